@@ -12,15 +12,24 @@ import re
 import random
 import string
 import io
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict, deque
 import time
 import json
 import threading
+import queue
+import concurrent.futures
+import multiprocessing
+import hashlib
+import weakref
+import math
+import unicodedata
+import array
+import itertools
 import signal
 import copy
 from pathlib import Path
 import shlex
-from typing import Awaitable, Callable, List, Optional, Set
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Set
 _PIL_AVAILABLE = False
 try:
     from PIL import Image, ImageDraw, ImageFont, ImageFilter
@@ -39,6 +48,10 @@ try:
 except Exception:  # pragma: no cover
     _REGEX_ENGINE = re
     _REGEX_ENGINE_NAME = "re"
+try:
+    import re2 as _re2_engine  # optional linear-time RE2 bindings (google-re2 or pyre2)
+except Exception:  # pragma: no cover
+    _re2_engine = None
 
 # Load environment variables from .env file
 dotenv.load_dotenv()
@@ -53,6 +66,8 @@ else:
 # Settings file path
 SETTINGS_FILE = "bot_settings.json"
 SECURITY_SETTINGS_FILE = "security_settings.json"
+# Large regex patterns are kept out of the settings JSON as content-addressed blobs
+REGEX_PATTERN_STORE_DIR = "regex_patterns"
 
 # Settings save/load functions
 def get_normalized_event_limits(event_data):
@@ -96,24 +111,21 @@ def save_settings():
         "account_age_timeout_duration": account_age_timeout_duration,
         "events": events,
         "event_nickname_limit": event_nickname_limit,
-        "scheduled_messages_by_guild": scheduled_messages_by_guild
+        "scheduled_messages_by_guild": scheduled_messages_by_guild,
+        "regex_modlog_channels": {str(guild_id): channel_id for guild_id, channel_id in regex_modlog_channels.items()}
     }
     
     # Convert regex settings to serializable format
     for guild_id, guild_rules in regex_settings_by_guild.items():
         settings["regex_settings_by_guild"][str(guild_id)] = {}
         for rule_name, rule_data in guild_rules.items():
-            settings["regex_settings_by_guild"][str(guild_id)][rule_name] = {
-                "pattern": rule_data.get("pattern", ""),
-                "channels": list(rule_data.get("channels", set())),
-                "exempt_users": list(rule_data.get("exempt_users", set())),
-                "exempt_roles": list(rule_data.get("exempt_roles", set()))
-            }
+            settings["regex_settings_by_guild"][str(guild_id)][rule_name] = _serialize_regex_rule(rule_data)
     
     try:
         with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(settings, f, indent=2, ensure_ascii=False)
         print(f"[SETTINGS] Settings saved to {SETTINGS_FILE}")
+        _prune_regex_pattern_store()
     except Exception as e:
         print(f"[SETTINGS] Error saving settings: {e}")
 
@@ -209,26 +221,67 @@ def load_settings():
             if normalized_schedules:
                 scheduled_messages_by_guild[guild_id] = normalized_schedules
         
+        regex_modlog_channels.clear()
+        for guild_id_raw, channel_id in settings.get("regex_modlog_channels", {}).items():
+            try:
+                regex_modlog_channels[int(guild_id_raw)] = int(channel_id)
+            except (TypeError, ValueError):
+                print(f"[SETTINGS] Skipping invalid regex mod-log channel for guild {guild_id_raw}")
+
         # Load regex settings and recompile patterns
         regex_data = settings.get("regex_settings_by_guild", {})
         for guild_id_str, guild_rules in regex_data.items():
             guild_id = int(guild_id_str)
+            for previous_rule in regex_settings_by_guild.get(guild_id, {}).values():
+                _release_compiled_pattern(previous_rule.get("compiled"))
             regex_settings_by_guild[guild_id] = {}
             for rule_name, rule_data in guild_rules.items():
-                pattern = rule_data.get("pattern", "")
+                if rule_data.get("kind") == "domains":
+                    domains = {
+                        domain for domain in map(_normalize_domain_entry, rule_data.get("domains", [])) if domain
+                    }
+                    regex_settings_by_guild[guild_id][rule_name] = {
+                        "quarantined": rule_data.get("quarantined"),
+                        "kind": "domains",
+                        "domain_mode": rule_data.get("domain_mode", "block") if rule_data.get("domain_mode") in DOMAIN_LIST_MODES else "block",
+                        "domains": frozenset(domains),
+                        "pattern": "",
+                        "input": rule_data.get("input") if rule_data.get("input") in RULE_INPUT_MODES else "raw",
+                        "channels": set(rule_data.get("channels", [])),
+                        "exempt_users": set(rule_data.get("exempt_users", [])),
+                        "exempt_roles": set(rule_data.get("exempt_roles", []))
+                    }
+                    continue
+                pattern_ref = rule_data.get("pattern_ref")
+                try:
+                    pattern = _read_regex_pattern(pattern_ref) if pattern_ref else rule_data.get("pattern", "")
+                except Exception as e:
+                    print(f"[SETTINGS] Error reading stored regex pattern {pattern_ref} for rule '{rule_name}': {e}")
+                    continue
                 if pattern:
                     try:
                         pattern_text, flags_letters = _parse_pattern_and_flags(pattern)
-                        compiled = _compile_with_flags(pattern_text, flags_letters)
+                        engine_choice = rule_data.get("engine") if rule_data.get("engine") in REGEX_ENGINE_CHOICES else "default"
+                        compiled = _acquire_compiled_pattern(pattern_text, flags_letters, engine_choice)
+                        pattern_fields = (
+                            {"pattern_ref": pattern_ref, "pattern_length": len(pattern)}
+                            if pattern_ref else _regex_pattern_fields(pattern)
+                        )
                         regex_settings_by_guild[guild_id][rule_name] = {
-                            "pattern": pattern,
+                            **pattern_fields,
                             "compiled": compiled,
+                            "engine": engine_choice,
+                            "literals": _interned_required_literals(compiled),
+                            "quarantined": rule_data.get("quarantined"),
+                            "input": rule_data.get("input") if rule_data.get("input") in RULE_INPUT_MODES else "raw",
                             "channels": set(rule_data.get("channels", [])),
                             "exempt_users": set(rule_data.get("exempt_users", [])),
                             "exempt_roles": set(rule_data.get("exempt_roles", []))
                         }
                     except Exception as e:
-                        print(f"[SETTINGS] Error recompiling regex pattern '{pattern}': {e}")
+                        print(f"[SETTINGS] Error recompiling regex pattern for rule '{rule_name}': {e}")
+            _rebuild_regex_channel_index(guild_id)
+            _invalidate_regex_rule_set(guild_id)
         
         print(f"[SETTINGS] Settings loaded successfully from {SETTINGS_FILE}")
         
@@ -308,8 +361,11 @@ async def _save_spam_violation_stats():
     loop = asyncio.get_running_loop()
     await loop.run_in_executor(None, _write_snapshot)
 
-async def record_spam_violation(guild_id, user_id, rule_key, label=""):
-    """Record a spam violation and update rolling aggregates."""
+async def record_spam_violation(guild_id, user_id, rule_key, label="", persist=True):
+    """Record a spam violation and update rolling aggregates.
+
+    Pass persist=False when recording a batch, and save once with _save_spam_violation_stats().
+    """
     global spam_stats_loaded
     if not spam_stats_loaded:
         load_spam_violation_stats()
@@ -336,7 +392,8 @@ async def record_spam_violation(guild_id, user_id, rule_key, label=""):
         rule_bucket["aggregates"] = _calculate_spam_aggregates(daily_counts)
         rule_bucket["last_updated"] = today_key
 
-    await _save_spam_violation_stats()
+    if persist:
+        await _save_spam_violation_stats()
 
 async def remove_spam_violation_stats_for_rule(guild_id, rule_key):
     """Remove stored violation statistics for a specific rule."""
@@ -370,6 +427,9 @@ def _reset_spam_history_for_rule(guild_id: int, rule_key: str) -> None:
     keys_to_delete = [key for key in spam_message_history if key[0] == guild_id]
     for history_key in keys_to_delete:
         spam_message_history.pop(history_key, None)
+        _drop_spam_history_caches(history_key)
+
+    spam_crossuser_indexes.pop((guild_id, rule_key), None)
 
     trigger_keys = [
         key for key in spam_rule_trigger_log
@@ -378,6 +438,8 @@ def _reset_spam_history_for_rule(guild_id: int, rule_key: str) -> None:
     for trigger_key in trigger_keys:
         spam_rule_trigger_log.pop(trigger_key, None)
 
+    _forget_rule_runtime(guild_id, "spam", rule_key)
+
 # ============== SECURITY SETTINGS PERSISTENCE ==============
 
 def save_security_settings():
@@ -388,12 +450,7 @@ def save_security_settings():
         for guild_id, guild_rules in regex_settings_by_guild.items():
             serializable_regex_settings[str(guild_id)] = {}
             for rule_name, rule_data in guild_rules.items():
-                serializable_regex_settings[str(guild_id)][rule_name] = {
-                    "pattern": rule_data.get("pattern", ""),
-                    "channels": list(rule_data.get("channels", set())),
-                    "exempt_users": list(rule_data.get("exempt_users", set())),
-                    "exempt_roles": list(rule_data.get("exempt_roles", set()))
-                }
+                serializable_regex_settings[str(guild_id)][rule_name] = _serialize_regex_rule(rule_data)
         
         # Serialize spam rules
         serializable_spam_rules = {}
@@ -415,21 +472,15 @@ def save_security_settings():
                     "nonreply_only": rule_data.get("nonreply_only", False),
                     "mod_action": rule_data.get("mod_action"),
                     "regex_pattern": rule_data.get("regex_pattern"),  # None for similarity mode
+                    "input": rule_data.get("input", "raw"),
+                    "cross_user": rule_data.get("cross_user", False),
                 }
 
         # Serialize spam message history
         serializable_spam_history = {}
         for (guild_id, user_id), entries in spam_message_history.items():
             key = f"{guild_id}:{user_id}"
-            serializable_spam_history[key] = [
-                {
-                    "timestamp": entry.get("timestamp", 0),
-                    "content": entry.get("content", ""),
-                    "is_reply": entry.get("is_reply", False),
-                    "channel_id": entry.get("channel_id"),
-                }
-                for entry in entries
-            ]
+            serializable_spam_history[key] = [entry.to_json() for entry in entries]
 
         # Serialize captcha panel texts
         serializable_panel_texts = {}
@@ -571,7 +622,11 @@ def load_security_settings():
         
         # Spam Settings
         spam_data = settings_data.get("spam_rules_by_guild", {})
+        for previous_rules in spam_rules_by_guild.values():
+            for previous_rule in previous_rules.values():
+                _release_compiled_pattern(previous_rule.get("compiled_regex"))
         spam_rules_by_guild.clear()
+        spam_rule_max_windows.clear()
         for guild_id_str, guild_rules in spam_data.items():
             try:
                 guild_id = int(guild_id_str)
@@ -599,37 +654,44 @@ def load_security_settings():
                         mod_action_value = None
                     # Load regex_pattern if present (None for similarity mode)
                     regex_pattern_value = rule_data.get("regex_pattern")
+                    compiled_regex_value = None
                     if regex_pattern_value is not None:
                         regex_pattern_value = str(regex_pattern_value)
-                        # Validate the regex pattern
+                        # Validate the regex pattern (compiling it once into the shared intern table)
                         try:
-                            re.compile(regex_pattern_value, re.IGNORECASE)
-                        except re.error:
+                            compiled_regex_value = _acquire_compiled_pattern(regex_pattern_value, "i", "re", fallback=False)
+                        except (re.error, _REGEX_ENGINE.error):
                             print(f"[SECURITY] Warning: Invalid regex pattern in rule '{rule_name}' for guild {guild_id_str}")
                             regex_pattern_value = None
 
-                    spam_rules_by_guild[guild_id][rule_name] = {
-                        "label": label,
-                        "min_length": max(0, min_length),
-                        "similarity_threshold": max(0.0, min(similarity_threshold, 1.0)),
-                        "time_window": max(0, time_window),
-                        "message_count": max(0, message_count),
-                        "dm_message": dm_message,
-                        "notify_channel_id": notify_channel_id,
-                        "channels": set(rule_data.get("channels", [])),
-                        "excluded_channels": set(rule_data.get("excluded_channels", [])),
-                        "targeted_roles": set(rule_data.get("targeted_roles", [])),
-                        "exempted_roles": set(rule_data.get("exempted_roles", [])),
-                        "nonreply_only": _coerce_bool(rule_data.get("nonreply_only", False)),
-                        "mod_action": mod_action_value,
-                        "regex_pattern": regex_pattern_value,
-                    }
+                    spam_rules_by_guild[guild_id][rule_name] = _compile_spam_rule(
+                        label=label,
+                        min_length=min_length,
+                        similarity_threshold=similarity_threshold,
+                        time_window=time_window,
+                        message_count=message_count,
+                        dm_message=dm_message,
+                        notify_channel_id=notify_channel_id,
+                        channels=rule_data.get("channels", []),
+                        excluded_channels=rule_data.get("excluded_channels", []),
+                        targeted_roles=rule_data.get("targeted_roles", []),
+                        exempted_roles=rule_data.get("exempted_roles", []),
+                        nonreply_only=_coerce_bool(rule_data.get("nonreply_only", False)),
+                        mod_action=mod_action_value,
+                        regex_pattern=regex_pattern_value,
+                        compiled_regex=compiled_regex_value,
+                        input_mode=rule_data.get("input", "raw"),
+                        cross_user=_coerce_bool(rule_data.get("cross_user", False)),
+                    )
                 except Exception as e:
                     print(f"[SECURITY] Warning: Could not load spam rule '{rule_name}' for guild {guild_id_str}: {e}")
+            _refresh_spam_rule_caches(guild_id)
 
         # Load spam message history
         history_data = settings_data.get("spam_message_history", {})
         spam_message_history.clear()
+        spam_similarity_indexes.clear()
+        spam_regex_running_counts.clear()
         now = time.time()
         # Calculate max_history_window from actual spam rules
         max_rule_window = 0
@@ -641,6 +703,7 @@ def load_security_settings():
         # Use rule-based window with buffer, minimum 24h
         max_history_window = max(max_rule_window + 3600, 86400)
         loaded_history_count = 0
+        loaded_histories = []
         for key, entries in history_data.items():
             try:
                 guild_id_str, user_id_str = key.split(":")
@@ -649,21 +712,25 @@ def load_security_settings():
                 history_key = (guild_id, user_id)
                 # Only load entries within max_history_window
                 valid_entries = [
-                    {
-                        "timestamp": entry.get("timestamp", 0),
-                        "content": entry.get("content", ""),
-                        "is_reply": entry.get("is_reply", False),
-                        "channel_id": entry.get("channel_id"),
-                        "tokens": None,  # Will be regenerated when needed
-                    }
+                    SpamHistoryEntry(
+                        entry.get("timestamp", 0),
+                        entry.get("content", "") or "",
+                        bool(entry.get("is_reply", False)),
+                        entry.get("channel_id"),
+                    )
                     for entry in entries
                     if now - entry.get("timestamp", 0) <= max_history_window
                 ]
                 if valid_entries:
-                    spam_message_history[history_key] = valid_entries
+                    valid_entries.sort(key=lambda entry: entry.timestamp)
+                    loaded_histories.append((history_key, deque(valid_entries)))
                     loaded_history_count += len(valid_entries)
             except (ValueError, KeyError) as e:
                 print(f"[SECURITY] Warning: Could not load spam history entry '{key}': {e}")
+        # Least recently active users first, so the entry cap evicts them first
+        loaded_histories.sort(key=lambda item: item[1][-1].timestamp)
+        for history_key, user_history in loaded_histories:
+            spam_message_history[history_key] = user_history
 
         # Verify button usage
         usage_data = settings_data.get("verify_button_usage", {})
@@ -852,6 +919,21 @@ def _parse_role_ids(env_value: str | None) -> Set[int]:
             print(f"⚠️  WARNING: Invalid role ID entry ignored: {token!r}")
     return ids
 
+def _parse_env_number(name: str, default, cast=int):
+    """Read a numeric setting from the environment, falling back to default."""
+    raw = os.getenv(name)
+    if raw is None or not raw.strip():
+        return default
+    try:
+        value = cast(raw.strip())
+    except ValueError:
+        print(f"⚠️  WARNING: Invalid value for {name} ignored: {raw!r}")
+        return default
+    if value <= 0:
+        print(f"⚠️  WARNING: {name} must be positive, using default {default}")
+        return default
+    return value
+
 # Function to extract regex from markdown code blocks
 def _extract_regex_from_codeblock(text: str) -> str | None:
     """Extract regex pattern from markdown code block (``` or `)"""
@@ -901,7 +983,7 @@ def _parse_pattern_and_flags(raw_text):
     return text, letters
 
 
-def _compile_with_flags(pattern_text, flags_letters):
+def _regex_flags_value(flags_letters) -> int:
     flag_map = {
         "i": re.IGNORECASE,
         "m": re.MULTILINE,
@@ -914,7 +996,89 @@ def _compile_with_flags(pattern_text, flags_letters):
     flags_value = 0
     for ch in flags_letters or "":
         flags_value |= flag_map.get(ch.lower(), 0)
-    return _REGEX_ENGINE.compile(pattern_text, flags_value)
+    return flags_value
+
+
+def _compile_with_flags(pattern_text, flags_letters, engine_choice=None):
+    return _compile_regex_for_engine(pattern_text, _regex_flags_value(flags_letters), engine_choice)
+
+# ============== REGEX ENGINE BACKENDS ==============
+
+# Flags RE2 understands as inline (?ims) modifiers; verbose, ASCII and locale modes have no equivalent
+_RE2_INLINE_FLAGS = {re.IGNORECASE: "i", re.MULTILINE: "m", re.DOTALL: "s"}
+
+
+class _RE2Pattern:
+    """RE2 pattern exposing the re-style attributes the evaluation, sandbox and prefilter code read.
+
+    RE2 matches in time linear in the input and never backtracks, so it needs no native timeout.
+    """
+    __slots__ = ("_compiled", "pattern", "flags", "__weakref__")
+
+    def __init__(self, pattern_text: str, flags_value: int):
+        unsupported = flags_value & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE)
+        if unsupported:
+            raise re.error(f"RE2 does not support flags {re.RegexFlag(unsupported)!r}")
+        letters = "".join(letter for flag, letter in _RE2_INLINE_FLAGS.items() if flags_value & flag)
+        try:
+            compiled = _re2_engine.compile(f"(?{letters}){pattern_text}" if letters else pattern_text)
+        except Exception as exc:
+            raise re.error(f"RE2: {exc}") from None
+        if isinstance(compiled, re.Pattern):
+            # pyre2 quietly hands syntax RE2 lacks (lookarounds, backreferences) to the stdlib
+            raise re.error("RE2 does not support this pattern's syntax")
+        self._compiled = compiled
+        self.pattern = pattern_text
+        self.flags = int(flags_value | re.UNICODE)
+
+    def search(self, text):
+        return self._compiled.search(text)
+
+    def finditer(self, text):
+        return self._compiled.finditer(text)
+
+
+def _compile_on_engine(engine_name: str, pattern_text: str, flags_value: int):
+    """Compile on exactly one engine. Raises re.error (or the engine's error) if it cannot."""
+    if engine_name == "re2":
+        if _re2_engine is None:
+            raise re.error("RE2 bindings are not installed (pip install google-re2)")
+        return _RE2Pattern(pattern_text, flags_value)
+    if engine_name == "regex":
+        if _REGEX_ENGINE_NAME != "regex":
+            raise re.error("the 'regex' module is not installed")
+        return _REGEX_ENGINE.compile(pattern_text, flags_value)
+    return re.compile(pattern_text, flags_value)
+
+
+def _regex_engine_fallbacks(engine_choice=None) -> tuple:
+    """Engines to try for a rule's engine choice, preferred engine first."""
+    preferred = REGEX_DEFAULT_ENGINE if engine_choice in (None, "default") else engine_choice
+    return tuple(dict.fromkeys((preferred, _REGEX_ENGINE_NAME, "re")))
+
+
+def _compile_regex_for_engine(pattern_text, flags_value: int, engine_choice=None):
+    """Compile on the rule's preferred engine, falling back when it rejects the pattern's syntax.
+
+    Raises the default engine's error when no engine accepts the pattern.
+    """
+    errors = {}
+    for engine_name in _regex_engine_fallbacks(engine_choice):
+        try:
+            return _compile_on_engine(engine_name, pattern_text, flags_value)
+        except (re.error, _REGEX_ENGINE.error) as exc:
+            errors[engine_name] = exc
+    raise errors.get(_REGEX_ENGINE_NAME) or errors["re"]
+
+
+def _describe_regex_rule_engine(rule: dict) -> str:
+    """Engine a rule runs on, noting when it fell back from the engine it asked for."""
+    compiled = rule.get("compiled")
+    if compiled is None:
+        return "-"
+    actual = _pattern_engine_name(compiled)
+    preferred = _regex_engine_fallbacks(rule.get("engine"))[0]
+    return actual if actual == preferred else f"{actual} (fallback from {preferred})"
 
 def string_similarity(s1, s2):
     # Convert both strings to lowercase for case-insensitive comparison
@@ -984,9 +1148,110 @@ CAPTCHA_RATE_LIMIT_MESSAGE_COOLDOWN = 60  # Show captcha rate limit message once
 # Structure: { guild_id: { name: {"pattern": str, "compiled": Pattern, "channels": set[int], "exempt_users": set[int], "exempt_roles": set[int]} } }
 regex_settings_by_guild = {}
 
+# Rule-set version per guild; bumped whenever !regex, !setregexsettings or !delregexsettings change rules
+regex_rule_set_versions = defaultdict(int)
+
+# Routing index per guild: { guild_id: { channel_id: (rule key, ...) } }
+regex_channel_index = {}
+
+# Combined single-pass matchers per guild: { guild_id: OrderedDict[(version, rule keys) -> CombinedRegexMatcher] }
+regex_combined_matchers = {}
+REGEX_COMBINED_MATCHER_CACHE_SIZE = 32
+
+# Literal prefilters per guild: { guild_id: (rule set version, RegexLiteralPrefilter) }
+regex_prefilters = {}
+# Prefilter counters per guild (messages fully skipped and rules skipped without running a regex)
+regex_prefilter_stats = defaultdict(lambda: {"messages": 0, "messages_skipped": 0, "rules_considered": 0, "rules_skipped": 0})
+
+# Verdict caches per guild: { guild_id: RegexVerdictCache } keyed by a digest of the scanned text blocks
+regex_verdict_caches = {}
+REGEX_VERDICT_CACHE_SIZE = _parse_env_number("REGEX_VERDICT_CACHE_SIZE", 2048, int)
+REGEX_VERDICT_CACHE_TTL_SECONDS = _parse_env_number("REGEX_VERDICT_CACHE_TTL", 300.0, float)
+
+# Short-lived scan fingerprints: OrderedDict[message_id -> (rule set version, text digest, expires_at)]
+# Lets on_message_edit skip edits that only attach embeds/snapshots without changing scanned text
+regex_scan_fingerprints = OrderedDict()
+REGEX_SCAN_FINGERPRINT_LIMIT = _parse_env_number("REGEX_SCAN_FINGERPRINT_LIMIT", 20000, int)
+REGEX_SCAN_FINGERPRINT_TTL_SECONDS = _parse_env_number("REGEX_SCAN_FINGERPRINT_TTL", 900.0, float)
+regex_edit_scan_stats = {"edits": 0, "edits_skipped": 0}
+
+# Define-time profiling for !regex / !setregexsettings
+# REGEX_PROFILE_MODE: "reject" (block catastrophic patterns), "warn" (report only) or "off"
+REGEX_PROFILE_MODE = os.getenv("REGEX_PROFILE_MODE", "reject").strip().lower()
+if REGEX_PROFILE_MODE not in {"reject", "warn", "off"}:
+    print(f"⚠️  WARNING: Unknown REGEX_PROFILE_MODE {REGEX_PROFILE_MODE!r}, using 'reject'")
+    REGEX_PROFILE_MODE = "reject"
+REGEX_PROFILE_BUDGET_SECONDS = _parse_env_number("REGEX_PROFILE_BUDGET", 5.0, float)
+REGEX_PROFILE_SUPERLINEAR_EXPONENT = 1.5  # Growth exponent (time ~ n^k) treated as likely backtracking
+REGEX_PROFILE_SLOW_FRACTION = 0.2  # Warn when p99 uses this share of the evaluation timeout
+
+# Per-rule regex counters: { guild_id: { rule key: RegexRuleCounters } }
+regex_rule_counters = defaultdict(dict)
+
+# Per-rule CPU budget: a rule that spends more than its budget (or keeps timing out) within
+# the rolling window is quarantined until re-enabled with !regexenable
+REGEX_RULE_CPU_BUDGET_SECONDS = _parse_env_number("REGEX_RULE_CPU_BUDGET", 5.0, float)
+REGEX_RULE_BUDGET_WINDOW_SECONDS = _parse_env_number("REGEX_RULE_BUDGET_WINDOW", 60.0, float)
+REGEX_RULE_MAX_TIMEOUTS = _parse_env_number("REGEX_RULE_MAX_TIMEOUTS", 3, int)
+REGEX_RULE_BUDGET_BUCKETS = 12  # Rolling window resolution
+# { (guild_id, rule key or combined unit key): deque[[bucket start, cpu seconds, timeouts]] }
+regex_rule_budgets = {}
+# Guilds with a standalone measurement of combined rules in progress (see _measure_regex_rules_standalone)
+regex_standalone_measurements: Set[int] = set()
+# Every Nth combined scan per guild also times its rules one by one, so !regexstats has real per-rule numbers
+REGEX_STATS_SAMPLE_EVERY = max(1, _parse_env_number("REGEX_STATS_SAMPLE_EVERY", 50, int))
+regex_combined_scan_counts = defaultdict(int)
+# Mod-log channel per guild for regex notices: { guild_id: channel_id }
+regex_modlog_channels = {}
+
+# Rule evaluation planner: { (guild_id, "regex"|"spam", unit key): RuleRuntimeStats }
+rule_runtime_stats = {}
+RULE_PLANNER_EWMA_ALPHA = 0.1  # Weight of the newest observation in cost/match-rate averages
+RULE_PLANNER_MIN_MATCH_RATE = 0.001  # Floor so never-matching rules still rank by cost
+
+# Regex evaluation limits (matching runs on a shared worker pool, never on the event loop)
+REGEX_EVAL_TIMEOUT_SECONDS = _parse_env_number("REGEX_EVAL_TIMEOUT", 1.0, float)
+REGEX_EVAL_WORKERS = _parse_env_number("REGEX_EVAL_WORKERS", 4, int)
+REGEX_EVAL_GUILD_CONCURRENCY = _parse_env_number("REGEX_EVAL_GUILD_CONCURRENCY", 2, int)
+REGEX_MAX_TEXT_LENGTH = 10000  # Longer text blocks are truncated before matching
+# "thread" (default) or "process": process mode runs matching in killable worker processes
+REGEX_ISOLATION_MODE = os.getenv("REGEX_ISOLATION_MODE", "thread").strip().lower()
+if REGEX_ISOLATION_MODE not in {"thread", "process"}:
+    print(f"⚠️  WARNING: Unknown REGEX_ISOLATION_MODE {REGEX_ISOLATION_MODE!r}, using 'thread'")
+    REGEX_ISOLATION_MODE = "thread"
+# Compiled patterns each sandbox worker keeps; the least recently used one is dropped beyond this
+REGEX_SANDBOX_MAX_PATTERNS = max(1, _parse_env_number("REGEX_SANDBOX_MAX_PATTERNS", 256, int))
+# !regexscan: retroactive history scans, one at a time per guild
+REGEX_HISTORY_SCAN_MAX_MESSAGES = _parse_env_number("REGEX_HISTORY_SCAN_MAX_MESSAGES", 10000, int)
+REGEX_HISTORY_SCAN_PROGRESS_SECONDS = 5.0  # Minimum gap between progress edits
+regex_history_scans: Set[int] = set()
+# Rule-triggered deletions are coalesced per channel for this long and sent as bulk deletes (0 disables)
+MESSAGE_DELETE_COALESCE_SECONDS = _parse_env_number("MESSAGE_DELETE_COALESCE_SECONDS", 0.5, float)
+# Discord only bulk-deletes messages younger than 14 days; keep a margin for clock skew
+BULK_DELETE_MAX_AGE_SECONDS = 14 * 86400 - 300
+BULK_DELETE_BATCH = 100  # API maximum per bulk delete
+# Engine per regex rule: "default" follows REGEX_DEFAULT_ENGINE; rules fall back to the
+# backtracking engines when the chosen one rejects their syntax (e.g. RE2 and lookarounds)
+REGEX_ENGINE_CHOICES = ("default", "re2", "regex", "re")
+REGEX_AVAILABLE_ENGINES = (("re2",) if _re2_engine is not None else ()) + tuple(dict.fromkeys((_REGEX_ENGINE_NAME, "re")))
+REGEX_DEFAULT_ENGINE = os.getenv("REGEX_DEFAULT_ENGINE", _REGEX_ENGINE_NAME).strip().lower()
+if REGEX_DEFAULT_ENGINE not in REGEX_AVAILABLE_ENGINES:
+    print(f"⚠️  WARNING: REGEX_DEFAULT_ENGINE {REGEX_DEFAULT_ENGINE!r} is not available, using {_REGEX_ENGINE_NAME!r}")
+    REGEX_DEFAULT_ENGINE = _REGEX_ENGINE_NAME
+
 # Spam moderation settings per guild
 # Structure: { guild_id: { name: {"min_length": int, "similarity_threshold": float, "time_window": int, "message_count": int, "dm_message": str, "notify_channel_id": int, "channels": set[int], "nonreply_only": bool, "mod_action": str | None} } }
 spam_rules_by_guild = {}
+# Largest time_window per guild, refreshed whenever its spam rules change: { guild_id: seconds }
+spam_rule_max_windows = {}
+# Spam history bounds: total entries across all users (least recently active users are evicted
+# whole), idle time before a quiet user's history is dropped (0: the guild's longest rule window)
+SPAM_HISTORY_MAX_ENTRIES = _parse_env_number("SPAM_HISTORY_MAX_ENTRIES", 200000, int)
+SPAM_HISTORY_IDLE_TTL_SECONDS = _parse_env_number("SPAM_HISTORY_IDLE_TTL", 0.0, float)
+SPAM_HISTORY_SWEEP_SECONDS = _parse_env_number("SPAM_HISTORY_SWEEP_INTERVAL", 60.0, float)
+# History entries keep this many characters of the message for similarity (regex rules see the full current message)
+SPAM_HISTORY_CONTENT_LIMIT = _parse_env_number("SPAM_HISTORY_CONTENT_LIMIT", 512, int)
+SPAM_HISTORY_INTERN_LIMIT = _parse_env_number("SPAM_HISTORY_INTERN_LIMIT", 50000, int)  # Recently seen strings shared between entries
 
 # Security Authorization
 # Load security role ID from environment variable for better security
@@ -1130,14 +1395,821 @@ SPAM_RULE_PREDEFINED_WINDOWS = {
     "360d": 360 * 86400,
 }
 
-# Runtime spam tracking (not persisted)
-# Key: (guild_id, user_id) -> list[{"timestamp": float, "content": str}]
-spam_message_history = defaultdict(list)
+# Bounded intern tables (least recently used dropped first, unlike sys.intern which pins
+# every string): common words share one string object, and repeated message texts share
+# their content string and token multiset across history entries.
+_spam_history_tokens = OrderedDict()  # token -> token
+_spam_history_texts = OrderedDict()  # content -> (content, token counts)
+
+
+def _intern_bounded(table: OrderedDict, key, value):
+    shared = table.get(key)
+    if shared is not None:
+        table.move_to_end(key)
+        return shared
+    table[key] = value
+    if len(table) > SPAM_HISTORY_INTERN_LIMIT:
+        table.popitem(last=False)
+    return value
+
+
+def _spam_history_token_counts(text: str) -> tuple:
+    """(sorted unique tokens, count per token as bytes) of text: a compact token multiset."""
+    counts = Counter(_extract_word_tokens(text))
+    tokens = tuple(sorted(counts))
+    return (
+        tuple(_intern_bounded(_spam_history_tokens, token, token) for token in tokens),
+        bytes(min(counts[token], 255) for token in tokens),
+    )
+
+
+def _spam_history_text(text: str) -> tuple:
+    """Shared (content, token counts) for text, tokenized only the first time it is seen."""
+    shared = _spam_history_texts.get(text)
+    if shared is None:
+        shared = (text, _spam_history_token_counts(text))
+    return _intern_bounded(_spam_history_texts, text, shared)
+
+
+class SpamHistoryEntry:
+    """One message in a user's spam history.
+
+    Content is truncated to SPAM_HISTORY_CONTENT_LIMIT characters and interned, and tokens are
+    kept as a token -> count multiset rather than a token list. The folded view, MinHash
+    signatures and the regex memo are filled in lazily by the rules that need them.
+    """
+
+    __slots__ = ("timestamp", "channel_id", "flags", "content", "token_counts", "folded", "minhash", "folded_minhash", "regex_memo")
+
+    FLAG_REPLY = 1
+
+    def __init__(self, timestamp: float, content: str, is_reply: bool = False, channel_id: Optional[int] = None):
+        self.timestamp = float(timestamp)
+        self.channel_id = channel_id
+        self.flags = self.FLAG_REPLY if is_reply else 0
+        self.content, self.token_counts = _spam_history_text(content[:SPAM_HISTORY_CONTENT_LIMIT])
+        self.folded = None  # (content, token counts) once a folded rule looks at the entry
+        self.minhash = None
+        self.folded_minhash = None
+        self.regex_memo = None  # [epoch, evaluated bits, matched bits], see _spam_regex_memo_lookup
+
+    @property
+    def is_reply(self) -> bool:
+        return bool(self.flags & self.FLAG_REPLY)
+
+    def view(self, input_mode: str) -> tuple:
+        """(content, token counts) in the given input mode."""
+        if input_mode != "folded":
+            return self.content, self.token_counts
+        folded = self.folded
+        if folded is None:
+            content = _fold_message_text(self.content)
+            folded = (self.content, self.token_counts) if content == self.content else _spam_history_text(content)
+            self.folded = folded
+        return folded
+
+    def to_json(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "content": self.content,
+            "is_reply": self.is_reply,
+            "channel_id": self.channel_id,
+        }
+
+
+class SpamHistoryStore:
+    """Per-user spam history with an idle TTL and a global entry cap.
+
+    Maps (guild_id, user_id) -> deque of history entries, oldest first. Users are kept in
+    order of their last message, so the cap evicts the least recently active users whole.
+    All changes to a user's history go through record()/remove_entries() so the entry total
+    stays exact; evicted users also lose their similarity indexes and regex running counts.
+    """
+
+    def __init__(self, max_entries: int, idle_ttl_seconds: float):
+        self.max_entries = max(1, max_entries)
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._users = OrderedDict()  # (guild_id, user_id) -> deque, least recently active first
+        self.entry_count = 0
+        self.expired_entries = 0
+        self.idle_evictions = 0
+        self.lru_evictions = 0
+        self.trimmed_entries = 0
+        self.sweeps = 0
+        self.last_sweep_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, history_key) -> bool:
+        return history_key in self._users
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def items(self):
+        return self._users.items()
+
+    def get(self, history_key, default=None):
+        return self._users.get(history_key, default)
+
+    def __setitem__(self, history_key, entries: deque) -> None:
+        """Install a user's history as is (loading); entries must be in time order."""
+        self.pop(history_key)
+        self._users[history_key] = entries
+        self.entry_count += len(entries)
+
+    def pop(self, history_key, default=None):
+        entries = self._users.pop(history_key, None)
+        if entries is None:
+            return default
+        self.entry_count -= len(entries)
+        return entries
+
+    def clear(self) -> None:
+        self._users.clear()
+        self.entry_count = 0
+
+    def idle_limit(self, guild_id: int) -> float:
+        """Seconds a user of this guild may stay quiet before their history is dropped."""
+        window = spam_rule_max_windows.get(guild_id, 0)
+        if self.idle_ttl_seconds > 0:
+            return min(window, self.idle_ttl_seconds)
+        return window
+
+    def _evict(self, history_key) -> None:
+        self.pop(history_key)
+        _drop_spam_history_caches(history_key)
+
+    def record(self, history_key, entry: SpamHistoryEntry, max_window: float) -> deque:
+        """Expire the user's entries older than max_window, append entry and enforce the cap."""
+        user_history = self._users.get(history_key)
+        if user_history is None:
+            user_history = self._users[history_key] = deque()
+        else:
+            self._users.move_to_end(history_key)
+        now = entry.timestamp
+        if max_window > 0:
+            # Entries arrive in time order, so expired ones are always at the head: amortized O(1) per message
+            while user_history and now - user_history[0].timestamp > max_window:
+                user_history.popleft()
+                self.entry_count -= 1
+                self.expired_entries += 1
+        elif user_history:
+            self.entry_count -= len(user_history)
+            user_history.clear()
+            _drop_spam_history_caches(history_key)
+        user_history.append(entry)
+        self.entry_count += 1
+
+        while self.entry_count > self.max_entries and len(self._users) > 1:
+            oldest_key = next(iter(self._users))
+            self._evict(oldest_key)
+            self.lru_evictions += 1
+        while self.entry_count > self.max_entries and len(user_history) > 1:
+            # A single user over the whole cap loses their oldest entries, like an expiry
+            user_history.popleft()
+            self.entry_count -= 1
+            self.trimmed_entries += 1
+        return user_history
+
+    def remove_entries(self, history_key, entries: list) -> None:
+        """Remove specific entries (e.g. deleted messages) from anywhere in a user's history."""
+        user_history = self._users.get(history_key)
+        if not user_history or not entries:
+            return
+        kept_entries = [entry for entry in user_history if not any(entry is removed for removed in entries)]
+        self.entry_count -= len(user_history) - len(kept_entries)
+        user_history.clear()
+        user_history.extend(kept_entries)
+        _forget_spam_history_entries(history_key, entries)
+
+    def sweep(self, now: float) -> int:
+        """Drop users idle for longer than their guild's limit. Returns the number of users dropped."""
+        started = time.perf_counter()
+        idle_keys = []
+        for history_key, user_history in self._users.items():
+            if not user_history or now - user_history[-1].timestamp > self.idle_limit(history_key[0]):
+                idle_keys.append(history_key)
+        for history_key in idle_keys:
+            self._evict(history_key)
+        self.idle_evictions += len(idle_keys)
+        self.sweeps += 1
+        self.last_sweep_seconds = time.perf_counter() - started
+        return len(idle_keys)
+
+
+# Runtime spam tracking (persisted with the security settings)
+# Key: (guild_id, user_id) -> deque[SpamHistoryEntry], oldest first
+spam_message_history = SpamHistoryStore(SPAM_HISTORY_MAX_ENTRIES, SPAM_HISTORY_IDLE_TTL_SECONDS)
+spam_history_sweeper_task: Optional[asyncio.Task] = None
+
+
+async def _spam_history_sweeper() -> None:
+    """Periodically drop the spam history of users who went quiet."""
+    while not bot.is_closed():
+        await asyncio.sleep(max(SPAM_HISTORY_SWEEP_SECONDS, 1.0))
+        try:
+            now = time.time()
+            for index in list(spam_crossuser_indexes.values()):
+                index.expire(now)
+            dropped = spam_message_history.sweep(now)
+            if dropped:
+                print(f"[SPAM] History sweep dropped {dropped} idle users ({len(spam_message_history)} users, {spam_message_history.entry_count} entries kept)")
+        except Exception as exc:
+            print(f"[SPAM] History sweep failed: {exc}")
+
+
+def start_spam_history_sweeper() -> None:
+    global spam_history_sweeper_task
+    if spam_history_sweeper_task is not None and not spam_history_sweeper_task.done():
+        return
+    spam_history_sweeper_task = bot.loop.create_task(_spam_history_sweeper())
 
 # Last trigger timestamps to prevent duplicate alerts within the window
 # Key: (guild_id, user_id, rule_name) -> float
 spam_rule_trigger_log = {}
 
+# ============== COMPILED PATTERN INTERNING ==============
+
+# Process-wide compiled patterns shared by every rule/guild using the same source:
+# { (sha256 of pattern, flags, engine): [compiled, refcount, required literals] }
+regex_pattern_intern = {}
+_interned_pattern_keys = {}  # id(compiled) -> intern key
+regex_pattern_intern_stats = {"compiles": 0, "hits": 0}
+_LITERALS_NOT_COMPUTED = object()
+
+
+def _acquire_compiled_pattern(pattern_text: str, flags_letters: str, engine_choice=None, fallback: bool = True):
+    """Return the shared compiled pattern for (pattern_text, flags, engine), compiling it only the first time.
+
+    With fallback=False the pattern is compiled on exactly the chosen engine and never
+    handed a pattern another engine compiled. Every acquire must be paired with
+    _release_compiled_pattern when the rule drops the pattern.
+    Raises the engine's error for invalid patterns, like _compile_with_flags.
+    """
+    flags_value = _regex_flags_value(flags_letters)
+    pattern_hash = hashlib.sha256(pattern_text.encode("utf-8", "surrogatepass")).hexdigest()
+    engine_name = _regex_engine_fallbacks(engine_choice)[0]
+    key = (pattern_hash, flags_value, engine_name if fallback else f"{engine_name} only")
+    entry = regex_pattern_intern.get(key)
+    if entry is not None:
+        entry[1] += 1
+        regex_pattern_intern_stats["hits"] += 1
+        return entry[0]
+    if fallback:
+        compiled = _compile_regex_for_engine(pattern_text, flags_value, engine_choice)
+    else:
+        compiled = _compile_on_engine(engine_name, pattern_text, flags_value)
+    regex_pattern_intern[key] = [compiled, 1, _LITERALS_NOT_COMPUTED]
+    _interned_pattern_keys[id(compiled)] = key
+    regex_pattern_intern_stats["compiles"] += 1
+    return compiled
+
+
+def _release_compiled_pattern(compiled_pattern) -> None:
+    """Drop one reference to an interned pattern; the last release frees it."""
+    if compiled_pattern is None:
+        return
+    key = _interned_pattern_keys.get(id(compiled_pattern))
+    entry = regex_pattern_intern.get(key) if key is not None else None
+    if entry is None or entry[0] is not compiled_pattern:
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        del regex_pattern_intern[key]
+        del _interned_pattern_keys[id(compiled_pattern)]
+
+
+def _interned_required_literals(compiled_pattern) -> frozenset | None:
+    """Required literals of a pattern, extracted once per interned pattern."""
+    key = _interned_pattern_keys.get(id(compiled_pattern))
+    entry = regex_pattern_intern.get(key) if key is not None else None
+    if entry is None or entry[0] is not compiled_pattern:
+        return _extract_required_literals(compiled_pattern)
+    if entry[2] is _LITERALS_NOT_COMPUTED:
+        entry[2] = _extract_required_literals(compiled_pattern)
+    return entry[2]
+
+# ============== REGEX PATTERN STORE ==============
+
+REGEX_PATTERN_INLINE_LIMIT = _parse_env_number("REGEX_PATTERN_INLINE_LIMIT", 4096, int)  # Characters
+_PATTERN_BLOB_NAME = re.compile(r"[0-9a-f]{64}\.txt")
+
+
+def _pattern_blob_path(digest: str) -> Path:
+    return Path(REGEX_PATTERN_STORE_DIR) / f"{digest}.txt"
+
+
+def _store_regex_pattern(pattern: str) -> str:
+    """Write pattern as a content-addressed blob (once) and return its reference 'sha256:<hex>'."""
+    data = pattern.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    path = _pattern_blob_path(digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return f"sha256:{digest}"
+
+
+def _read_regex_pattern(pattern_ref: str) -> str:
+    """Read a stored pattern and verify it against its hash."""
+    algorithm, _, digest = (pattern_ref or "").partition(":")
+    if algorithm != "sha256" or not re.fullmatch(r"[0-9a-f]{64}", digest):
+        raise ValueError(f"invalid pattern reference {pattern_ref!r}")
+    data = _pattern_blob_path(digest).read_bytes()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"pattern blob {digest[:12]} is corrupted")
+    return data.decode("utf-8")
+
+
+def _regex_pattern_fields(pattern: str) -> dict:
+    """Rule fields for a pattern: inline 'pattern' when small, 'pattern_ref' (+ size) when large."""
+    if len(pattern) <= REGEX_PATTERN_INLINE_LIMIT:
+        return {"pattern": pattern}
+    return {"pattern_ref": _store_regex_pattern(pattern), "pattern_length": len(pattern)}
+
+
+def _regex_rule_pattern_text(rule: dict) -> str:
+    """Full pattern text of a rule, loading it from the store if it is kept out of line."""
+    if rule.get("pattern_ref"):
+        return _read_regex_pattern(rule["pattern_ref"])
+    return rule.get("pattern", "")
+
+
+def _serialize_regex_rule(rule_data: dict) -> dict:
+    """JSON form of one regex/domain rule, shared by bot_settings.json and security_settings.json."""
+    serialized = {
+        "channels": list(rule_data.get("channels", set())),
+        "exempt_users": list(rule_data.get("exempt_users", set())),
+        "exempt_roles": list(rule_data.get("exempt_roles", set())),
+        "input": rule_data.get("input", "raw"),
+    }
+    if rule_data.get("pattern_ref"):
+        serialized["pattern_ref"] = rule_data["pattern_ref"]
+    else:
+        serialized["pattern"] = rule_data.get("pattern", "")
+    if rule_data.get("quarantined"):
+        serialized["quarantined"] = rule_data["quarantined"]
+    if rule_data.get("engine", "default") != "default":
+        serialized["engine"] = rule_data["engine"]
+    if rule_data.get("kind") == "domains":
+        serialized.update({
+            "kind": "domains",
+            "domain_mode": rule_data.get("domain_mode", "block"),
+            "domains": sorted(rule_data.get("domains", ())),
+        })
+    return serialized
+
+
+def _prune_regex_pattern_store() -> None:
+    """Delete blobs that no rule references any more."""
+    store_dir = Path(REGEX_PATTERN_STORE_DIR)
+    if not store_dir.is_dir():
+        return
+    referenced = {
+        rule["pattern_ref"].partition(":")[2]
+        for guild_rules in regex_settings_by_guild.values()
+        for rule in guild_rules.values()
+        if rule.get("pattern_ref")
+    }
+    for path in store_dir.iterdir():
+        if _PATTERN_BLOB_NAME.fullmatch(path.name) and path.stem not in referenced:
+            try:
+                path.unlink()
+            except OSError as e:
+                print(f"[SETTINGS] Could not remove unused pattern blob {path.name}: {e}")
+
+# ============== COMPILED SPAM RULES ==============
+
+class SpamRule(NamedTuple):
+    """Immutable spam rule, built once by !spamrule or load_security_settings.
+
+    Scope sets are frozensets and the regex is compiled up front, so evaluating a message
+    only reads attributes. get() keeps dict-style reads working for listings and persistence.
+    """
+    label: str
+    min_length: int
+    similarity_threshold: float
+    time_window: int
+    message_count: int
+    dm_message: str
+    notify_channel_id: Optional[int]
+    channels: frozenset
+    excluded_channels: frozenset
+    targeted_roles: frozenset
+    exempted_roles: frozenset
+    nonreply_only: bool
+    mod_action: Optional[str]
+    regex_pattern: Optional[str]  # None for similarity mode
+    compiled_regex: object  # Interned pattern for regex mode (see _acquire_compiled_pattern), else None
+    input: str  # "raw" or "folded", see !ruleinput
+    evaluable: bool  # Window, count and a regex or similarity threshold are all set
+    trigger_cooldown: int = 0
+    cross_user: bool = False  # message_count counts distinct users posting the same content, see SpamFingerprintIndex
+
+    def get(self, field: str, default=None):
+        return getattr(self, field, default)
+
+
+def _compile_spam_rule(
+    label: str,
+    min_length: int,
+    similarity_threshold: float,
+    time_window: int,
+    message_count: int,
+    dm_message: str,
+    notify_channel_id: Optional[int],
+    channels=(),
+    excluded_channels=(),
+    targeted_roles=(),
+    exempted_roles=(),
+    nonreply_only: bool = False,
+    mod_action: Optional[str] = None,
+    regex_pattern: Optional[str] = None,
+    compiled_regex=None,
+    input_mode: str = "raw",
+    cross_user: bool = False,
+) -> SpamRule:
+    """Normalize rule settings into a SpamRule. compiled_regex must already be acquired by the caller."""
+    min_length = max(0, int(min_length))
+    similarity_threshold = max(0.0, min(float(similarity_threshold), 1.0))
+    time_window = max(0, int(time_window))
+    message_count = max(0, int(message_count))
+    regex_pattern = regex_pattern if compiled_regex is not None else None
+    cross_user = bool(cross_user) and compiled_regex is None
+    return SpamRule(
+        label=label,
+        min_length=min_length,
+        similarity_threshold=similarity_threshold,
+        time_window=time_window,
+        message_count=message_count,
+        dm_message=dm_message,
+        notify_channel_id=notify_channel_id,
+        channels=frozenset(channels),
+        excluded_channels=frozenset(excluded_channels),
+        targeted_roles=frozenset(targeted_roles),
+        exempted_roles=frozenset(exempted_roles),
+        nonreply_only=bool(nonreply_only),
+        mod_action=mod_action,
+        regex_pattern=regex_pattern,
+        compiled_regex=compiled_regex,
+        input=input_mode if input_mode in RULE_INPUT_MODES else "raw",
+        evaluable=time_window > 0 and message_count >= 1 and (cross_user or compiled_regex is not None or similarity_threshold > 0),
+        cross_user=cross_user,
+    )
+
+
+def _refresh_spam_rule_caches(guild_id: int) -> None:
+    """Recompute a guild's derived spam rule state after its rules change.
+
+    Refreshes the largest time window (history retention) and assigns regex-mode rules their
+    memo bits under a new epoch, which invalidates every memoized match result of the guild.
+    """
+    guild_rules = spam_rules_by_guild.get(guild_id)
+    spam_regex_memo_epochs[guild_id] += 1
+    if guild_rules:
+        spam_rule_max_windows[guild_id] = max(rule.time_window for rule in guild_rules.values())
+        regex_keys = sorted(name_key for name_key, rule in guild_rules.items() if rule.compiled_regex is not None)
+        spam_regex_rule_bits[guild_id] = {name_key: 1 << bit for bit, name_key in enumerate(regex_keys)}
+    else:
+        spam_rule_max_windows.pop(guild_id, None)
+        spam_regex_rule_bits.pop(guild_id, None)
+    # Fingerprint indexes of removed or rebuilt cross-user rules
+    for index_key in [key for key in spam_crossuser_indexes if key[0] == guild_id]:
+        rule = (guild_rules or {}).get(index_key[1])
+        if rule is None or spam_crossuser_indexes[index_key].rule is not rule:
+            del spam_crossuser_indexes[index_key]
+
+# ============== SPAM SIMILARITY INDEX ==============
+
+# Similarity-mode spam rules keep MinHash signatures of character shingles in an LSH band
+# index per user. The index only decides which window entries are compared first: every
+# verdict comes from the rule's own metric (see _spam_entries_similar), so a check that
+# reaches its count on likely near-duplicates can stop without scanning the whole window.
+SPAM_SHINGLE_SIZE = 3
+SPAM_MINHASH_SLOTS = 64  # One-permutation MinHash: each shingle hash lands in one slot
+SPAM_LSH_BAND_ROWS = 2  # 32 bands of 2 rows: ~98% recall at a Dice similarity of 0.5
+SPAM_LSH_BANDS = SPAM_MINHASH_SLOTS // SPAM_LSH_BAND_ROWS
+# Below this threshold few similar entries share a band, so the window is compared in history order
+SPAM_LSH_MIN_THRESHOLD = 0.5
+_MINHASH_VALUE_BITS = 58  # Slot values stay below 2**58; densified slots keep their distance above that
+_MINHASH_MASK = (1 << 64) - 1
+
+# { (guild_id, user_id, input mode): SpamSimilarityIndex }
+spam_similarity_indexes = {}
+
+
+def _minhash_signature(text: str) -> array.array:
+    """One-permutation MinHash of the text's character shingles, densified so every slot is set."""
+    size = SPAM_SHINGLE_SIZE
+    shingles = {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+    slots = [None] * SPAM_MINHASH_SLOTS
+    for shingle in shingles:
+        hashed = hash(shingle) & _MINHASH_MASK
+        slot = hashed % SPAM_MINHASH_SLOTS
+        value = (hashed // SPAM_MINHASH_SLOTS) & ((1 << _MINHASH_VALUE_BITS) - 1)
+        current = slots[slot]
+        if current is None or value < current:
+            slots[slot] = value
+    if None in slots:
+        # Empty slots borrow the next filled slot's value (circularly), tagged with the distance
+        dense = list(slots)
+        next_value, distance = None, 0
+        for i in range(2 * SPAM_MINHASH_SLOTS - 1, -1, -1):
+            value = slots[i % SPAM_MINHASH_SLOTS]
+            if value is not None:
+                next_value, distance = value, 0
+                continue
+            distance += 1
+            if i < SPAM_MINHASH_SLOTS and next_value is not None:
+                dense[i] = next_value | (distance << _MINHASH_VALUE_BITS)
+        slots = dense
+    return array.array("Q", slots)
+
+
+def _minhash_band_keys(signature) -> tuple:
+    rows = SPAM_LSH_BAND_ROWS
+    return tuple(hash((band, *signature[band * rows:(band + 1) * rows])) for band in range(SPAM_LSH_BANDS))
+
+
+def _history_entry_signature(entry: "SpamHistoryEntry", input_mode: str) -> array.array:
+    """MinHash signature of a spam history entry in the given input mode, cached on the entry."""
+    if input_mode == "folded":
+        signature = entry.folded_minhash
+        if signature is None:
+            signature = entry.folded_minhash = _minhash_signature(entry.view(input_mode)[0])
+        return signature
+    signature = entry.minhash
+    if signature is None:
+        signature = entry.minhash = _minhash_signature(entry.content)
+    return signature
+
+
+class SpamSimilarityIndex:
+    """LSH band buckets over one user's spam history entries for one input mode.
+
+    The history list stays the source of truth: sync() indexes entries appended since the
+    last call and drops entries pruned from its front, both in time proportional to the change.
+    """
+
+    __slots__ = ("input_mode", "buckets", "entries")
+
+    def __init__(self, input_mode: str):
+        self.input_mode = input_mode
+        self.buckets = {}  # band key -> deque of entries, oldest first
+        self.entries = deque()  # indexed entries in history order
+
+    def _add(self, entry: "SpamHistoryEntry") -> None:
+        for band_key in _minhash_band_keys(_history_entry_signature(entry, self.input_mode)):
+            self.buckets.setdefault(band_key, deque()).append(entry)
+        self.entries.append(entry)
+
+    def _remove_from_buckets(self, entry: "SpamHistoryEntry") -> None:
+        for band_key in _minhash_band_keys(_history_entry_signature(entry, self.input_mode)):
+            bucket = self.buckets.get(band_key)
+            if not bucket:
+                continue
+            if bucket[0] is entry:
+                bucket.popleft()  # Entries expire oldest first
+            else:
+                for position, candidate in enumerate(bucket):
+                    if candidate is entry:
+                        del bucket[position]
+                        break
+            if not bucket:
+                del self.buckets[band_key]
+
+    def sync(self, user_history: deque) -> None:
+        oldest = user_history[0].timestamp if user_history else math.inf
+        while self.entries and self.entries[0].timestamp < oldest:
+            self._remove_from_buckets(self.entries.popleft())
+        last_indexed = self.entries[-1] if self.entries else None
+        appended = []
+        for entry in reversed(user_history):
+            if entry is last_indexed:
+                break
+            appended.append(entry)
+        else:
+            if last_indexed is not None:
+                # History was rebuilt underneath the index: start over
+                self.buckets.clear()
+                self.entries.clear()
+        for entry in reversed(appended):
+            self._add(entry)
+
+    def discard(self, entries: list) -> None:
+        """Forget entries removed from the middle of the history."""
+        for entry in entries:
+            for position, candidate in enumerate(self.entries):
+                if candidate is entry:
+                    del self.entries[position]
+                    self._remove_from_buckets(entry)
+                    break
+
+    def candidates(self, band_keys) -> list:
+        """Entries sharing at least one band with the given signature's band keys."""
+        found = {}
+        for band_key in band_keys:
+            for entry in self.buckets.get(band_key, ()):
+                found[id(entry)] = entry
+        return list(found.values())
+
+
+def _spam_similarity_index(guild_id: int, user_id: int, input_mode: str, user_history: deque) -> SpamSimilarityIndex:
+    key = (guild_id, user_id, input_mode)
+    index = spam_similarity_indexes.get(key)
+    if index is None:
+        index = SpamSimilarityIndex(input_mode)
+        spam_similarity_indexes[key] = index
+    index.sync(user_history)
+    return index
+
+
+# ============== SPAM REGEX MEMO ==============
+
+# Regex-mode spam rules evaluate each history entry once per rule version. The result is kept
+# on the entry as bits of its regex_memo = [epoch, evaluated bits, matched bits], and the
+# matching entries inside the rule's window are kept per (user, rule) as a running count.
+# { guild_id: epoch }, bumped by _refresh_spam_rule_caches
+spam_regex_memo_epochs = defaultdict(int)
+# { guild_id: { rule key: bit } }
+spam_regex_rule_bits = {}
+# { (guild_id, user_id): { rule key: SpamRegexRunningCount } }
+spam_regex_running_counts = {}
+
+
+class SpamRegexRunningCount:
+    """Matching history entries of one user for one regex-mode rule, oldest first."""
+
+    __slots__ = ("rule", "epoch", "hits", "last_entry")
+
+    def __init__(self, rule: "SpamRule", epoch: int):
+        self.rule = rule
+        self.epoch = epoch
+        self.hits = deque()  # (timestamp, entry) of in-scope entries that matched
+        self.last_entry = None  # Newest history entry already accounted for
+
+    def expire(self, cutoff: float) -> int:
+        hits = self.hits
+        while hits and hits[0][0] < cutoff:
+            hits.popleft()
+        return len(hits)
+
+
+def _spam_regex_memo_lookup(entry: "SpamHistoryEntry", epoch: int, bit: int):
+    """Memoized match result of entry for the rule owning bit, or None if not evaluated yet."""
+    memo = entry.regex_memo
+    if memo is None or memo[0] != epoch or not memo[1] & bit:
+        return None
+    return bool(memo[2] & bit)
+
+
+def _spam_regex_memo_store(entry: "SpamHistoryEntry", epoch: int, bit: int, matched: bool) -> None:
+    memo = entry.regex_memo
+    if memo is None or memo[0] != epoch:
+        memo = [epoch, 0, 0]
+        entry.regex_memo = memo
+    memo[1] |= bit
+    if matched:
+        memo[2] |= bit
+
+
+def _spam_regex_pending_entries(running: SpamRegexRunningCount, user_history: deque, cutoff: float) -> list:
+    """History entries the running count has not seen yet, oldest first (normally just the new message)."""
+    appended = []
+    for entry in reversed(user_history):
+        if entry is running.last_entry:
+            break
+        if entry.timestamp < cutoff:
+            # Everything older is outside the rule's window, including whatever was counted before
+            running.hits.clear()
+            break
+        appended.append(entry)
+    else:
+        # First use, or the last seen entry left the history: recount the window
+        running.hits.clear()
+    appended.reverse()
+    return appended
+
+
+def _forget_spam_history_entries(history_key: tuple, entries: list) -> None:
+    """Drop entries removed from the middle of a user's history from the derived indexes."""
+    for input_mode in RULE_INPUT_MODES:
+        index = spam_similarity_indexes.get((*history_key, input_mode))
+        if index is not None:
+            index.discard(entries)
+    for running in spam_regex_running_counts.get(history_key, {}).values():
+        if any(running.last_entry is entry for entry in entries):
+            running.last_entry = None  # Recount from the per-entry memo on next use
+            continue
+        running.hits = deque(hit for hit in running.hits if not any(hit[1] is entry for entry in entries))
+
+
+def _drop_spam_history_caches(history_key: tuple) -> None:
+    for input_mode in RULE_INPUT_MODES:
+        spam_similarity_indexes.pop((*history_key, input_mode), None)
+    spam_regex_running_counts.pop(history_key, None)
+
+# ============== CROSS-USER SPAM INDEX ==============
+
+# Cross-user rules (!spamrule ... crossuser) look for the same content posted by many
+# different accounts, e.g. a raid where every fresh account posts the scam once. Each rule
+# keeps its in-scope messages of the last time_window seconds by content fingerprint.
+SPAM_CROSSUSER_MAX_MESSAGES = _parse_env_number("SPAM_CROSSUSER_MAX_MESSAGES", 50000, int)  # Per rule; oldest dropped first
+# { (guild_id, rule key): SpamFingerprintIndex }
+spam_crossuser_indexes = {}
+
+
+def _spam_content_fingerprint(text: str) -> Optional[int]:
+    """Fingerprint of text that ignores case, spacing and punctuation (None if it has no words)."""
+    tokens = _extract_word_tokens(text)
+    if not tokens:
+        return None
+    return hash(" ".join(tokens))
+
+
+class SpamFingerprintBucket:
+    """Messages sharing one fingerprint inside the window, oldest first."""
+
+    __slots__ = ("messages", "users", "unhandled")
+
+    def __init__(self):
+        self.messages = deque()  # (timestamp, user_id, message_id, channel_id)
+        self.users = Counter()  # user_id -> messages in the window
+        self.unhandled = deque()  # messages not yet acted on, a suffix-ordered subset of messages
+
+
+class SpamFingerprintIndex:
+    """Rolling fingerprint -> messages index of one cross-user rule.
+
+    Every message is appended to its bucket and to one time-ordered log; expiring from the
+    log's head pops the matching bucket heads, so adding a message and reading its bucket's
+    distinct user count are both amortized O(1).
+    """
+
+    __slots__ = ("rule", "buckets", "order")
+
+    def __init__(self, rule: SpamRule):
+        self.rule = rule
+        self.buckets = {}  # fingerprint -> SpamFingerprintBucket
+        self.order = deque()  # fingerprints in arrival order, matching each bucket's messages
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _pop_oldest(self) -> None:
+        fingerprint = self.order.popleft()
+        bucket = self.buckets[fingerprint]
+        record = bucket.messages.popleft()
+        if bucket.unhandled and bucket.unhandled[0] is record:
+            bucket.unhandled.popleft()
+        user_id = record[1]
+        bucket.users[user_id] -= 1
+        if not bucket.users[user_id]:
+            del bucket.users[user_id]
+        if not bucket.messages:
+            del self.buckets[fingerprint]
+
+    def expire(self, now: float) -> None:
+        cutoff = now - self.rule.time_window
+        while self.order and self.buckets[self.order[0]].messages[0][0] < cutoff:
+            self._pop_oldest()
+
+    def add(self, fingerprint: int, user_id: int, message_id: int, channel_id: int, now: float) -> list:
+        """Record a message. Returns the messages to act on once more than message_count users posted it."""
+        self.expire(now)
+        bucket = self.buckets.get(fingerprint)
+        if bucket is None:
+            bucket = self.buckets[fingerprint] = SpamFingerprintBucket()
+        record = (now, user_id, message_id, channel_id)
+        bucket.messages.append(record)
+        bucket.unhandled.append(record)
+        bucket.users[user_id] += 1
+        self.order.append(fingerprint)
+        while len(self.order) > SPAM_CROSSUSER_MAX_MESSAGES:
+            self._pop_oldest()
+        if len(bucket.users) <= self.rule.message_count:
+            return []
+        flagged = list(bucket.unhandled)
+        bucket.unhandled.clear()
+        return flagged
+
+
+def _record_crossuser_message(message: discord.Message, rule_key: str, rule: SpamRule, text_view: "MessageTextView", now: float) -> list:
+    """Add message to the rule's fingerprint index; returns [(timestamp, user_id, message_id, channel_id)] to act on."""
+    fingerprint = _spam_content_fingerprint(text_view.content(rule.input))
+    if fingerprint is None:
+        return []
+    key = (message.guild.id, rule_key)
+    index = spam_crossuser_indexes.get(key)
+    if index is None or index.rule is not rule:
+        index = spam_crossuser_indexes[key] = SpamFingerprintIndex(rule)
+    return index.add(fingerprint, message.author.id, message.id, message.channel.id, now)
+
 # ============== SPAM & REGEX HELPER FUNCTIONS ==============
 
 _WORD_TOKEN_PATTERN = re.compile(r"\w+")
@@ -1148,19 +2220,47 @@ def _extract_word_tokens(text: str) -> list[str]:
         return []
     return [token for token in _WORD_TOKEN_PATTERN.findall(text.lower()) if token]
 
-def _token_multiset_similarity(tokens1: list[str], tokens2: list[str]) -> float:
-    """Compute multiset Jaccard similarity between two token lists."""
+def _token_multiset_similarity(token_counts1: tuple, token_counts2: tuple) -> float:
+    """Compute multiset Jaccard similarity between two (sorted tokens, counts) token multisets."""
+    tokens1, counts1 = token_counts1
+    tokens2, counts2 = token_counts2
     if not tokens1 or not tokens2:
         return 0.0
 
-    counts1 = Counter(tokens1)
-    counts2 = Counter(tokens2)
-    intersection = sum(min(counts1[token], counts2[token]) for token in counts1.keys())
-    union = sum(max(counts1.get(token, 0), counts2.get(token, 0)) for token in set(counts1) | set(counts2))
+    # Both token tuples are sorted: merge them
+    intersection = 0
+    i = j = 0
+    while i < len(tokens1) and j < len(tokens2):
+        if tokens1[i] == tokens2[j]:
+            intersection += min(counts1[i], counts2[j])
+            i += 1
+            j += 1
+        elif tokens1[i] < tokens2[j]:
+            i += 1
+        else:
+            j += 1
+    union = sum(counts1) + sum(counts2) - intersection
     if union == 0:
         return 0.0
     return intersection / union
 
+def _spam_entries_similar(content: str, token_counts: tuple, entry_content: str, entry_token_counts: tuple, threshold: float) -> bool:
+    """True if max(SequenceMatcher ratio, token multiset Jaccard) >= threshold.
+
+    The token similarity is cheap and settles most matches; the character ratio is only
+    computed when its upper bounds (real_quick_ratio, quick_ratio) can still reach threshold.
+    """
+    if _token_multiset_similarity(token_counts, entry_token_counts) >= threshold:
+        return True
+    if not entry_content:
+        return threshold <= 0.0
+    matcher = SequenceMatcher(None, content, entry_content)
+    return (
+        matcher.real_quick_ratio() >= threshold
+        and matcher.quick_ratio() >= threshold
+        and matcher.ratio() >= threshold
+    )
+
 def _is_message_reply(message: discord.Message) -> bool:
     """Return True if message is a Discord reply (covers uncached targets)."""
     ref = getattr(message, "reference", None)
@@ -1177,41 +2277,1644 @@ def _is_message_reply(message: discord.Message) -> bool:
         pass
     return False
 
-# Security: Safe regex search with timeout to prevent ReDoS attacks
-def _safe_regex_search(compiled_pattern, text, timeout_seconds=1):
-    """Safely search regex with timeout to prevent ReDoS (Regular Expression Denial of Service) attacks"""
-    if not text:
+# ============== TEXT NORMALIZATION ==============
+
+# Which text a regex/spam rule reads: the message as sent, or the normalized (folded) form
+RULE_INPUT_MODES = ("raw", "folded")
+
+# Look-alike letters from other scripts and "fancy text" small capitals, mapped to the Latin letter they imitate
+_CONFUSABLE_CHARACTERS = {
+    # Cyrillic
+    "а": "a", "е": "e", "о": "o", "р": "p", "с": "c", "у": "y", "х": "x", "ѕ": "s", "і": "i", "ј": "j",
+    "ԁ": "d", "һ": "h", "ӏ": "l", "ԛ": "q", "ԝ": "w", "ѡ": "w", "ү": "y",
+    "А": "A", "В": "B", "Е": "E", "К": "K", "М": "M", "Н": "H", "О": "O", "Р": "P", "С": "C", "Т": "T",
+    "Х": "X", "У": "Y", "Ѕ": "S", "І": "I", "Ј": "J", "Ԛ": "Q", "Ԝ": "W", "Ү": "Y",
+    # Greek
+    "α": "a", "ο": "o", "ν": "v", "ρ": "p", "ι": "i", "κ": "k", "υ": "u",
+    "Α": "A", "Β": "B", "Ε": "E", "Ζ": "Z", "Η": "H", "Ι": "I", "Κ": "K", "Μ": "M", "Ν": "N", "Ο": "O",
+    "Ρ": "P", "Τ": "T", "Υ": "Y", "Χ": "X",
+    # Latin alternates and small capitals
+    "ɑ": "a", "ɡ": "g", "ᴀ": "a", "ʙ": "b", "ᴄ": "c", "ᴅ": "d", "ᴇ": "e", "ꜰ": "f", "ɢ": "g", "ʜ": "h", "ɪ": "i",
+    "ᴊ": "j", "ᴋ": "k", "ʟ": "l", "ᴍ": "m", "ɴ": "n", "ᴏ": "o", "ᴘ": "p", "ʀ": "r", "ꜱ": "s", "ᴛ": "t",
+    "ᴜ": "u", "ᴠ": "v", "ᴡ": "w", "ʏ": "y", "ᴢ": "z",
+}
+# Regional indicator symbols (🇦..🇿) spell words without being letters
+_CONFUSABLE_CHARACTERS.update({chr(0x1F1E6 + offset): chr(ord("a") + offset) for offset in range(26)})
+
+# Characters that render as nothing (or as blank space) and are used to split up words
+_INVISIBLE_CODEPOINTS = {0x034F, 0x115F, 0x1160, 0x17B4, 0x17B5, 0x180B, 0x180C, 0x180D, 0x180F, 0x3164, 0xFFA0}
+_BLANK_CODEPOINTS = {0x2800}  # Braille blank looks like a space
+
+
+def _build_text_fold_table() -> dict:
+    """Build one str.translate table: invisible/format characters and combining marks removed,
+    compatibility forms replaced by their NFKC form, then confusables mapped to Latin."""
+
+    def _post(ch: str) -> str:
+        codepoint = ord(ch)
+        if codepoint in _INVISIBLE_CODEPOINTS or unicodedata.category(ch) in ("Cf", "Mn", "Me"):
+            return ""
+        if codepoint in _BLANK_CODEPOINTS:
+            return " "
+        return _CONFUSABLE_CHARACTERS.get(ch, ch)
+
+    table = {}
+    # Planes 0-1 cover full-width forms, mathematical alphanumerics and enclosed letters
+    for codepoint in range(0x20000):
+        if 0xD800 <= codepoint <= 0xDFFF:
+            continue
+        ch = chr(codepoint)
+        normalized = unicodedata.normalize("NFKC", ch)
+        folded = "".join(_post(part) for part in normalized)
+        if folded != ch:
+            table[codepoint] = folded if folded else None
+    # Tag characters (plane 14) are invisible too
+    for codepoint in range(0xE0000, 0xE0080):
+        table[codepoint] = None
+    return table
+
+
+_TEXT_FOLD_TABLE = _build_text_fold_table()
+
+
+def _fold_message_text(text: str) -> str:
+    """Normalize text for folded-input rules in a single str.translate pass."""
+    if text.isascii():
+        return text
+    return text.translate(_TEXT_FOLD_TABLE)
+
+
+class MessageTextView:
+    """Raw and folded text of one message, each computed at most once and shared by every rule."""
+
+    __slots__ = ("message", "_blocks", "_digests", "_content", "_tokens")
+
+    def __init__(self, message: discord.Message):
+        self.message = message
+        self._blocks: dict = {}
+        self._digests: dict = {}
+        self._content: dict = {}
+        self._tokens: dict = {}
+
+    def blocks(self, input_mode: str = "raw") -> List[str]:
+        """Regex text blocks (content, attachments, snapshots) in the given input mode."""
+        blocks = self._blocks.get(input_mode)
+        if blocks is None:
+            if input_mode == "folded":
+                blocks = [folded for folded in map(_fold_message_text, self.blocks("raw")) if folded.strip()]
+            else:
+                blocks = _collect_regex_text_blocks(self.message)
+            self._blocks[input_mode] = blocks
+        return blocks
+
+    def digest(self, input_mode: str = "raw") -> bytes:
+        digest = self._digests.get(input_mode)
+        if digest is None:
+            digest = _regex_text_blocks_digest(self.blocks(input_mode))
+            self._digests[input_mode] = digest
+        return digest
+
+    def content(self, input_mode: str = "raw") -> str:
+        """Message content only (what spam rules compare)."""
+        content = self._content.get(input_mode)
+        if content is None:
+            content = getattr(self.message, "content", None) or ""
+            if input_mode == "folded":
+                content = _fold_message_text(content)
+            self._content[input_mode] = content
+        return content
+
+    def tokens(self, input_mode: str = "raw") -> list[str]:
+        tokens = self._tokens.get(input_mode)
+        if tokens is None:
+            tokens = _extract_word_tokens(self.content(input_mode))
+            self._tokens[input_mode] = tokens
+        return tokens
+
+# ============== REGEX EVALUATION SERVICE ==============
+
+class RegexEvalResult(NamedTuple):
+    """Outcome of one bounded regex job."""
+    matched: bool
+    timed_out: bool = False
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    # mode="each": one bool per submitted text
+    per_text: tuple = ()
+    # mode="groups": names of the named groups that produced a match
+    fired: frozenset = frozenset()
+
+
+def _pattern_supports_native_timeout(compiled_pattern) -> bool:
+    """The third-party 'regex' engine can abort a match itself and release the GIL while matching."""
+    return _pattern_engine_name(compiled_pattern) == "regex"
+
+
+def _run_regex_job(compiled_pattern, texts, mode, timeout_seconds) -> RegexEvalResult:
+    """Evaluate compiled_pattern against texts. Runs on a worker thread, never on the event loop."""
+    started = time.perf_counter()
+    deadline = started + timeout_seconds
+    native_timeout = _pattern_supports_native_timeout(compiled_pattern)
+
+    def _search(text, finditer=False):
+        if native_timeout:
+            remaining = max(deadline - time.perf_counter(), 0.001)
+            if finditer:
+                return compiled_pattern.finditer(text, timeout=remaining, concurrent=True)
+            return compiled_pattern.search(text, timeout=remaining, concurrent=True)
+        if finditer:
+            return compiled_pattern.finditer(text)
+        return compiled_pattern.search(text)
+
+    matched = False
+    per_text = []
+    fired = set()
+    try:
+        for text in texts:
+            if time.perf_counter() > deadline:
+                raise TimeoutError("regex budget exhausted")
+            if not text:
+                per_text.append(False)
+                continue
+            if mode == "groups":
+                for match in _search(text, finditer=True):
+                    matched = True
+                    if match.lastgroup:
+                        fired.add(match.lastgroup)
+                continue
+            hit = _search(text) is not None
+            if mode == "each":
+                per_text.append(hit)
+                matched = matched or hit
+            elif hit:
+                matched = True
+                break
+    except TimeoutError:
+        return RegexEvalResult(False, timed_out=True, elapsed=time.perf_counter() - started)
+    except Exception as exc:
+        return RegexEvalResult(False, error=str(exc), elapsed=time.perf_counter() - started)
+    return RegexEvalResult(
+        matched,
+        elapsed=time.perf_counter() - started,
+        per_text=tuple(per_text),
+        fired=frozenset(fired),
+    )
+
+
+class _DaemonThreadPool:
+    """Fixed-size pool of daemon worker threads.
+
+    Daemon threads keep a runaway stdlib ``re`` match from blocking interpreter
+    shutdown, which a ``ThreadPoolExecutor`` would do.
+    """
+
+    def __init__(self, size: int, name: str):
+        self._size = max(1, size)
+        self._name = name
+        self._jobs = queue.SimpleQueue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self._size):
+                thread = threading.Thread(target=self._worker, name=f"{self._name}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            future, fn, args = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+    def submit(self, fn, *args) -> concurrent.futures.Future:
+        self._ensure_started()
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._jobs.put((future, fn, args))
+        return future
+
+
+def _pattern_engine_name(compiled_pattern) -> str:
+    if isinstance(compiled_pattern, re.Pattern):
+        return "re"
+    if isinstance(compiled_pattern, _RE2Pattern):
+        return "re2"
+    return _REGEX_ENGINE_NAME
+
+
+_pattern_sandbox_keys: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _pattern_sandbox_key(compiled_pattern) -> str:
+    """Stable identity of a compiled pattern (engine, flags and source) for shipping to workers."""
+    key = _pattern_sandbox_keys.get(compiled_pattern)
+    if key is None:
+        source = compiled_pattern.pattern
+        if isinstance(source, str):
+            source = source.encode("utf-8", "surrogatepass")
+        digest = hashlib.sha1(source).hexdigest()
+        key = f"{_pattern_engine_name(compiled_pattern)}:{compiled_pattern.flags}:{digest}"
+        _pattern_sandbox_keys[compiled_pattern] = key
+    return key
+
+
+def _regex_sandbox_worker_main(conn):
+    """Entry point of a sandbox worker process: compile shipped patterns, answer match jobs."""
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the parent
+    except Exception:
+        pass
+    compiled_patterns = {}
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            return
+        op = request[0]
+        if op == "load":
+            _, key, engine_name, pattern_text, flags_value = request
+            try:
+                compiled_patterns[key] = _compile_on_engine(engine_name, pattern_text, flags_value)
+                conn.send(("ok",))
+            except Exception as exc:
+                conn.send(("error", str(exc)))
+        elif op == "run":
+            _, key, texts, mode, timeout_seconds = request
+            compiled = compiled_patterns.get(key)
+            if compiled is None:
+                conn.send(("missing",))
+                continue
+            conn.send(("result", tuple(_run_regex_job(compiled, texts, mode, timeout_seconds))))
+        elif op == "drop":
+            compiled_patterns.pop(request[1], None)
+            conn.send(("ok",))
+
+
+class _RegexSandboxWorker:
+    """Parent-side handle of one sandbox process and the pattern keys it has loaded (LRU order)."""
+
+    def __init__(self, mp_context, index: int):
+        self.index = index
+        self.loaded_keys: OrderedDict = OrderedDict()
+        self.conn, child_conn = mp_context.Pipe(duplex=True)
+        self.process = mp_context.Process(
+            target=_regex_sandbox_worker_main,
+            args=(child_conn,),
+            name=f"regex-sandbox-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def request(self, payload, timeout_seconds: float):
+        """Send payload and wait for the reply. Returns None if the worker did not answer in time."""
+        self.conn.send(payload)
+        if not self.conn.poll(timeout_seconds):
+            return None
+        return self.conn.recv()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=1)
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class RegexProcessSandbox:
+    """Small pool of worker processes that can be killed when a match runs away.
+
+    Compiled patterns are shipped to a worker once per pattern version (keyed by
+    engine, flags and a hash of the source) instead of once per message, and each
+    worker keeps at most REGEX_SANDBOX_MAX_PATTERNS of them.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        # Forking the bot would copy its event loop, sockets and lock state into every worker
+        start_methods = multiprocessing.get_all_start_methods()
+        self._mp_context = multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+        self._workers: List[_RegexSandboxWorker] = []
+        self._idle: asyncio.Queue | None = None
+        # Blocking pipe I/O happens on these threads, one per worker process
+        self._io_pool = _DaemonThreadPool(self.size, "regex-sandbox-io")
+        self.respawn_count = 0
+
+    def _ensure_started(self):
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        for index in range(self.size):
+            worker = _RegexSandboxWorker(self._mp_context, index)
+            self._workers.append(worker)
+            self._idle.put_nowait(worker)
+
+    def _respawn(self, worker: _RegexSandboxWorker) -> _RegexSandboxWorker:
+        worker.kill()
+        replacement = _RegexSandboxWorker(self._mp_context, worker.index)
+        self._workers[worker.index] = replacement
+        self.respawn_count += 1
+        print(f"[SECURITY] Regex sandbox worker {worker.index} killed after exceeding its budget and respawned")
+        return replacement
+
+    def _load_pattern(self, worker: _RegexSandboxWorker, key: str, compiled_pattern, timeout_seconds: float):
+        """Make sure worker has compiled_pattern loaded. Returns None on success, else the reply to give up with."""
+        if key in worker.loaded_keys:
+            worker.loaded_keys.move_to_end(key)
+            return None
+        while len(worker.loaded_keys) >= REGEX_SANDBOX_MAX_PATTERNS:
+            old_key, _ = worker.loaded_keys.popitem(last=False)
+            if worker.request(("drop", old_key), max(timeout_seconds, 5.0)) is None:
+                return ("unavailable",)
+        reply = worker.request(
+            ("load", key, _pattern_engine_name(compiled_pattern), compiled_pattern.pattern, compiled_pattern.flags),
+            max(timeout_seconds, 5.0),
+        )
+        if reply is None:
+            return ("unavailable",)
+        if reply[0] == "error":
+            return reply
+        worker.loaded_keys[key] = None
         return None
-    
-    # Limit text length to prevent memory issues
-    MAX_TEXT_LENGTH = 10000
-    if len(text) > MAX_TEXT_LENGTH:
-        text = text[:MAX_TEXT_LENGTH]
-    
-    result = [None]
-    exception = [None]
-    
-    def search_worker():
+
+    def _run_blocking(self, worker: _RegexSandboxWorker, compiled_pattern, texts, mode, timeout_seconds):
+        """Runs on an I/O thread. Returns (worker_to_release, result_tuple_or_None)."""
+        key = _pattern_sandbox_key(compiled_pattern)
         try:
-            result[0] = compiled_pattern.search(text)
-        except Exception as e:
-            exception[0] = e
-    
-    # Use threading for timeout (signal doesn't work well with Discord.py)
-    thread = threading.Thread(target=search_worker, daemon=True)
-    thread.start()
-    thread.join(timeout=timeout_seconds)
-    
-    if thread.is_alive():
-        # Timeout occurred - potential ReDoS attack
-        print(f"[SECURITY] Regex timeout detected - potential ReDoS attack blocked")
+            # A worker that lost the pattern (e.g. restarted between calls) gets it once more
+            for _ in range(2):
+                failure = self._load_pattern(worker, key, compiled_pattern, timeout_seconds)
+                if failure is not None:
+                    if failure[0] == "error":
+                        return worker, tuple(RegexEvalResult(False, error=failure[1]))
+                    return self._respawn(worker), None
+                reply = worker.request(("run", key, texts, mode, timeout_seconds), timeout_seconds + 0.25)
+                if reply is None or reply[0] != "missing":
+                    break
+                worker.loaded_keys.pop(key, None)
+        except (EOFError, OSError, BrokenPipeError) as exc:
+            print(f"[SECURITY] Regex sandbox worker {worker.index} failed: {exc}")
+            return self._respawn(worker), None
+        if reply is None:
+            return self._respawn(worker), tuple(RegexEvalResult(False, timed_out=True, elapsed=timeout_seconds))
+        if reply[0] == "missing":
+            return worker, None
+        return worker, reply[1]
+
+    def _release_when_done(self, io_future: concurrent.futures.Future, worker: _RegexSandboxWorker, loop) -> None:
+        """Done-callback of the I/O job: hand the (possibly respawned) worker back to the idle queue."""
+        if not io_future.cancelled() and io_future.exception() is None:
+            worker = io_future.result()[0]
+        try:
+            loop.call_soon_threadsafe(self._idle.put_nowait, worker)
+        except RuntimeError:
+            pass  # Event loop already closed (shutdown)
+
+    async def run(self, compiled_pattern, texts, mode: str, timeout_seconds: float) -> RegexEvalResult:
+        self._ensure_started()
+        worker = await self._idle.get()
+        io_future = self._io_pool.submit(self._run_blocking, worker, compiled_pattern, texts, mode, timeout_seconds)
+        # Released only once the I/O thread is done with the pipe, even if this coroutine is cancelled
+        loop = asyncio.get_running_loop()
+        io_future.add_done_callback(lambda done: self._release_when_done(done, worker, loop))
+        _, payload = await asyncio.wrap_future(io_future)
+        if payload is None:
+            return RegexEvalResult(False, error="sandbox worker unavailable")
+        return RegexEvalResult(*payload)
+
+    def close(self):
+        for worker in self._workers:
+            worker.kill()
+        self._workers.clear()
+
+
+class RegexEvaluationService:
+    """Awaitable, time-bounded regex evaluation shared by regex rules and spam rules.
+
+    Jobs run on a reusable worker pool so a slow pattern never blocks the gateway
+    event loop, and each guild may only occupy a limited number of workers at once.
+    Stdlib ``re`` has no native timeout, so a runaway match would keep its pool
+    thread forever; in thread mode such patterns are routed to a killable process
+    sandbox instead. REGEX_ISOLATION_MODE=process moves all matching there.
+    """
+
+    def __init__(self, max_workers: int, per_guild_limit: int, timeout_seconds: float, isolation_mode: str = "thread"):
+        self.timeout_seconds = timeout_seconds
+        self.per_guild_limit = max(1, per_guild_limit)
+        self.isolation_mode = isolation_mode
+        self._pool = _DaemonThreadPool(max_workers, "regex-eval")
+        self._max_workers = max_workers
+        self._sandbox = RegexProcessSandbox(max_workers) if isolation_mode == "process" else None
+        self._guild_semaphores: dict = {}
+
+    def _sandbox_for(self, compiled_pattern) -> "RegexProcessSandbox | None":
+        """The process sandbox this pattern must run in, or None if a pool thread is safe."""
+        if self._sandbox is None and _pattern_engine_name(compiled_pattern) == "re":
+            # RE2 runs in linear time and `regex` honours its timeout; stdlib re does neither
+            self._sandbox = RegexProcessSandbox(self._max_workers)
+            print("[REGEX] Stdlib re patterns have no native timeout; starting the process sandbox for them")
+        if self.isolation_mode == "process" or _pattern_engine_name(compiled_pattern) == "re":
+            return self._sandbox
         return None
-    
-    if exception[0]:
-        print(f"[SECURITY] Regex error: {exception[0]}")
+
+    def _semaphore_for(self, guild_id) -> asyncio.Semaphore:
+        semaphore = self._guild_semaphores.get(guild_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_guild_limit)
+            self._guild_semaphores[guild_id] = semaphore
+        return semaphore
+
+    async def evaluate(self, guild_id, compiled_pattern, texts, *, mode: str = "any", timeout: float | None = None) -> RegexEvalResult:
+        """Run compiled_pattern against texts. mode is "any", "each" or "groups"."""
+        budget = self.timeout_seconds if timeout is None else timeout
+        bounded_texts = [text[:REGEX_MAX_TEXT_LENGTH] if text else "" for text in texts]
+        if not any(bounded_texts):
+            return RegexEvalResult(False, per_text=tuple(False for _ in bounded_texts))
+
+        async with self._semaphore_for(guild_id):
+            sandbox = self._sandbox_for(compiled_pattern)
+            if sandbox is not None:
+                result = await sandbox.run(compiled_pattern, bounded_texts, mode, budget)
+            else:
+                future = asyncio.wrap_future(
+                    self._pool.submit(_run_regex_job, compiled_pattern, bounded_texts, mode, budget)
+                )
+                try:
+                    # Small grace period so engines with native timeouts report it themselves
+                    result = await asyncio.wait_for(future, budget + 0.25)
+                except asyncio.TimeoutError:
+                    result = RegexEvalResult(False, timed_out=True, elapsed=budget)
+
+        if result.timed_out:
+            print(f"[SECURITY] Regex timeout detected - potential ReDoS attack blocked (guild {guild_id})")
+        elif result.error:
+            print(f"[SECURITY] Regex error: {result.error}")
+        return result
+
+
+regex_evaluation_service = RegexEvaluationService(
+    max_workers=REGEX_EVAL_WORKERS,
+    per_guild_limit=REGEX_EVAL_GUILD_CONCURRENCY,
+    timeout_seconds=REGEX_EVAL_TIMEOUT_SECONDS,
+    isolation_mode=REGEX_ISOLATION_MODE,
+)
+
+# ============== COMBINED REGEX MATCHING ==============
+
+# Flags that can be scoped to a single alternative with (?imsx:...)
+_SCOPABLE_REGEX_FLAGS = {
+    "i": re.IGNORECASE,
+    "m": re.MULTILINE,
+    "s": re.DOTALL,
+    "x": re.VERBOSE,
+}
+_SCOPABLE_REGEX_FLAGS_MASK = re.IGNORECASE | re.MULTILINE | re.DOTALL | re.VERBOSE
+_REGEX_BASE_FLAGS = _REGEX_ENGINE.compile("").flags
+# Backreferences (\1, \g.., \k..), recursion/subroutine calls ((?1), (?-1), (?R), (?&name), (?P>name)),
+# conditionals, branch resets and global inline flags depend on the pattern's own group numbering/position
+_UNCOMBINABLE_REGEX_SYNTAX = re.compile(
+    r"\\(?:[1-9]|[gk])"
+    r"|\(\?(?:P[=>]|[(|&]|[+-]?[0-9])"
+    r"|\(\?[a-zA-Z]+\)"
+)
+
+
+class CombinedRegexMatcher(NamedTuple):
+    """One alternation over several rules plus the rules that must still run on their own."""
+    compiled: object  # combined pattern or None
+    group_to_rule: dict  # named group -> rule key
+    combined_rules: tuple  # ((rule key, compiled pattern), ...) covered by the alternation
+    standalone: tuple  # ((rule key, compiled pattern), ...) evaluated one by one
+
+
+def _invalidate_regex_rule_set(guild_id: int) -> None:
+    """Mark a guild's regex rules as changed so derived matchers are rebuilt on next use."""
+    regex_rule_set_versions[guild_id] += 1
+    regex_combined_matchers.pop(guild_id, None)
+    _forget_rule_runtime(guild_id, "regex")
+    verdict_cache = regex_verdict_caches.get(guild_id)
+    if verdict_cache is not None:
+        verdict_cache.clear()
+
+
+def _rebuild_regex_channel_index(guild_id: int) -> None:
+    """Rebuild the channel -> rule keys routing index for a guild from scratch."""
+    guild_index: dict = {}
+    for name_key, rule in regex_settings_by_guild.get(guild_id, {}).items():
+        for channel_id in rule.get("channels", set()):
+            guild_index.setdefault(channel_id, []).append(name_key)
+    if guild_index:
+        regex_channel_index[guild_id] = {channel_id: tuple(keys) for channel_id, keys in guild_index.items()}
+    else:
+        regex_channel_index.pop(guild_id, None)
+
+
+def _update_regex_channel_index(guild_id: int, name_key: str, old_channels, new_channels) -> None:
+    """Incrementally move one rule between channels in the routing index."""
+    old_channels = set(old_channels or ())
+    new_channels = set(new_channels or ())
+    guild_index = regex_channel_index.setdefault(guild_id, {})
+    for channel_id in old_channels - new_channels:
+        remaining = tuple(key for key in guild_index.get(channel_id, ()) if key != name_key)
+        if remaining:
+            guild_index[channel_id] = remaining
+        else:
+            guild_index.pop(channel_id, None)
+    for channel_id in new_channels - old_channels:
+        existing = guild_index.get(channel_id, ())
+        if name_key not in existing:
+            guild_index[channel_id] = existing + (name_key,)
+    if not guild_index:
+        regex_channel_index.pop(guild_id, None)
+
+
+def _combinable_regex_piece(compiled_pattern) -> str | None:
+    """Return compiled_pattern wrapped for use inside an alternation, or None if it must run alone."""
+    if _pattern_engine_name(compiled_pattern) != _REGEX_ENGINE_NAME:
         return None
-        
-    return result[0]
+    pattern_text = compiled_pattern.pattern
+    if not isinstance(pattern_text, str):
+        return None
+    if (compiled_pattern.flags & ~_SCOPABLE_REGEX_FLAGS_MASK) != (_REGEX_BASE_FLAGS & ~_SCOPABLE_REGEX_FLAGS_MASK):
+        return None
+    if _UNCOMBINABLE_REGEX_SYNTAX.search(pattern_text):
+        return None
+    letters = "".join(
+        letter for letter, flag in _SCOPABLE_REGEX_FLAGS.items() if compiled_pattern.flags & flag
+    )
+    # A trailing verbose-mode comment must not swallow the closing parenthesis
+    body = f"{pattern_text}\n" if "x" in letters else pattern_text
+    return f"(?{letters}:{body})" if letters else f"(?:{body})"
+
+
+def _build_combined_regex_matcher(rules: list) -> CombinedRegexMatcher:
+    """Build a matcher for [(rule key, compiled pattern), ...]."""
+    group_to_rule = {}
+    alternatives = []
+    combined_rules = []
+    standalone = []
+    for index, (name_key, compiled) in enumerate(rules):
+        piece = _combinable_regex_piece(compiled)
+        if piece is None:
+            standalone.append((name_key, compiled))
+            continue
+        group_name = f"__rule{index}"
+        group_to_rule[group_name] = name_key
+        alternatives.append(f"(?P<{group_name}>{piece})")
+        combined_rules.append((name_key, compiled))
+
+    combined = None
+    if len(alternatives) > 1:
+        try:
+            combined = _REGEX_ENGINE.compile("|".join(alternatives))
+        except Exception as exc:
+            print(f"[REGEX] Could not combine {len(alternatives)} rules, evaluating them one by one: {exc}")
+    if combined is None:
+        # Zero or one combinable rule (or compile failure): nothing to gain from an alternation
+        return CombinedRegexMatcher(None, {}, (), tuple(combined_rules + standalone))
+    return CombinedRegexMatcher(combined, group_to_rule, tuple(combined_rules), tuple(standalone))
+
+
+def _get_combined_regex_matcher(guild_id: int, rules: list) -> CombinedRegexMatcher:
+    """Return the cached matcher for this subset of a guild's rules, building it on first use."""
+    cache = regex_combined_matchers.get(guild_id)
+    if cache is None:
+        cache = OrderedDict()
+        regex_combined_matchers[guild_id] = cache
+    cache_key = (regex_rule_set_versions[guild_id], tuple(sorted(name_key for name_key, _ in rules)))
+    matcher = cache.get(cache_key)
+    if matcher is not None:
+        cache.move_to_end(cache_key)
+        return matcher
+    matcher = _build_combined_regex_matcher(rules)
+    cache[cache_key] = matcher
+    while len(cache) > REGEX_COMBINED_MATCHER_CACHE_SIZE:
+        cache.popitem(last=False)
+    return matcher
+
+
+async def _scan_with_combined_regex_matcher(
+    guild_id: int,
+    matcher: CombinedRegexMatcher,
+    text_blocks: List[str],
+    verdicts: Optional[dict] = None,
+) -> Set[str]:
+    """Scan text_blocks with the combined alternation and standalone rules, in planner order.
+
+    Returns the keys of the rules that fired; evaluation stops at the first unit that fires.
+    If verdicts is given, every rule whose outcome was actually established is recorded
+    in it as rule key -> bool. Rules cut short by a timeout or an early exit are left out.
+    """
+    fired: Set[str] = set()
+    pending = _plan_regex_units(guild_id, matcher)
+    while pending:
+        unit = pending.pop(0)
+        if unit.is_combined:
+            result = await regex_evaluation_service.evaluate(guild_id, unit.compiled, text_blocks, mode="groups")
+            _observe_rule_runtime(guild_id, "regex", unit.key, result.elapsed, bool(result.fired))
+            fired_groups = {matcher.group_to_rule.get(group) for group in result.fired}
+            for name_key, _ in matcher.combined_rules:
+                counters = _regex_rule_counters(guild_id, name_key)
+                counters.combined_scans += 1
+                if name_key in fired_groups:
+                    counters.combined_fires += 1
+            _charge_combined_regex_unit(guild_id, matcher, unit.key, result, text_blocks)
+            if result.timed_out or result.error:
+                # One slow alternative must not hide the others: fall back to per-rule evaluation
+                fallback = [PlannedRegexUnit(name_key, compiled, False) for name_key, compiled in matcher.combined_rules]
+                pending = _order_planned_units(guild_id, "regex", fallback + pending)
+                continue
+            fired.update(matcher.group_to_rule[group] for group in result.fired if group in matcher.group_to_rule)
+            if verdicts is not None:
+                if fired:
+                    # finditer reports non-overlapping matches only, so silent alternatives are not proof of a miss
+                    verdicts.update((name_key, True) for name_key in fired)
+                else:
+                    verdicts.update((name_key, False) for name_key, _ in matcher.combined_rules)
+        else:
+            result = await regex_evaluation_service.evaluate(guild_id, unit.compiled, text_blocks)
+            _observe_rule_runtime(guild_id, "regex", unit.key, result.elapsed, result.matched)
+            _charge_regex_rule(guild_id, unit.key, result.elapsed, result.matched, result.timed_out)
+            if verdicts is not None and not result.timed_out and not result.error:
+                verdicts[unit.key] = result.matched
+            if result.matched:
+                fired.add(unit.key)
+        if fired:
+            break
+    return fired
+
+# ============== RULE EVALUATION PLANNER ==============
+
+class RuleRuntimeStats:
+    """Exponentially weighted cost and match rate of one regex/spam evaluation unit."""
+
+    __slots__ = ("evaluations", "matches", "cost_ewma", "match_rate_ewma")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.cost_ewma = 0.0
+        self.match_rate_ewma = 0.0
+
+    def observe(self, elapsed: float, matched: bool) -> None:
+        self.evaluations += 1
+        if matched:
+            self.matches += 1
+        # Plain running mean until there are enough samples for the EWMA to be meaningful
+        alpha = max(RULE_PLANNER_EWMA_ALPHA, 1.0 / self.evaluations)
+        self.cost_ewma += alpha * (elapsed - self.cost_ewma)
+        self.match_rate_ewma += alpha * ((1.0 if matched else 0.0) - self.match_rate_ewma)
+
+    def rank(self) -> float:
+        """Expected cost per useful outcome; lower runs earlier. Unmeasured units run first to get measured."""
+        if not self.evaluations:
+            return 0.0
+        return self.cost_ewma / max(self.match_rate_ewma, RULE_PLANNER_MIN_MATCH_RATE)
+
+
+class PlannedRegexUnit(NamedTuple):
+    """One regex evaluation step: the combined alternation or a single standalone rule."""
+    key: object  # rule key, or ("combined", rule keys...) for the alternation
+    compiled: object
+    is_combined: bool
+
+
+def _get_rule_runtime_stats(guild_id: int, kind: str, unit_key) -> RuleRuntimeStats:
+    stats_key = (guild_id, kind, unit_key)
+    stats = rule_runtime_stats.get(stats_key)
+    if stats is None:
+        stats = RuleRuntimeStats()
+        rule_runtime_stats[stats_key] = stats
+    return stats
+
+
+def _observe_rule_runtime(guild_id: int, kind: str, unit_key, elapsed: float, matched: bool) -> None:
+    _get_rule_runtime_stats(guild_id, kind, unit_key).observe(elapsed, matched)
+
+
+def _forget_rule_runtime(guild_id: int, kind: str, name_key: str | None = None) -> None:
+    """Drop runtime stats for one rule (or all combined units) after its definition changes."""
+    for stats_key in list(rule_runtime_stats):
+        key_guild, key_kind, unit_key = stats_key
+        if key_guild != guild_id or key_kind != kind:
+            continue
+        if unit_key == name_key or (isinstance(unit_key, tuple) and unit_key[:1] == ("combined",)):
+            del rule_runtime_stats[stats_key]
+
+
+def _order_planned_units(guild_id: int, kind: str, units: list) -> list:
+    return sorted(units, key=lambda unit: _get_rule_runtime_stats(guild_id, kind, unit.key).rank())
+
+
+def _plan_regex_units(guild_id: int, matcher: CombinedRegexMatcher) -> list:
+    """Order the matcher's evaluation units by measured cost per match."""
+    units = []
+    if matcher.compiled is not None:
+        combined_key = ("combined",) + tuple(sorted(name_key for name_key, _ in matcher.combined_rules))
+        units.append(PlannedRegexUnit(combined_key, matcher.compiled, True))
+    units.extend(PlannedRegexUnit(name_key, compiled, False) for name_key, compiled in matcher.standalone)
+    return _order_planned_units(guild_id, "regex", units)
+
+
+def _describe_planned_unit(guild_id: int, kind: str, unit_key) -> str:
+    stats = _get_rule_runtime_stats(guild_id, kind, unit_key)
+    if isinstance(unit_key, tuple):
+        label = f"combined[{', '.join(unit_key[1:])}]"
+    else:
+        label = str(unit_key)
+    if not stats.evaluations:
+        return f"{label} - not measured yet"
+    return (
+        f"{label} - cost {stats.cost_ewma * 1000:.2f} ms, match rate {stats.match_rate_ewma * 100:.1f}%, "
+        f"{stats.evaluations} evals / {stats.matches} hits"
+    )
+
+# ============== REGEX RULE COUNTERS ==============
+
+class RegexRuleCounters:
+    """Lifetime counters of one regex/domain rule (slotted to stay small with many rules).
+
+    evaluations, matches, timeouts and the times only come from evaluating the rule on its
+    own; scans of the combined alternation are counted separately in combined_scans and
+    combined_fires, since they neither time a single rule nor see shadowed matches.
+    """
+
+    __slots__ = (
+        "evaluations", "matches", "timeouts", "total_time", "max_time", "deletions", "cache_hits", "prefilter_skips",
+        "combined_scans", "combined_fires",
+    )
+
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.deletions = 0
+        self.cache_hits = 0
+        self.prefilter_skips = 0
+        self.combined_scans = 0
+        self.combined_fires = 0
+
+    def record(self, elapsed: float, matched: bool, timed_out: bool = False) -> None:
+        self.evaluations += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if matched:
+            self.matches += 1
+        if timed_out:
+            self.timeouts += 1
+
+
+def _regex_rule_counters(guild_id: int, name_key: str) -> RegexRuleCounters:
+    guild_counters = regex_rule_counters[guild_id]
+    counters = guild_counters.get(name_key)
+    if counters is None:
+        counters = RegexRuleCounters()
+        guild_counters[name_key] = counters
+    return counters
+
+
+def _charge_regex_budget(budget_key: tuple, elapsed: float, timed_out: bool) -> str | None:
+    """Add one evaluation to a rolling CPU budget. Returns why it is over budget, or None."""
+    now = time.monotonic()
+    bucket_width = REGEX_RULE_BUDGET_WINDOW_SECONDS / REGEX_RULE_BUDGET_BUCKETS
+    buckets = regex_rule_budgets.get(budget_key)
+    if buckets is None:
+        buckets = deque()
+        regex_rule_budgets[budget_key] = buckets
+    while buckets and now - buckets[0][0] > REGEX_RULE_BUDGET_WINDOW_SECONDS:
+        buckets.popleft()
+    if not buckets or now - buckets[-1][0] >= bucket_width:
+        buckets.append([now, 0.0, 0])
+    buckets[-1][1] += elapsed
+    if timed_out:
+        buckets[-1][2] += 1
+
+    cpu_used = sum(bucket[1] for bucket in buckets)
+    timeouts = sum(bucket[2] for bucket in buckets)
+    if timeouts >= REGEX_RULE_MAX_TIMEOUTS:
+        return f"{timeouts} timeouts within {REGEX_RULE_BUDGET_WINDOW_SECONDS:g}s"
+    if cpu_used > REGEX_RULE_CPU_BUDGET_SECONDS:
+        return f"used {cpu_used:.2f}s CPU within {REGEX_RULE_BUDGET_WINDOW_SECONDS:g}s (budget {REGEX_RULE_CPU_BUDGET_SECONDS:g}s)"
+    return None
+
+
+def _charge_regex_rule(guild_id: int, name_key: str, elapsed: float, matched: bool, timed_out: bool = False) -> None:
+    """Record one standalone evaluation in the rule's counters and rolling CPU budget; quarantine it if over budget.
+
+    Only time measured for this rule alone may be charged here; combined scans go through
+    _charge_combined_regex_unit so one slow alternative cannot get its neighbours quarantined.
+    """
+    _regex_rule_counters(guild_id, name_key).record(elapsed, matched, timed_out)
+    reason = _charge_regex_budget((guild_id, name_key), elapsed, timed_out)
+    if reason:
+        _quarantine_regex_rule(guild_id, name_key, reason)
+
+
+def _charge_combined_regex_unit(guild_id: int, matcher: CombinedRegexMatcher, unit_key: tuple, result: RegexEvalResult, text_blocks: List[str]) -> None:
+    """Charge a combined scan to the alternation's own budget.
+
+    When the alternation runs over budget, and on every REGEX_STATS_SAMPLE_EVERY-th scan, its
+    rules are measured one by one on the same text in the background. Only those standalone
+    measurements feed per-rule stats and can quarantine a rule. A timed out scan is already
+    re-run rule by rule by the caller.
+    """
+    if result.timed_out:
+        # The caller falls back to evaluating each rule alone, which charges them individually
+        regex_rule_budgets.pop((guild_id, unit_key), None)
+        return
+    regex_combined_scan_counts[guild_id] += 1
+    sampled = regex_combined_scan_counts[guild_id] % REGEX_STATS_SAMPLE_EVERY == 0
+    reason = _charge_regex_budget((guild_id, unit_key), result.elapsed, False)
+    if reason is None and not sampled:
+        return
+    if reason is not None:
+        regex_rule_budgets.pop((guild_id, unit_key), None)
+    if guild_id in regex_standalone_measurements:
+        return
+    regex_standalone_measurements.add(guild_id)
+    if reason is not None:
+        print(f"[REGEX] Combined scan of {len(matcher.combined_rules)} rules in guild {guild_id} "
+              f"{reason}; measuring its rules one by one")
+    asyncio.get_running_loop().create_task(
+        _measure_regex_rules_standalone(guild_id, list(matcher.combined_rules), list(text_blocks))
+    )
+
+
+async def _measure_regex_rules_standalone(guild_id: int, rules: list, text_blocks: List[str]) -> None:
+    """Evaluate each (rule key, compiled) alone on text_blocks and charge it its own cost."""
+    try:
+        for name_key, compiled in rules:
+            result = await regex_evaluation_service.evaluate(guild_id, compiled, text_blocks)
+            _charge_regex_rule(guild_id, name_key, result.elapsed, result.matched, result.timed_out)
+    except Exception as exc:
+        print(f"[REGEX] Standalone measurement failed in guild {guild_id}: {exc}")
+    finally:
+        regex_standalone_measurements.discard(guild_id)
+
+
+def _quarantine_regex_rule(guild_id: int, name_key: str, reason: str) -> None:
+    rule = regex_settings_by_guild.get(guild_id, {}).get(name_key)
+    if rule is None or rule.get("quarantined"):
+        return
+    rule["quarantined"] = {"reason": reason, "since": time.time()}
+    regex_rule_budgets.pop((guild_id, name_key), None)
+    print(f"[SECURITY] Regex rule '{name_key}' quarantined in guild {guild_id}: {reason}")
+    save_settings()
+    try:
+        asyncio.get_running_loop().create_task(_post_regex_quarantine_notice(guild_id, name_key, reason))
+    except RuntimeError:
+        pass
+
+
+async def _post_regex_quarantine_notice(guild_id: int, name_key: str, reason: str) -> None:
+    channel_id = regex_modlog_channels.get(guild_id)
+    guild = bot.get_guild(guild_id)
+    channel = guild.get_channel(channel_id) if guild and channel_id else None
+    if channel is None:
+        print(f"[SECURITY] No regex mod-log channel for guild {guild_id}; set one with !regexmodlog")
+        return
+    try:
+        await channel.send(
+            f"⛔ Regex rule `{name_key}` was quarantined and is skipped until re-enabled.\n"
+            f"Reason: {reason}\n"
+            f"Fix or replace the pattern with `!regex {name_key} ...`, or re-enable it with `!regexenable {name_key}`."
+        )
+    except discord.HTTPException as e:
+        print(f"[SECURITY] HTTP error posting regex quarantine notice: {e}")
+    except Exception as e:
+        print(f"[SECURITY] Unexpected error posting regex quarantine notice: {e}")
+
+
+def _forget_regex_rule_counters(guild_id: int, name_key: str) -> None:
+    """Drop a rule's counters and CPU budget history (after it is redefined or deleted)."""
+    regex_rule_budgets.pop((guild_id, name_key), None)
+    for budget_key in [key for key in regex_rule_budgets if key[0] == guild_id and isinstance(key[1], tuple) and name_key in key[1]]:
+        del regex_rule_budgets[budget_key]  # Combined units containing the rule
+    guild_counters = regex_rule_counters.get(guild_id)
+    if guild_counters is not None:
+        guild_counters.pop(name_key, None)
+        if not guild_counters:
+            regex_rule_counters.pop(guild_id, None)
+
+# ============== REGEX LITERAL PREFILTER ==============
+
+try:
+    from re import _parser as _sre_parse, _constants as _sre_constants
+except ImportError:  # pragma: no cover - Python < 3.11
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_constants
+try:
+    import _sre
+    from re._casefix import _EXTRA_CASES as _SRE_EXTRA_CASES
+except ImportError:  # pragma: no cover
+    _sre = None
+    _SRE_EXTRA_CASES = {}
+try:
+    import ahocorasick as _ahocorasick_module  # optional 'pyahocorasick' C implementation
+except Exception:  # pragma: no cover
+    _ahocorasick_module = None
+
+REGEX_PREFILTER_MIN_LITERAL_LENGTH = 2  # Shorter literals appear in nearly every message
+REGEX_PREFILTER_MAX_LITERALS_PER_RULE = 20000
+_PREFILTER_MAX_RUN_VARIANTS = 64
+_PREFILTER_PARSE_FLAGS_MASK = re.IGNORECASE | re.MULTILINE | re.DOTALL | re.VERBOSE | re.ASCII | re.UNICODE
+# Escapes with the same meaning in re, regex and RE2; any other letter escape is engine-specific
+_PREFILTER_PORTABLE_ESCAPES = frozenset("abBdDfnrstvwWxuUNAZ0123456789")
+# regex/RE2 extensions the stdlib parser would misread instead of rejecting
+_PREFILTER_NON_STDLIB_SYNTAX = re.compile(
+    r"\(\?(?:[0-9R&|]|P>|\(DEFINE|V[01])"  # Subroutine calls, recursion, branch reset, version flags
+    r"|\{[^{}]*[eisd][^{}]*\}"  # Fuzzy matching, e.g. {e<=1}
+)
+
+
+def _pattern_is_stdlib_parsable(pattern_text: str) -> bool:
+    """True if the stdlib parser reads pattern_text the way the regex and RE2 engines do.
+
+    Rejects POSIX classes, nested sets and set operations, \\p{..}-style escapes and the
+    inline extensions above; a stdlib parse of those yields literals the engine does not require.
+    """
+    if _PREFILTER_NON_STDLIB_SYNTAX.search(pattern_text):
+        return False
+    in_class = False
+    i = 0
+    while i < len(pattern_text):
+        ch = pattern_text[i]
+        if ch == "\\":
+            escaped = pattern_text[i + 1:i + 2]
+            if escaped.isalpha() and escaped not in _PREFILTER_PORTABLE_ESCAPES:
+                return False
+            i += 2
+            continue
+        if in_class:
+            if ch == "[" or pattern_text[i:i + 2] in ("--", "&&", "||", "~~"):
+                return False
+            if ch == "]" and not class_start:
+                in_class = False
+            class_start = False
+        elif ch == "[":
+            in_class = True
+            class_start = True
+            if pattern_text[i + 1:i + 2] == "^":
+                i += 1
+        i += 1
+    return True
+
+
+def _build_prefilter_fold_table() -> dict:
+    """Map every cased character to one representative of its case-insensitive class.
+
+    Classes follow the regex engines' IGNORECASE equivalences (simple lowercase plus
+    the engine's extra cases such as i/ı and s/ſ), so folding both literals and text
+    never hides a literal that a case-insensitive pattern would match.
+    """
+    parent: dict = {}
+
+    def _find(cp):
+        while parent[cp] != cp:
+            parent[cp] = parent[parent[cp]]
+            cp = parent[cp]
+        return cp
+
+    def _union(a, b):
+        parent.setdefault(a, a)
+        parent.setdefault(b, b)
+        root_a, root_b = _find(a), _find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    for cp in range(0x1F000):
+        ch = chr(cp)
+        partners = [ord(v) for v in (ch.lower(), ch.upper(), ch.casefold()) if len(v) == 1 and v != ch]
+        if _sre is not None:
+            partners.append(_sre.unicode_tolower(cp))
+        partners.extend(_SRE_EXTRA_CASES.get(cp, ()))
+        for partner in partners:
+            if partner != cp:
+                _union(cp, partner)
+
+    table = {}
+    for cp in list(parent):
+        root = _find(cp)
+        representative = ord(chr(root).lower()) if len(chr(root).lower()) == 1 else root
+        if _find(representative) != root:
+            representative = root
+        if cp != representative:
+            table[cp] = representative
+    return table
+
+
+_PREFILTER_FOLD_TABLE = _build_prefilter_fold_table()
+
+
+def _fold_for_prefilter(text: str) -> str:
+    return text.translate(_PREFILTER_FOLD_TABLE)
+
+
+def _required_literals_of_sequence(items):
+    """Return a set of literals of which every match of items contains at least one, or None."""
+    factor_sets = []
+    run = {""}
+
+    def _close_run():
+        nonlocal run
+        if run != {""}:
+            factor_sets.append(run)
+        run = {""}
+
+    for op, av in items:
+        if op is _sre_constants.LITERAL:
+            ch = _fold_for_prefilter(chr(av))
+            run = {prefix + ch for prefix in run}
+            continue
+        if op is _sre_constants.IN and len(av) <= 4 and all(kind is _sre_constants.LITERAL for kind, _ in av):
+            chars = {_fold_for_prefilter(chr(value)) for _, value in av}
+            if len(run) * len(chars) <= _PREFILTER_MAX_RUN_VARIANTS:
+                run = {prefix + ch for prefix in run for ch in chars}
+                continue
+        _close_run()
+        nested = None
+        if op is _sre_constants.SUBPATTERN:
+            nested = _required_literals_of_sequence(av[-1])
+        elif op is getattr(_sre_constants, "ATOMIC_GROUP", None):
+            nested = _required_literals_of_sequence(av)
+        elif op in (_sre_constants.MAX_REPEAT, _sre_constants.MIN_REPEAT, getattr(_sre_constants, "POSSESSIVE_REPEAT", None)):
+            if av[0] >= 1:
+                nested = _required_literals_of_sequence(av[2])
+        elif op is _sre_constants.BRANCH:
+            alternatives = [_required_literals_of_sequence(branch) for branch in av[1]]
+            if alternatives and all(alternative for alternative in alternatives):
+                nested = set().union(*alternatives)
+        if nested:
+            factor_sets.append(nested)
+    _close_run()
+
+    best = None
+    for factor in factor_sets:
+        if best is None or (min(map(len, factor)), -len(factor)) > (min(map(len, best)), -len(best)):
+            best = factor
+    return best
+
+
+def _extract_required_literals(compiled_pattern) -> frozenset | None:
+    """Literals (folded) of which any match must contain one, or None when no prefilter applies."""
+    pattern_text = getattr(compiled_pattern, "pattern", None)
+    if not isinstance(pattern_text, str) or not pattern_text:
+        return None
+    engine_name = _pattern_engine_name(compiled_pattern)
+    if engine_name == "regex" and compiled_pattern.flags & (getattr(_REGEX_ENGINE, "FULLCASE", 0) | getattr(_REGEX_ENGINE, "V1", 0)):
+        return None  # Full case folding can match one character against several; V1 changes set syntax
+    if engine_name != "re" and not _pattern_is_stdlib_parsable(pattern_text):
+        return None  # The stdlib parser would misread engine-specific syntax
+    try:
+        parsed = _sre_parse.parse(pattern_text, compiled_pattern.flags & _PREFILTER_PARSE_FLAGS_MASK)
+    except Exception:
+        return None  # Engine-specific syntax the stdlib parser does not understand
+    literals = _required_literals_of_sequence(list(parsed))
+    if not literals or min(map(len, literals)) < REGEX_PREFILTER_MIN_LITERAL_LENGTH:
+        return None
+    if len(literals) > REGEX_PREFILTER_MAX_LITERALS_PER_RULE:
+        return None
+    return frozenset(literals)
+
+
+class _AhoCorasickAutomaton:
+    """Finds which of many literals occur in a text in a single pass."""
+
+    def __init__(self, literals):
+        self.literals = sorted(set(literals))
+        if _ahocorasick_module is not None:
+            self._native = _ahocorasick_module.Automaton()
+            for index, literal in enumerate(self.literals):
+                self._native.add_word(literal, index)
+            self._native.make_automaton()
+            return
+        self._native = None
+        goto = [{}]
+        outputs = [set()]
+        for index, literal in enumerate(self.literals):
+            state = 0
+            for ch in literal:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    outputs.append(set())
+                state = next_state
+            outputs[state].add(index)
+        fail = [0] * len(goto)
+        pending = deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, next_state in goto[state].items():
+                pending.append(next_state)
+                fallback = fail[state]
+                while fallback and ch not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(ch, 0)
+                outputs[next_state] |= outputs[fail[next_state]]
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [frozenset(output) for output in outputs]
+
+    def find(self, text: str) -> Set[int]:
+        """Return the indexes (into self.literals) of every literal found in text."""
+        found: Set[int] = set()
+        if self._native is not None:
+            for _, index in self._native.iter(text):
+                found.add(index)
+            return found
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+
+class RegexLiteralPrefilter:
+    """Per-guild automaton over the required literals of every rule."""
+
+    def __init__(self, rule_literals: dict):
+        literal_rules: dict = defaultdict(set)
+        self.unfiltered_rules: Set[str] = set()
+        for name_key, literals in rule_literals.items():
+            if not literals:
+                self.unfiltered_rules.add(name_key)
+                continue
+            for literal in literals:
+                literal_rules[literal].add(name_key)
+        self.automaton = _AhoCorasickAutomaton(literal_rules) if literal_rules else None
+        self._rules_by_index = (
+            [frozenset(literal_rules[literal]) for literal in self.automaton.literals] if self.automaton else []
+        )
+
+    def candidate_rules(self, text_blocks: List[str]) -> Set[str]:
+        """Rules that may match text_blocks: every unfiltered rule plus rules whose literal occurs."""
+        candidates = set(self.unfiltered_rules)
+        if self.automaton is None:
+            return candidates
+        for text in text_blocks:
+            for index in self.automaton.find(_fold_for_prefilter(text)):
+                candidates |= self._rules_by_index[index]
+        return candidates
+
+
+def _get_regex_prefilter(guild_id: int) -> RegexLiteralPrefilter:
+    version = regex_rule_set_versions[guild_id]
+    cached = regex_prefilters.get(guild_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    rule_literals = {
+        name_key: rule.get("literals")
+        for name_key, rule in regex_settings_by_guild.get(guild_id, {}).items()
+    }
+    prefilter = RegexLiteralPrefilter(rule_literals)
+    regex_prefilters[guild_id] = (version, prefilter)
+    return prefilter
+
+
+def _record_prefilter_outcome(guild_id: int, rules_considered: int, rules_skipped: int) -> None:
+    stats = regex_prefilter_stats[guild_id]
+    stats["messages"] += 1
+    stats["rules_considered"] += rules_considered
+    stats["rules_skipped"] += rules_skipped
+    if rules_considered and rules_skipped == rules_considered:
+        stats["messages_skipped"] += 1
+
+# ============== DOMAIN LIST RULES ==============
+
+# Host names in text: optional scheme / "www." marker, dotted labels and an alphabetic TLD (punycode allowed)
+_URL_HOST_PATTERN = re.compile(
+    r"(?:(?P<scheme>\b[a-z][a-z0-9+.-]{1,15}://)(?:[^\s/@]+@)?|(?P<www>\bwww\.))?"
+    r"(?P<host>\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59}))\b\.?",
+    re.IGNORECASE,
+)
+# Discord's own attachment hosts never count against an allow-list
+_DOMAIN_ALLOWLIST_IMPLICIT = frozenset({"cdn.discordapp.com", "media.discordapp.net"})
+DOMAIN_LIST_MODES = ("block", "allow")
+
+
+def _normalize_domain_entry(entry: str) -> str | None:
+    """Reduce 'https://*.Example.com/path' style entries to 'example.com'; None if not a domain."""
+    value = (entry or "").strip().lower()
+    if not value or value.startswith("#"):
+        return None
+    if "://" in value:
+        value = value.split("://", 1)[1]
+    value = value.split("/", 1)[0].split("?", 1)[0].split("@")[-1].split(":", 1)[0]
+    value = value.lstrip("*.").rstrip(".")
+    if value.startswith("www."):
+        value = value[4:]
+    match = _URL_HOST_PATTERN.fullmatch(value)
+    if not match or match.group("host").lower() != value:
+        return None
+    return value
+
+
+def _parse_domain_list(text: str) -> tuple[set, list]:
+    """Parse whitespace/comma/newline separated domains. Returns (domains, invalid entries)."""
+    domains: set = set()
+    invalid: list = []
+    for line in (text or "").splitlines():
+        line = line.split("#", 1)[0]
+        for token in line.replace(",", " ").split():
+            domain = _normalize_domain_entry(token)
+            if domain:
+                domains.add(domain)
+            else:
+                invalid.append(token)
+    return domains, invalid
+
+
+def _extract_url_hosts(text_blocks: List[str]) -> dict:
+    """Return {host: explicit} for every host in the blocks.
+
+    explicit means the host looked like a link (scheme, 'www.' or a following path), not a bare word.
+    """
+    hosts: dict = {}
+    for block in text_blocks:
+        text = block[:REGEX_MAX_TEXT_LENGTH]
+        for match in _URL_HOST_PATTERN.finditer(text):
+            host = match.group("host").lower()
+            explicit = bool(match.group("scheme") or match.group("www")) or text.startswith("/", match.end())
+            hosts[host] = hosts.get(host, False) or explicit
+    return hosts
+
+
+def _domain_in_list(host: str, domains) -> bool:
+    """True if host or any parent domain of it is in domains (one hash lookup per label)."""
+    if host in domains:
+        return True
+    position = host.find(".")
+    while position != -1:
+        suffix = host[position + 1:]
+        if "." not in suffix:
+            # Bare TLDs are never list entries
+            return False
+        if suffix in domains:
+            return True
+        position = host.find(".", position + 1)
+    return False
+
+
+def _domain_rule_match(rule: dict, hosts: dict) -> str | None:
+    """Return the host that makes a domain-list rule fire, or None."""
+    domains = rule.get("domains") or frozenset()
+    if rule.get("domain_mode") == "allow":
+        for host, explicit in hosts.items():
+            # Only real links are judged against an allow-list; bare words like "node.js" are not
+            if not explicit:
+                continue
+            if _domain_in_list(host, domains) or _domain_in_list(host, _DOMAIN_ALLOWLIST_IMPLICIT):
+                continue
+            return host
+        return None
+    for host in hosts:
+        if _domain_in_list(host, domains):
+            return host
+    return None
+
+
+def _describe_regex_rule_pattern(rule: dict) -> str:
+    """One-line description of what a rule matches, for listings."""
+    if rule.get("kind") == "domains":
+        return f"{rule.get('domain_mode', 'block')}-list of {len(rule.get('domains') or ())} domains"
+    if rule.get("pattern_ref"):
+        return f"stored pattern {rule['pattern_ref'][:19]}… ({rule.get('pattern_length', '?')} chars)"
+    return rule.get("pattern", "-")
+
+# ============== REGEX DEFINE-TIME PROFILER ==============
+
+# Message-like samples: typical chat, links, invites, forwarded announcements and a long wall of text
+_REGEX_PROFILE_SAMPLE_MESSAGES = (
+    "hello everyone",
+    "gg wp, see you tomorrow at the tournament",
+    "Selam arkadaşlar, bugünkü etkinlik saat 21:00'de başlıyor!",
+    "check this out https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "join us discord.gg/abcdef for free nitro",
+    "https://cdn.discordapp.com/attachments/123456789012345678/123456789012345678/image.png",
+    "<@123456789012345678> can you look at <#123456789012345678> please",
+    "FREE STEAM GIFT >>> https://steamcommunity.com.gift-claim.example/redeem?id=8841 <<<",
+    "😂😂😂 lmaooo 🔥🔥",
+    "@everyone new update is live, patch notes: https://example.com/patch-notes/2024/10/15",
+    "```py\nprint('hello world')\n```",
+    "a" * 200,
+    "spam " * 120,
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 35,
+    "https://x.com/someone/status/1234567890123456789 " * 20,
+)
+
+
+class RegexProfileReport(NamedTuple):
+    """Result of profiling one compiled pattern before it goes live."""
+    samples: int
+    median: float
+    p99: float
+    worst: float
+    worst_input: str
+    superlinear: tuple  # descriptions of inputs whose match time grows faster than linearly
+    reasons: tuple  # why the pattern was rejected or warned about
+    verdict: str  # "ok", "warn", "reject" or "disabled"
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _regex_profile_generators(compiled_pattern) -> list:
+    """Return [(label, make(n) -> str), ...] of adversarial input families derived from the pattern."""
+    pattern_text = compiled_pattern.pattern if isinstance(compiled_pattern.pattern, str) else ""
+    char_counts = Counter(ch for ch in pattern_text if ch.isalnum())
+    alphabet = [ch for ch, _ in char_counts.most_common(5)]
+    for fallback in ("a", " "):
+        if fallback not in alphabet:
+            alphabet.append(fallback)
+
+    generators = []
+    for ch in alphabet:
+        # Long run of one character followed by a breaker: the classic (x+)+$ trigger
+        generators.append((f"{ch!r}×n+'!'", lambda n, ch=ch: ch * n + "!"))
+    generators.append(("'a '×n/2", lambda n: "a " * (n // 2)))
+    generators.append(("url-like 'a.'×n/2", lambda n: "http://" + "a." * (n // 2) + "!"))
+
+    literals = _extract_required_literals(compiled_pattern) or ()
+    for literal in sorted(literals, key=len, reverse=True)[:3]:
+        if len(literal) < 2:
+            continue
+        near_miss = literal[:-1]
+        # Repeated near-misses make the engine restart its literal match at every offset
+        generators.append((
+            f"near-miss {near_miss!r}×k",
+            lambda n, near_miss=near_miss: near_miss * max(1, n // len(near_miss)),
+        ))
+    return generators
+
+
+def _growth_exponent(points: list) -> float | None:
+    """Time growth exponent k (time ~ n^k) between the two largest measurable sizes."""
+    usable = [(size, elapsed) for size, elapsed in points if elapsed >= 0.00005]
+    if len(usable) < 2:
+        return None
+    (size_a, time_a), (size_b, time_b) = usable[-2], usable[-1]
+    if size_b <= size_a or time_a <= 0:
+        return None
+    return math.log(time_b / time_a) / math.log(size_b / size_a)
+
+
+# Adversarial profiling inputs run in their own killable process, never on the production workers
+regex_profile_sandbox = RegexProcessSandbox(1)
+
+
+async def _profile_regex_pattern(guild_id: int, compiled_pattern) -> RegexProfileReport:
+    """Time compiled_pattern on realistic samples and growing adversarial inputs.
+
+    Samples run in regex_profile_sandbox with the production timeout, so a catastrophic
+    pattern costs one respawned profiling process instead of a shared evaluation worker.
+    """
+    timeout = REGEX_EVAL_TIMEOUT_SECONDS
+    profile_deadline = time.monotonic() + REGEX_PROFILE_BUDGET_SECONDS
+    timings: list = []
+    worst = (0.0, "")
+    superlinear: list = []
+    reasons: list = []
+    timed_out_input = None
+    profile_error = None
+
+    async def _time_sample(text: str, label: str) -> float | None:
+        nonlocal worst, timed_out_input, profile_error
+        result = await regex_profile_sandbox.run(compiled_pattern, [text[:REGEX_MAX_TEXT_LENGTH]], "any", timeout)
+        if result.error:
+            profile_error = profile_error or result.error
+            return None
+        if result.timed_out:
+            timed_out_input = timed_out_input or label
+            return None
+        timings.append(result.elapsed)
+        if result.elapsed > worst[0]:
+            worst = (result.elapsed, label)
+        return result.elapsed
+
+    for sample in _REGEX_PROFILE_SAMPLE_MESSAGES:
+        await _time_sample(sample, f"sample ({len(sample)} chars)")
+
+    sizes = []
+    size = 256
+    while size < REGEX_MAX_TEXT_LENGTH:
+        sizes.append(size)
+        size *= 2
+    sizes.append(REGEX_MAX_TEXT_LENGTH)
+
+    for label, make in _regex_profile_generators(compiled_pattern):
+        if timed_out_input or profile_error or time.monotonic() > profile_deadline:
+            break
+        points = []
+        for size in sizes:
+            text = make(size)
+            # Best of two runs keeps scheduler noise out of the growth estimate
+            first = await _time_sample(text, f"{label} (n={size})")
+            if first is None:
+                break
+            second = await _time_sample(text, f"{label} (n={size})")
+            if second is None:
+                break
+            points.append((len(text), min(first, second)))
+            if points[-1][1] > timeout * REGEX_PROFILE_SLOW_FRACTION or time.monotonic() > profile_deadline:
+                break
+        if timed_out_input or profile_error:
+            break
+        exponent = _growth_exponent(points)
+        if exponent is not None and exponent >= REGEX_PROFILE_SUPERLINEAR_EXPONENT:
+            superlinear.append(f"{label}: time ~ n^{exponent:.1f}")
+            last_size, last_time = points[-1]
+            projected = last_time * (REGEX_MAX_TEXT_LENGTH / last_size) ** exponent
+            if projected > timeout:
+                reasons.append(
+                    f"{label} is projected to take {projected:.1f}s on a {REGEX_MAX_TEXT_LENGTH}-char message"
+                )
+
+    ordered = sorted(timings)
+    median = _percentile(ordered, 0.5)
+    p99 = _percentile(ordered, 0.99)
+
+    verdict = "ok"
+    if timed_out_input:
+        reasons.insert(0, f"timed out (> {timeout:g}s) on {timed_out_input} - likely catastrophic backtracking")
+    if profile_error:
+        reasons.insert(0, f"could not be profiled: {profile_error}")
+    if reasons:
+        verdict = "reject"
+    else:
+        if superlinear:
+            reasons.append("match time grows faster than input length")
+        if p99 > timeout * REGEX_PROFILE_SLOW_FRACTION:
+            reasons.append(f"p99 {p99 * 1000:.1f} ms is over {int(REGEX_PROFILE_SLOW_FRACTION * 100)}% of the {timeout:g}s timeout")
+        if reasons:
+            verdict = "warn"
+
+    return RegexProfileReport(
+        samples=len(timings),
+        median=median,
+        p99=p99,
+        worst=worst[0],
+        worst_input=worst[1],
+        superlinear=tuple(superlinear),
+        reasons=tuple(reasons),
+        verdict=verdict,
+    )
+
+
+def _format_regex_profile_report(report: RegexProfileReport) -> str:
+    if report.verdict == "disabled":
+        return "➖ Profile: profiling disabled (REGEX_PROFILE_MODE=off)"
+    icon = {"ok": "✅", "warn": "⚠️", "reject": "⛔"}.get(report.verdict, "")
+    lines = [
+        f"{icon} Profile: median {report.median * 1000:.3f} ms | p99 {report.p99 * 1000:.3f} ms | "
+        f"worst {report.worst * 1000:.3f} ms ({report.worst_input or '-'}) | {report.samples} runs"
+    ]
+    for entry in report.superlinear:
+        lines.append(f"  - superlinear: {entry}")
+    for reason in report.reasons:
+        lines.append(f"  - {reason}")
+    return "\n".join(lines)
+
+
+async def _profile_regex_rule_for_commit(ctx, guild_id: int, compiled_pattern) -> RegexProfileReport | None:
+    """Profile a pattern for !regex/!setregexsettings and report it.
+
+    Returns None if the pattern must not go live.
+    """
+    if REGEX_PROFILE_MODE == "off":
+        return RegexProfileReport(0, 0.0, 0.0, 0.0, "", (), ("profiling disabled",), "disabled")
+    report = await _profile_regex_pattern(guild_id, compiled_pattern)
+    if report.verdict != "ok":
+        print(f"[REGEX_PROFILE] guild={guild_id} verdict={report.verdict} reasons={'; '.join(report.reasons)}")
+    if report.verdict == "reject" and REGEX_PROFILE_MODE == "reject":
+        await ctx.send(
+            "Regex rejected: it is too slow to run safely on live messages.\n"
+            f"{_format_regex_profile_report(report)}"
+        )
+        return None
+    return report
+
+# ============== REGEX VERDICT CACHE ==============
+
+def _regex_text_blocks_digest(text_blocks: List[str]) -> bytes:
+    """Return a stable digest of the collected text blocks (order and boundaries included)."""
+    hasher = hashlib.blake2b(digest_size=16)
+    for block in text_blocks:
+        encoded = block.encode("utf-8", "surrogatepass")
+        hasher.update(len(encoded).to_bytes(4, "little"))
+        hasher.update(encoded)
+    return hasher.digest()
+
+
+class RegexVerdictCache:
+    """Bounded LRU/TTL cache of per-rule verdicts for one guild, keyed by text digest.
+
+    Entries remember the rule-set version they were computed under, so a rule change
+    turns every older entry into a miss even before clear() is called.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # digest -> (version, expires_at, {rule key: bool})
+        self.lookups = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def lookup(self, digest: bytes, version: int) -> dict:
+        """Return the known verdicts for digest (empty dict if none are usable)."""
+        entry = self._entries.get(digest)
+        if entry is None:
+            return {}
+        entry_version, expires_at, verdicts = entry
+        if entry_version != version or expires_at <= time.monotonic():
+            del self._entries[digest]
+            return {}
+        self._entries.move_to_end(digest)
+        return verdicts
+
+    def record_lookup(self, known: int, needed: int, decided: bool = False) -> None:
+        """Count one lookup; decided means a cached match already settles the message."""
+        self.lookups += 1
+        if decided or (needed and known >= needed):
+            self.hits += 1
+        elif known:
+            self.partial_hits += 1
+        else:
+            self.misses += 1
+
+    def store(self, digest: bytes, version: int, verdicts: dict) -> None:
+        """Merge verdicts into the entry for digest and refresh its expiry."""
+        if not verdicts:
+            return
+        entry = self._entries.get(digest)
+        merged = dict(entry[2]) if entry is not None and entry[0] == version else {}
+        merged.update(verdicts)
+        self._entries[digest] = (version, time.monotonic() + self.ttl_seconds, merged)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+def _regex_scan_already_done(message_id: int, version: int, digest: bytes) -> bool:
+    """True if this message was already scanned with identical text under the same rule set."""
+    entry = regex_scan_fingerprints.get(message_id)
+    if entry is None:
+        return False
+    entry_version, entry_digest, expires_at = entry
+    if expires_at <= time.monotonic():
+        del regex_scan_fingerprints[message_id]
+        return False
+    return entry_version == version and entry_digest == digest
+
+
+def _remember_regex_scan(message_id: int, version: int, digest: bytes) -> None:
+    regex_scan_fingerprints[message_id] = (version, digest, time.monotonic() + REGEX_SCAN_FINGERPRINT_TTL_SECONDS)
+    regex_scan_fingerprints.move_to_end(message_id)
+    while len(regex_scan_fingerprints) > REGEX_SCAN_FINGERPRINT_LIMIT:
+        regex_scan_fingerprints.popitem(last=False)
+
+
+def _get_regex_verdict_cache(guild_id: int) -> RegexVerdictCache:
+    cache = regex_verdict_caches.get(guild_id)
+    if cache is None:
+        cache = RegexVerdictCache(REGEX_VERDICT_CACHE_SIZE, REGEX_VERDICT_CACHE_TTL_SECONDS)
+        regex_verdict_caches[guild_id] = cache
+    return cache
 
 def _collect_regex_text_blocks(
     message: discord.Message,
@@ -1334,8 +4037,83 @@ def _collect_regex_text_blocks(
     return [block for block in blocks if isinstance(block, str) and block.strip()]
 
 # Helper function for regex moderation (shared by on_message and on_message_edit)
-async def _check_message_against_regex(message: discord.Message):
-    """Check message against regex rules and delete if it matches"""
+def _match_domain_rules(guild_id: int, domain_rules: list, text_blocks: List[str]) -> Set[str]:
+    """Domain lists: hosts are extracted once and checked with set lookups, independent of list size."""
+    hosts = _extract_url_hosts(text_blocks)
+    if not hosts:
+        return set()
+    for name_key, rule in domain_rules:
+        started = time.perf_counter()
+        matched_host = _domain_rule_match(rule, hosts)
+        _charge_regex_rule(guild_id, name_key, time.perf_counter() - started, bool(matched_host))
+        if matched_host:
+            if DEBUG_MODE:
+                print(f"[REGEX] Domain list '{name_key}' hit host {matched_host}", flush=True)
+            return {name_key}
+    return set()
+
+
+async def _scan_regex_rules(
+    guild_id: int,
+    rules: list,
+    text_blocks: List[str],
+    text_digest: bytes,
+    rule_set_version: int,
+    verdicts: Optional[dict] = None,
+) -> Set[str]:
+    """Run [(rule key, compiled)] over text_blocks: verdict cache, then literal prefilter, then combined scan.
+
+    If verdicts is given, every rule whose outcome was established (cached or evaluated) is
+    recorded in it as rule key -> bool, as in _scan_with_combined_regex_matcher.
+    """
+    # Verdict cache: identical payloads (spam waves, repeated forwards) reuse earlier per-rule results
+    verdict_cache = _get_regex_verdict_cache(guild_id)
+    known_verdicts = verdict_cache.lookup(text_digest, rule_set_version)
+    if verdicts is not None:
+        verdicts.update((name_key, known_verdicts[name_key]) for name_key, _ in rules if name_key in known_verdicts)
+    fired_rules = {name_key for name_key, _ in rules if known_verdicts.get(name_key)}
+    unknown_rules = [(name_key, compiled) for name_key, compiled in rules if name_key not in known_verdicts]
+    verdict_cache.record_lookup(len(rules) - len(unknown_rules), len(rules), bool(fired_rules))
+    for name_key, _ in rules:
+        if name_key in known_verdicts:
+            _regex_rule_counters(guild_id, name_key).cache_hits += 1
+    if fired_rules or not unknown_rules:
+        return fired_rules
+
+    new_verdicts = {}
+    # Literal prefilter: only rules whose required literal occurs in the text need a regex pass
+    prefilter = _get_regex_prefilter(guild_id)
+    candidate_rules = prefilter.candidate_rules(text_blocks)
+    candidates = []
+    for name_key, compiled in unknown_rules:
+        if name_key in candidate_rules:
+            candidates.append((name_key, compiled))
+        else:
+            new_verdicts[name_key] = False
+            _regex_rule_counters(guild_id, name_key).prefilter_skips += 1
+    _record_prefilter_outcome(guild_id, len(unknown_rules), len(unknown_rules) - len(candidates))
+
+    if candidates:
+        matcher = _get_combined_regex_matcher(guild_id, candidates)
+        fired_rules = await _scan_with_combined_regex_matcher(guild_id, matcher, text_blocks, new_verdicts)
+    # Skip the store if rules changed while the scan was awaiting
+    if regex_rule_set_versions[guild_id] == rule_set_version:
+        verdict_cache.store(text_digest, rule_set_version, new_verdicts)
+    if verdicts is not None:
+        verdicts.update(new_verdicts)
+    return fired_rules
+
+async def _check_message_against_regex(
+    message: discord.Message,
+    is_edit: bool = False,
+    text_view: Optional[MessageTextView] = None,
+):
+    """Check message against regex rules and delete if it matches.
+
+    With is_edit=True the scan is skipped when the collected text blocks are identical
+    to the ones already scanned for this message id under the current rule set.
+    text_view lets on_message share one raw/folded view with the spam rules.
+    """
     if message.guild is None:
         return
 
@@ -1347,7 +4125,29 @@ async def _check_message_against_regex(message: discord.Message):
     except Exception:
         pass
 
-    text_blocks = _collect_regex_text_blocks(message)
+    # Route by channel first: messages in unmonitored channels cost one dict lookup
+    guild_index = regex_channel_index.get(message.guild.id)
+    if not guild_index:
+        return
+    channel_id = message.channel.id
+    # For threads (forum posts), also check parent channel ID
+    parent_id = None
+    if isinstance(message.channel, discord.Thread):
+        parent_id = message.channel.parent_id
+    routed_rule_keys = guild_index.get(channel_id, ())
+    if parent_id is not None:
+        parent_rule_keys = guild_index.get(parent_id, ())
+        if parent_rule_keys:
+            routed_rule_keys = tuple(dict.fromkeys(routed_rule_keys + parent_rule_keys))
+    if not routed_rule_keys:
+        return
+    guild_rules = regex_settings_by_guild.get(message.guild.id)
+    if not guild_rules:
+        return
+
+    if text_view is None:
+        text_view = MessageTextView(message)
+    text_blocks = text_view.blocks("raw")
     if DEBUG_MODE:
         try:
             snaps = getattr(message, 'message_snapshots', None)
@@ -1362,6 +4162,16 @@ async def _check_message_against_regex(message: discord.Message):
     if not text_blocks:
         return
 
+    rule_set_version = regex_rule_set_versions[message.guild.id]
+    text_digest = text_view.digest("raw")
+    if is_edit:
+        regex_edit_scan_stats["edits"] += 1
+        if _regex_scan_already_done(message.id, rule_set_version, text_digest):
+            regex_edit_scan_stats["edits_skipped"] += 1
+            if DEBUG_MODE:
+                print(f"[REGEX_SCAN] Edit of message {message.id} left scanned text unchanged, skipping", flush=True)
+            return
+
     # Debug logging for message scanning
     if DEBUG_MODE:
         try:
@@ -1369,233 +4179,422 @@ async def _check_message_against_regex(message: discord.Message):
         except Exception:
             pass
 
-    guild_rules = regex_settings_by_guild.get(message.guild.id)
-    if not guild_rules:
-        return
-
-    channel_id = message.channel.id
-    # For threads (forum posts), also check parent channel ID
-    parent_id = None
-    if isinstance(message.channel, discord.Thread):
-        parent_id = message.channel.parent_id
-    
-    for rule in guild_rules.values():
-        channels = rule.get("channels", set())
-        compiled = rule.get("compiled")
-        if not compiled or not channels:
+    author_role_ids = {r.id for r in getattr(message.author, "roles", [])}
+    # { input mode: ([(rule key, compiled)], [(rule key, domain rule)]) }
+    rules_by_input = {input_mode: ([], []) for input_mode in RULE_INPUT_MODES}
+    for name_key in routed_rule_keys:
+        rule = guild_rules.get(name_key)
+        if not rule or rule.get("quarantined"):
             continue
-        # Check if message is in a monitored channel or thread within a monitored channel
-        if channel_id not in channels:
-            if parent_id is None or parent_id not in channels:
-                if DEBUG_MODE:
-                    try:
-                        print(f"[DEBUG] Message not in monitored channels. Channel: {channel_id}, Parent: {parent_id}, Monitored count: {len(channels)}", flush=True)
-                    except Exception:
-                        pass
-                continue
 
-        if not any(_safe_regex_search(compiled, text) for text in text_blocks):
+        # Exemptions are resolved before matching so the combined scan only covers rules that can act
+        if message.author.id in rule.get("exempt_users", set()):
+            continue
+        if author_role_ids & rule.get("exempt_roles", set()):
+            continue
+        regex_rules, domain_rules = rules_by_input.get(rule.get("input", "raw"), rules_by_input["raw"])
+        if rule.get("kind") == "domains":
+            domain_rules.append((name_key, rule))
+            continue
+        compiled = rule.get("compiled")
+        if not compiled:
             continue
+        regex_rules.append((name_key, compiled))
 
-        exempt_users = rule.get("exempt_users", set())
-        if message.author.id in exempt_users:
+    # Each rule reads raw or folded blocks; the folded view is only built if some rule asks for it
+    fired_rules: Set[str] = set()
+    scan_verdicts = {}
+    for input_mode, (regex_rules, domain_rules) in rules_by_input.items():
+        if not regex_rules and not domain_rules:
             continue
-        exempt_roles = rule.get("exempt_roles", set())
-        author_roles = getattr(message.author, "roles", [])
-        if any(r.id in exempt_roles for r in author_roles):
+        mode_blocks = text_view.blocks(input_mode)
+        if not mode_blocks:
+            scan_verdicts.update((name_key, False) for name_key, _ in regex_rules)
             continue
+        if domain_rules:
+            fired_rules = _match_domain_rules(message.guild.id, domain_rules, mode_blocks)
+        if not fired_rules and regex_rules:
+            fired_rules = await _scan_regex_rules(
+                message.guild.id, regex_rules, mode_blocks, text_view.digest(input_mode), rule_set_version, scan_verdicts
+            )
+        if fired_rules:
+            break
 
-        try:
+    # Only a finished scan may let a later edit with the same text skip scanning; a timeout or
+    # error leaves some rule without a verdict, and the next edit must try again
+    if fired_rules or all(
+        name_key in scan_verdicts for regex_rules, _ in rules_by_input.values() for name_key, _ in regex_rules
+    ):
+        _remember_regex_scan(message.id, rule_set_version, text_digest)
+
+    if not fired_rules:
+        return
+    if DEBUG_MODE:
+        print(f"[REGEX] Rules fired in channel {channel_id}: {', '.join(sorted(fired_rules))}", flush=True)
+
+    try:
+        await message_deletion_coalescer.delete(message)
+        for name_key in fired_rules:
+            _regex_rule_counters(message.guild.id, name_key).deletions += 1
+    except discord.Forbidden:
+        print(f"[SECURITY] Bot lacks permission to delete message in {message.channel}")
+    except discord.NotFound:
+        print(f"[SECURITY] Message already deleted in {message.channel}")
+    except discord.HTTPException as e:
+        print(f"[SECURITY] HTTP error deleting message: {e}")
+    except Exception as e:
+        print(f"[SECURITY] Unexpected error deleting message: {e}")
+
+async def _regex_rule_matches_message(guild_id: int, name_key: str, rule: dict, message: discord.Message) -> bool:
+    """Evaluate one rule against an already posted message, with the same exemptions as live scanning."""
+    if message.author.id in rule.get("exempt_users", set()):
+        return False
+    if {r.id for r in getattr(message.author, "roles", [])} & rule.get("exempt_roles", set()):
+        return False
+    text_view = MessageTextView(message)
+    input_mode = rule.get("input", "raw")
+    text_blocks = text_view.blocks(input_mode)
+    if not text_blocks:
+        return False
+    if rule.get("kind") == "domains":
+        return bool(_match_domain_rules(guild_id, [(name_key, rule)], text_blocks))
+    fired = await _scan_regex_rules(
+        guild_id,
+        [(name_key, rule["compiled"])],
+        text_blocks,
+        text_view.digest(input_mode),
+        regex_rule_set_versions[guild_id],
+    )
+    return name_key in fired
+
+
+# ============== MESSAGE DELETION COALESCER ==============
+
+def _settle_deletion_futures(futures: list, exc: BaseException | None = None) -> None:
+    for future in futures:
+        if future.done():
+            continue  # Caller gave up waiting (cancelled)
+        if exc is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exc)
+
+
+class MessageDeletionCoalescer:
+    """Gathers rule-triggered deletions per channel over a short window and sends them as bulk deletes.
+
+    During a raid this turns hundreds of per-message DELETE calls, each counted against the
+    per-route rate limit, into one bulk call per channel per window. Every caller still awaits
+    its own message's outcome: delete() returns normally or raises the discord exception that
+    message.delete() would have raised.
+    """
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._pending: dict = {}  # channel id -> { message id: (message, [futures]) }
+        self._timers: dict = {}  # channel id -> task flushing that channel when the window ends
+        self._flushes: Set[asyncio.Task] = set()  # strong references to full-batch flushes
+
+    async def delete(self, message, bulk_only: bool = False) -> None:
+        """Delete message with the next bulk call for its channel.
+
+        bulk_only flushes only when a full batch has gathered or the window ends, for callers
+        such as !regexscan that submit many messages at once; it makes no difference to the outcome.
+        """
+        if self.window_seconds <= 0 and not bulk_only:
             await message.delete()
-        except discord.Forbidden:
-            print(f"[SECURITY] Bot lacks permission to delete message in {message.channel}")
-        except discord.NotFound:
-            print(f"[SECURITY] Message already deleted in {message.channel}")
-        except discord.HTTPException as e:
-            print(f"[SECURITY] HTTP error deleting message: {e}")
-        except Exception as e:
-            print(f"[SECURITY] Unexpected error deleting message: {e}")
-        break
+            return
+        channel = message.channel
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(channel.id, {})
+        entry = batch.get(message.id)
+        if entry is None:
+            batch[message.id] = (message, [future])
+        else:
+            entry[1].append(future)  # Regex and spam rules both deleting the same message
+        if len(batch) >= BULK_DELETE_BATCH:
+            timer = self._timers.pop(channel.id, None)
+            if timer is not None:
+                timer.cancel()
+            task = asyncio.create_task(self._flush(channel, self._pending.pop(channel.id)))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        elif channel.id not in self._timers:
+            self._timers[channel.id] = asyncio.create_task(self._flush_after_window(channel))
+        await future
+
+    async def _flush_after_window(self, channel):
+        await asyncio.sleep(max(self.window_seconds, 0.05))
+        self._timers.pop(channel.id, None)
+        batch = self._pending.pop(channel.id, None)
+        if batch:
+            await self._flush(channel, batch)
+
+    async def _flush(self, channel, batch: dict):
+        cutoff = discord.utils.utcnow() - timedelta(seconds=BULK_DELETE_MAX_AGE_SECONDS)
+        entries = list(batch.values())
+        bulk = [entry for entry in entries if entry[0].created_at > cutoff]
+        # Messages too old for bulk deletion go through the single-message route
+        singles = [entry for entry in entries if entry[0].created_at <= cutoff]
+        if len(bulk) > 1 and hasattr(channel, "delete_messages"):
+            try:
+                await channel.delete_messages([message for message, _ in bulk])
+            except discord.Forbidden as exc:
+                for _, futures in entries:
+                    _settle_deletion_futures(futures, exc)
+                return
+            except Exception as exc:
+                print(f"[SECURITY] Bulk delete of {len(bulk)} messages in {channel} failed, deleting one by one: {exc}")
+                singles = bulk + singles
+            else:
+                for _, futures in bulk:
+                    _settle_deletion_futures(futures)
+        else:
+            singles = bulk + singles
+        for message, futures in singles:
+            try:
+                await message.delete()
+            except Exception as exc:
+                _settle_deletion_futures(futures, exc)
+            else:
+                _settle_deletion_futures(futures)
+
+
+message_deletion_coalescer = MessageDeletionCoalescer(MESSAGE_DELETE_COALESCE_SECONDS)
 
-async def _check_message_against_spam_rules(message: discord.Message):
+
+async def _bulk_delete_channel_messages(channel, messages: list) -> int:
+    """Delete messages from one channel through the coalescer. Returns how many were deleted.
+
+    Raises discord.Forbidden if the bot may not delete messages there.
+    """
+    outcomes = await asyncio.gather(
+        *(message_deletion_coalescer.delete(message, bulk_only=True) for message in messages),
+        return_exceptions=True,
+    )
+    deleted = 0
+    for message, outcome in zip(messages, outcomes):
+        if outcome is None:
+            deleted += 1
+        elif isinstance(outcome, discord.Forbidden):
+            raise outcome
+        elif not isinstance(outcome, discord.NotFound):
+            print(f"[SECURITY] Error deleting message {message.id}: {outcome}")
+    return deleted
+
+
+async def _check_message_against_spam_rules(message: discord.Message, text_view: Optional[MessageTextView] = None):
     """Check message against custom spam rules and apply configured actions"""
     if message.author.bot:
         return
     if message.guild is None:
         return
 
-    # Skip security managers / authorized users
-    author_roles = getattr(message.author, "roles", []) or []
-    if security_authorized_role_ids and any(r.id in security_authorized_role_ids for r in author_roles):
+    guild_rules = spam_rules_by_guild.get(message.guild.id)
+    if not guild_rules:
         return
+
+    # Skip security managers / authorized users
     if message.author.id in security_authorized_ids:
         return
-    if any(r.id in security_authorized_ids for r in author_roles):
+    user_role_ids = {role.id for role in getattr(message.author, "roles", None) or ()}
+    if user_role_ids and not (user_role_ids.isdisjoint(security_authorized_role_ids) and user_role_ids.isdisjoint(security_authorized_ids)):
         return
 
-    guild_rules = spam_rules_by_guild.get(message.guild.id)
-    if not guild_rules:
-        return
-
-    content = message.content or ""
+    if text_view is None:
+        text_view = MessageTextView(message)
+    content = text_view.content("raw")
     if not content:
         return
 
-    content_tokens = _extract_word_tokens(content)
-
-    now = time.time()
-    history_key = (message.guild.id, message.author.id)
-    user_history = spam_message_history[history_key]
-
-    is_reply = _is_message_reply(message)
-
-    max_window = 0
-    for rule in guild_rules.values():
-        window = rule.get("time_window", 0)
-        if window > max_window:
-            max_window = window
-
-    if max_window > 0:
-        user_history[:] = [entry for entry in user_history if now - entry["timestamp"] <= max_window]
-    else:
-        user_history.clear()
+    now = time.time()
+    history_key = (message.guild.id, message.author.id)
+    is_reply = _is_message_reply(message)
 
-    user_history.append({
-        "timestamp": now,
-        "content": content,
-        "is_reply": is_reply,
-        "channel_id": message.channel.id,
-        "tokens": content_tokens,
-    })
+    current_entry = SpamHistoryEntry(now, content, is_reply, message.channel.id)
+    user_history = spam_message_history.record(history_key, current_entry, spam_rule_max_windows.get(message.guild.id, 0))
 
+    # Planner phase 1: cheap predicates (config, channel, role, reply, length) over every rule
+    channel_id = message.channel.id
+    eligible_rules = []
     for name_key, rule in guild_rules.items():
-        # Check excluded channels first
-        excluded_channels = rule.get("excluded_channels", set())
-        if excluded_channels and message.channel.id in excluded_channels:
+        # Window, count and a regex or similarity threshold were validated when the rule was built
+        if not rule.evaluable:
             continue
-
-        # Check included channels
-        channels = rule.get("channels", set())
-        if channels and message.channel.id not in channels:
+        if channel_id in rule.excluded_channels:
+            continue
+        if rule.channels and channel_id not in rule.channels:
+            continue
+        # User has at least one exempted role
+        if not rule.exempted_roles.isdisjoint(user_role_ids):
+            continue
+        # User has none of the targeted roles
+        if rule.targeted_roles and rule.targeted_roles.isdisjoint(user_role_ids):
             continue
-
-        # Check exempted roles first
-        exempted_roles = rule.get("exempted_roles", set())
-        if exempted_roles:
-            user_role_ids = {role.id for role in message.author.roles}
-            if user_role_ids & exempted_roles:  # User has at least one exempted role
-                continue
-
-        # Check targeted roles
-        targeted_roles = rule.get("targeted_roles", set())
-        if targeted_roles:
-            user_role_ids = {role.id for role in message.author.roles}
-            if not (user_role_ids & targeted_roles):  # User has none of the targeted roles
-                continue
-
-        nonreply_only = rule.get("nonreply_only", False)
         # Skip this rule for reply messages if nonreply_only is enabled
-        if nonreply_only and is_reply:
+        if rule.nonreply_only and is_reply:
             continue
-
-        min_length = rule.get("min_length", 0)
-        if min_length and len(content) <= min_length:
+        if rule.min_length and len(text_view.content(rule.input)) <= rule.min_length:
             continue
-
-        time_window = rule.get("time_window", 0)
-        if time_window <= 0:
+        eligible_rules.append((name_key, rule))
+
+    # Planner phase 2: every eligible matcher runs, in rule order. Their window counts and the
+    # cross-user index must see each message, so there is no early exit for an ordering to speed up
+    for name_key, rule in eligible_rules:
+        started = time.perf_counter()
+        if rule.cross_user:
+            flagged = _record_crossuser_message(message, name_key, rule, text_view, now)
+            triggered = bool(flagged)
+        else:
+            triggered = await _evaluate_spam_rule_matcher(message, name_key, rule, text_view, user_history, current_entry, now)
+        _observe_rule_runtime(message.guild.id, "spam", name_key, time.perf_counter() - started, triggered)
+        if not triggered:
             continue
+        if rule.cross_user:
+            await _handle_crossuser_spam_trigger(message, name_key, rule, flagged)
+        else:
+            await _handle_spam_rule_trigger(message, name_key, rule)
 
-        message_count = rule.get("message_count", 0)
-        if message_count < 1:
-            continue
 
-        # Check if this is a regex-based rule or similarity-based rule
-        regex_pattern_str = rule.get("regex_pattern")
-        similarity_threshold = rule.get("similarity_threshold", 0.0)
+def _spam_history_window(user_history: deque, cutoff: float):
+    """Entries of a time-ordered history with timestamp >= cutoff, newest first, without copying it."""
+    return itertools.takewhile(lambda entry: entry.timestamp >= cutoff, reversed(user_history))
 
-        # For similarity mode, require similarity_threshold > 0
-        # For regex mode, regex_pattern must be set
-        if not regex_pattern_str and similarity_threshold <= 0:
-            continue
 
-        relevant_messages = [
-            entry
-            for entry in user_history
-            if now - entry["timestamp"] <= time_window
-            and (
-                not channels
-                or entry.get("channel_id") is None
-                or entry["channel_id"] in channels
-            )
-        ]
+async def _evaluate_spam_rule_matcher(
+    message: discord.Message,
+    rule_key: str,
+    rule: SpamRule,
+    text_view: MessageTextView,
+    user_history: deque,
+    current_entry: SpamHistoryEntry,
+    now: float,
+) -> bool:
+    """Run the expensive part of one spam rule (window scan + regex/similarity). True if it triggers.
+
+    current_entry is the history entry recorded for message. It is not necessarily the newest
+    entry: more messages of the same user may be appended while this evaluation awaits.
+    """
+    input_mode = rule.input
+    channels = rule.channels
+    nonreply_only = rule.nonreply_only
+    time_window = rule.time_window
+    message_count = rule.message_count
+    similarity_threshold = rule.similarity_threshold
+
+    def _in_rule_scope(entry: SpamHistoryEntry) -> bool:
+        if now - entry.timestamp > time_window:
+            return False
+        if channels and entry.channel_id is not None and entry.channel_id not in channels:
+            return False
         # Filter out reply messages for nonreply_only rules
-        if nonreply_only:
-            relevant_messages = [
-                entry for entry in relevant_messages
-                if not _coerce_bool(entry.get("is_reply", False))
-            ]
-        if len(relevant_messages) < message_count:
-            continue
-
-        if regex_pattern_str:
-            # REGEX MODE: Count messages that match the regex pattern
-            try:
-                compiled_pattern = re.compile(regex_pattern_str, re.IGNORECASE)
-            except re.error:
-                continue  # Invalid regex, skip this rule
-
-            # Check if CURRENT message matches regex
-            current_matches_regex = bool(compiled_pattern.search(content))
-
-            # Only count messages that match regex
-            matching_count = 0
-            for entry in relevant_messages:
-                entry_content = entry.get("content", "")
-                if compiled_pattern.search(entry_content):
-                    matching_count += 1
-
-            # Only trigger if count exceeded AND current message matches regex
-            if matching_count > message_count and current_matches_regex:
-                await _handle_spam_rule_trigger(message, name_key, rule)
-                continue
-        else:
-            # SIMILARITY MODE: Original behavior
-            similar_count = 0
-            for entry in relevant_messages:
-                entry_content = entry.get("content", "")
-                char_ratio = SequenceMatcher(None, content, entry_content).ratio() if entry_content else 0.0
-
-                entry_tokens = entry.get("tokens")
-                if entry_tokens is None:
-                    entry_tokens = _extract_word_tokens(entry_content)
-                    entry["tokens"] = entry_tokens
-
-                token_ratio = _token_multiset_similarity(content_tokens, entry_tokens)
-                ratio = max(char_ratio, token_ratio)
-                if ratio >= similarity_threshold:
-                    similar_count += 1
-            if similar_count > message_count:
-                await _handle_spam_rule_trigger(message, name_key, rule)
-                continue
+        return not (nonreply_only and entry.flags & SpamHistoryEntry.FLAG_REPLY)
+
+    # Check if this is a regex-based rule or similarity-based rule
+    compiled_pattern = rule.compiled_regex
+    if compiled_pattern is not None:
+        # REGEX MODE: Count messages that match the regex pattern (compiled once when the rule was built)
+        guild_id = message.guild.id
+        epoch = spam_regex_memo_epochs[guild_id]
+        bit = spam_regex_rule_bits.get(guild_id, {}).get(rule_key)
+        if bit is None or not user_history:
+            return False
+        user_counts = spam_regex_running_counts.setdefault((guild_id, message.author.id), {})
+        running = user_counts.get(rule_key)
+        if running is None or running.rule is not rule or running.epoch != epoch:
+            running = SpamRegexRunningCount(rule, epoch)
+            user_counts[rule_key] = running
+
+        # Only entries the running count has not seen are evaluated, each at most once per rule version.
+        # Entries another task is still evaluating are evaluated here too; storing a result twice is harmless.
+        unevaluated = [
+            entry for entry in _spam_regex_pending_entries(running, user_history, now - time_window)
+            if _in_rule_scope(entry) and _spam_regex_memo_lookup(entry, epoch, bit) is None
+        ]
+        if unevaluated:
+            result = await regex_evaluation_service.evaluate(
+                guild_id,
+                compiled_pattern,
+                # History keeps truncated content; the current message is matched in full
+                [
+                    text_view.content(input_mode) if entry is current_entry else entry.view(input_mode)[0]
+                    for entry in unevaluated
+                ],
+                mode="each",
+            )
+            if result.timed_out or result.error:
+                return False  # Nothing was recorded; these entries are retried next time
+            if spam_regex_memo_epochs[guild_id] != epoch:
+                return False  # The rules changed while matching; the results belong to the old rule set
+            for entry, hit in zip(unevaluated, result.per_text):
+                _spam_regex_memo_store(entry, epoch, bit, hit)
+
+        # Advance the running count without awaiting, so concurrent evaluations of the same user
+        # never count an entry twice. It stops at the first entry whose result is still pending
+        # (appended while this call awaited); the task that owns that entry counts it.
+        for entry in _spam_regex_pending_entries(running, user_history, now - time_window):
+            if _in_rule_scope(entry):
+                matched = _spam_regex_memo_lookup(entry, epoch, bit)
+                if matched is None:
+                    break
+                if matched:
+                    running.hits.append((entry.timestamp, entry))
+            running.last_entry = entry
+
+        current_matches_regex = bool(_spam_regex_memo_lookup(current_entry, epoch, bit))
+        # Only count messages that match regex, and only trigger if count exceeded AND current message matches
+        matching_count = running.expire(now - time_window)
+        return matching_count > message_count and current_matches_regex
+
+    # SIMILARITY MODE: every in-scope window entry is judged by the exact metric; LSH candidates
+    # go first so the count is usually settled before the whole window has been compared
+    window = [entry for entry in _spam_history_window(user_history, now - time_window) if _in_rule_scope(entry)]
+    needed = message_count + 1
+    if len(window) < needed:
+        return False
+    # The current message is compared through the same truncated view as the history
+    content, token_counts = current_entry.view(input_mode)
+    if similarity_threshold >= SPAM_LSH_MIN_THRESHOLD:
+        index = _spam_similarity_index(message.guild.id, message.author.id, input_mode, user_history)
+        likely = {id(entry) for entry in index.candidates(_minhash_band_keys(_history_entry_signature(current_entry, input_mode)))}
+        window.sort(key=lambda entry: id(entry) not in likely)
+    similar_count = 0
+    for position, entry in enumerate(window):
+        entry_content, entry_token_counts = entry.view(input_mode)
+        if _spam_entries_similar(content, token_counts, entry_content, entry_token_counts, similarity_threshold):
+            similar_count += 1
+            if similar_count >= needed:
+                return True
+        elif similar_count + len(window) - position - 1 < needed:
+            return False
+    return False
 
-async def _handle_spam_rule_trigger(message: discord.Message, rule_key: str, rule: dict):
-    """Execute actions when a spam rule is triggered"""
-    guild_id = message.guild.id
-    user_id = message.author.id
+def _claim_spam_trigger(guild_id: int, user_id: int, rule_key: str, rule: SpamRule) -> bool:
+    """Log a trigger of rule_key by user_id, unless the rule's trigger cooldown is still running."""
     now = time.time()
-
     cooldown = max(rule.get("trigger_cooldown", 0), 0)
     last_trigger = spam_rule_trigger_log.get((guild_id, user_id, rule_key))
     if last_trigger and now - last_trigger < cooldown:
-        return
-
+        return False
     spam_rule_trigger_log[(guild_id, user_id, rule_key)] = now
+    return True
 
-    await record_spam_violation(guild_id, user_id, rule_key, label=rule.get("label", rule_key))
 
-    # Save spam message history to persist across restarts
-    save_security_settings()
+async def _handle_spam_rule_trigger(message: discord.Message, rule_key: str, rule: SpamRule, persist: bool = True):
+    """Execute actions when a spam rule is triggered.
+
+    With persist=False nothing is written to disk; the caller saves once for its whole batch.
+    """
+    guild_id = message.guild.id
+    user_id = message.author.id
+    if not _claim_spam_trigger(guild_id, user_id, rule_key, rule):
+        return
+
+    await record_spam_violation(guild_id, user_id, rule_key, label=rule.get("label", rule_key), persist=persist)
+
+    if persist:
+        # Save spam message history to persist across restarts
+        save_security_settings()
 
     mod_action = (rule.get("mod_action") or "").lower()
     dm_message = rule.get("dm_message")
@@ -1624,17 +4623,18 @@ async def _handle_spam_rule_trigger(message: discord.Message, rule_key: str, rul
     delete_error: str | None = None
     if should_delete:
         try:
-            await message.delete()
+            await message_deletion_coalescer.delete(message)
             delete_success = True
             # Remove the deleted message from history so it doesn't count toward future spam checks
             history_key = (message.guild.id, message.author.id)
-            user_history = spam_message_history.get(history_key, [])
+            user_history = spam_message_history.get(history_key, ())
             # Remove entries matching this message content (within 2 seconds)
             current_time = time.time()
-            user_history[:] = [
+            removed_entries = [
                 entry for entry in user_history
-                if not (entry.get("content") == message_content_snapshot and abs(entry.get("timestamp", 0) - current_time) < 2)
+                if entry.content == message_content_snapshot[:SPAM_HISTORY_CONTENT_LIMIT] and abs(entry.timestamp - current_time) < 2
             ]
+            spam_message_history.remove_entries(history_key, removed_entries)
         except discord.NotFound:
             delete_error = "Message already deleted"
             print(f"[SECURITY] Message already deleted when applying spam rule '{rule_key}'")
@@ -1675,9 +4675,13 @@ async def _handle_spam_rule_trigger(message: discord.Message, rule_key: str, rul
                     outcome_bits.append("Message deleted" if delete_success else f"Delete failed{f' ({delete_error})' if delete_error else ''}")
                 outcome_text = ", ".join(outcome_bits) if outcome_bits else "N/A"
 
+                if rule.get("cross_user"):
+                    criteria = f"Same content from > {rule.get('message_count', 0)} users"
+                else:
+                    criteria = f"Similarity ≥ {int(rule.get('similarity_threshold', 0.0) * 100)}% | Count ≥ {rule.get('message_count', 0)}"
                 await channel.send(
                     f"⚠️ Spam rule `{label}` triggered by {message.author.mention} in {message.channel.mention}.\n"
-                    f"Window: {window_seconds} seconds | Similarity ≥ {int(rule.get('similarity_threshold', 0.0) * 100)}% | Count ≥ {rule.get('message_count', 0)}\n"
+                    f"Window: {window_seconds} seconds | {criteria}\n"
                     f"Action: {action_summary} | Outcome: {outcome_text}\n"
                     f"Recent message:\n```{preview}```"
                 )
@@ -1688,6 +4692,34 @@ async def _handle_spam_rule_trigger(message: discord.Message, rule_key: str, rul
         else:
             print(f"[SECURITY] Notification channel {notify_channel_id} not found for spam rule '{rule_key}'")
 
+async def _handle_crossuser_spam_trigger(message: discord.Message, rule_key: str, rule: SpamRule, flagged: list):
+    """Apply a cross-user rule to the current message and to the earlier ones that took it over the threshold.
+
+    Earlier messages still in the message cache get the full rule action; for the others the
+    violation is recorded and the message can only be deleted, since it is no longer at hand.
+    Settings and violation stats are saved once for the whole batch.
+    """
+    earlier = [record for record in flagged if record[2] != message.id]
+    cached = {cached_message.id: cached_message for cached_message in bot.cached_messages} if earlier else {}
+    should_delete = (rule.mod_action or "").lower() in {"delete", "warnanddelete"}
+    actions = [_handle_spam_rule_trigger(message, rule_key, rule, persist=False)]
+    for _, user_id, message_id, channel_id in earlier:
+        earlier_message = cached.get(message_id)
+        if earlier_message is not None:
+            actions.append(_handle_spam_rule_trigger(earlier_message, rule_key, rule, persist=False))
+            continue
+        if _claim_spam_trigger(message.guild.id, user_id, rule_key, rule):
+            actions.append(record_spam_violation(message.guild.id, user_id, rule_key, label=rule.get("label", rule_key), persist=False))
+        channel = message.guild.get_channel(channel_id)
+        if should_delete and channel is not None and hasattr(channel, "get_partial_message"):
+            actions.append(message_deletion_coalescer.delete(channel.get_partial_message(message_id)))
+    outcomes = await asyncio.gather(*actions, return_exceptions=True)
+    failures = [outcome for outcome in outcomes if isinstance(outcome, Exception) and not isinstance(outcome, discord.NotFound)]
+    if failures:
+        print(f"[SECURITY] Cross-user spam rule '{rule_key}': {len(failures)} of {len(actions)} actions failed ({failures[0]})")
+    save_security_settings()
+    await _save_spam_violation_stats()
+
 # Message moderation via regex
 @bot.event
 async def on_message(message: discord.Message):
@@ -1720,18 +4752,21 @@ async def on_message(message: discord.Message):
         await bot.process_commands(message)
         return
     
+    # One shared view: raw text is collected once and folded at most once for all rules
+    text_view = MessageTextView(message)
+
     # Check message against regex rules
-    await _check_message_against_regex(message)
+    await _check_message_against_regex(message, text_view=text_view)
 
     # Check custom spam rules
-    await _check_message_against_spam_rules(message)
+    await _check_message_against_spam_rules(message, text_view=text_view)
 
 # Message edit moderation via regex
 @bot.event
 async def on_message_edit(before: discord.Message, after: discord.Message):
     """Check edited messages against regex rules"""
-    # Only check the edited message (after)
-    await _check_message_against_regex(after)
+    # Only check the edited message (after); unchanged text (embed/snapshot resolution) is skipped
+    await _check_message_against_regex(after, is_edit=True)
 
 # Button interaction handler - Add this to fix the interaction failed issue
 @bot.event
@@ -2182,7 +5217,8 @@ async def securityhelp(ctx):
         "9. **!securityaudit**\n"
         "   - Description: Shows security audit log with recent security actions.\n\n"
         "10. **!regex <regexsettingsname> <regex>**\n"
-        "   - Description: Defines/updates a regex rule with the given name. Supports `/pattern/flags` or `pattern --flags imsx`.\n\n"
+        "   - Description: Defines/updates a regex rule with the given name. Supports `/pattern/flags` or `pattern --flags imsx`.\n"
+        "   - The pattern is timed against sample and adversarial messages first; patterns that would time out are rejected.\n\n"
         "11. **!setregexsettings <regexsettingsname> <channels>**\n"
         "   - Description: Assigns which channels the regex rule applies to. You can specify multiple channels by ID or #mention.\n"
         "   - Also supported: `!setregexsettings <name> allchannel notchannel <channels_to_exclude>` → apply to all text channels except the ones listed.\n\n"
@@ -2192,7 +5228,7 @@ async def securityhelp(ctx):
         "   - Description: Shows active regex rules and their details (channels and exemptions). Provide a name to see only that rule.\n\n"
         "14. **!delregexsettings <regexsettingsname>**\n"
         "   - Description: Deletes the specified regex setting from this server.\n\n"
-        "15. **!spamrule** - Two modes available:\n"
+        "15. **!spamrule** - Three modes available:\n"
         "   **Mod Actions:** `mod warn` (DM only), `mod delete` (delete msg), `mod warnanddelete` (both)\n\n"
         "   **Time Format:** `s`=saniye, `min`=dakika, `h`=saat, `d`=gun, `m`=ay(30 gun)\n"
         "   Examples: `30s`, `5min`, `1h`, `24h`, `7d`, `30d`, `1m`, `12m`\n\n"
@@ -2213,6 +5249,10 @@ async def securityhelp(ctx):
         "   - Detects messages matching a regex pattern.\n"
         "   - Example: `!spamrule linkspam mod warn regex \"https?://\\S+\" 1h message>2 dm \"Links!\" modlogchannel #alerts channels #general #chat`\n"
         "   - Example: `!spamrule invitespam mod delete regex \"discord\\.gg/\\S+\" 24h message>3 dm \"No spam\" modlogchannel #mod-log channels allchannel notchannel #bot`\n\n"
+        "   **Cross-User Mode:**\n"
+        "   `!spamrule <name> [mod action] crossuser [characters>X] <duration> users>N dm \"text\" modlogchannel #ch [channels ...]`\n"
+        "   - Detects the same message (ignoring case, spacing and punctuation) posted by more than N different users within the duration, e.g. raids.\n"
+        "   - Example: `!spamrule raid mod warnanddelete crossuser characters>20 5min users>5 dm \"Raid detected\" modlogchannel #alerts`\n\n"
         "16. **!removespamrule <rulename>**\n"
         "   - Description: Removes a spam detection rule.\n\n"
         "17. **!spamrules [rulename]**\n"
@@ -2237,7 +5277,32 @@ async def securityhelp(ctx):
         "   - Description: Reloads all bot settings from JSON file.\n\n"
         "25. **!savesecurity**\n"
         "   - Description: Manually saves security settings to security_settings.json.\n\n"
-        "26. **!securityhelp**\n"
+        "26. **!regexprefilter**\n"
+        "   - Description: Shows which literals gate each regex setting and how often the prefilter skipped evaluation.\n\n"
+        "27. **!regexcache [clear]**\n"
+        "   - Description: Shows regex verdict cache hit rates for identical message payloads, or clears the cache.\n\n"
+        "28. **!ruleplan [#channel]**\n"
+        "   - Description: Shows the order regex and spam rules are evaluated in, with measured cost and match rate.\n\n"
+        "29. **!domainlist <name> block|allow <domains...>**\n"
+        "   - Description: Creates a domain block-list or allow-list rule (domains inline or as a TXT attachment). Subdomains are included. Assign channels and exemptions with `!setregexsettings` / `!setregexexempt`.\n\n"
+        "30. **!ruleinput regex|spam <rulename> raw|folded**\n"
+        "   - Description: Makes a rule match the message as sent (`raw`) or its normalized form (`folded`: no zero-width characters, NFKC, look-alike letters mapped to Latin).\n\n"
+        "31. **!regexstats [time|max|evals|matches|deletions|timeouts]**\n"
+        "   - Description: Shows per-rule evaluations, matches, deletions, timeouts and CPU time to find dead or expensive regex rules.\n\n"
+        "32. **!regexmodlog <#channel|off>**\n"
+        "   - Description: Sets the channel where regex notices (automatic rule quarantines) are posted.\n\n"
+        "33. **!regexenable <regexsettingsname>**\n"
+        "   - Description: Re-enables a regex rule that was quarantined for exceeding its CPU budget or timing out repeatedly.\n\n"
+        "34. **!regexengine <regexsettingsname> [default|re2|regex|re]**\n"
+        "   - Description: Shows or sets the regex engine a rule runs on. `re2` matches in linear time but lacks lookarounds and backreferences; "
+        "rules it cannot run fall back to `regex`/`re` automatically. `default` follows REGEX_DEFAULT_ENGINE.\n\n"
+        "35. **!regexscan <regexsettingsname> <#channel> [limit]**\n"
+        "   - Description: Scans up to `limit` past messages (default 1000) in a channel with one rule and deletes matches, "
+        "in bulk where messages are younger than 14 days. Pinned messages are kept.\n\n"
+        "36. **!spamhistory [sweep]**\n"
+        "   - Description: Shows how many users and messages the spam history holds and how many were evicted. "
+        "`sweep` drops idle users now instead of waiting for the background sweep.\n\n"
+        "37. **!securityhelp**\n"
         "   - Description: Shows this help menu.\n"
     )
     # Split into chunks to respect Discord 2000-char message limit
@@ -2519,11 +5584,28 @@ async def spamrule(ctx, rulename: str, *, rule_spec: str = ""):
             return
         mod_action = mod_action_token
 
-    # Check if using regex mode or similarity mode
+    # Check if using regex mode, cross-user mode or similarity mode
     regex_pattern_str: str | None = None
     compiled_regex: re.Pattern | None = None
+    cross_user = False
 
-    if parts and parts[0].lower() == "regex":
+    if parts and parts[0].lower() == "crossuser":
+        # CROSS-USER MODE: the same content from many different users
+        parts.pop(0)
+        cross_user = True
+        min_length = 0
+        similarity_threshold = 0.0
+        if parts:
+            length_match = re.fullmatch(r"characters\s*>\s*(\d+)", parts[0], flags=re.IGNORECASE)
+            if length_match:
+                parts.pop(0)
+                min_length = int(length_match.group(1))
+        if len(parts) < 3:
+            await ctx.send(
+                "Invalid format for cross-user mode. Expected `crossuser [characters>N] <duration> users>N dm \"text\" modlogchannel #channel`."
+            )
+            return
+    elif parts and parts[0].lower() == "regex":
         # REGEX MODE
         parts.pop(0)  # Remove "regex" keyword
         if not parts:
@@ -2591,10 +5673,16 @@ async def spamrule(ctx, rulename: str, *, rule_spec: str = ""):
         duration_display = f"{window_value}{window_unit}"
 
     message_token = parts.pop(0)
-    message_match = re.fullmatch(r"messages?\s*>\s*(\d+)", message_token, flags=re.IGNORECASE)
-    if not message_match:
-        await ctx.send("Specify message threshold like `message>3` or `messages>3`.")
-        return
+    if cross_user:
+        message_match = re.fullmatch(r"users?\s*>\s*(\d+)", message_token, flags=re.IGNORECASE)
+        if not message_match:
+            await ctx.send("Specify the user threshold like `users>5`.")
+            return
+    else:
+        message_match = re.fullmatch(r"messages?\s*>\s*(\d+)", message_token, flags=re.IGNORECASE)
+        if not message_match:
+            await ctx.send("Specify message threshold like `message>3` or `messages>3`.")
+            return
     message_count = int(message_match.group(1))
 
     KEYWORDS = {"modlogchannel", "channels", "allchannel", "notchannel", "nonreply", "roles", "allroles", "exemptroles"}
@@ -2814,27 +5902,37 @@ async def spamrule(ctx, rulename: str, *, rule_spec: str = ""):
     _reset_spam_history_for_rule(guild_id, name_key)
     await remove_spam_violation_stats_for_rule(guild_id, name_key)
 
-    guild_rules[name_key] = {
-        "label": label,
-        "min_length": max(0, min_length),
-        "similarity_threshold": similarity_threshold,
-        "time_window": max(0, time_window),
-        "message_count": max(0, message_count),
-        "dm_message": dm_message,
-        "notify_channel_id": notify_channel.id,
-        "channels": monitored_channels,
-        "excluded_channels": excluded_channels,
-        "targeted_roles": targeted_roles,
-        "exempted_roles": exempted_roles,
-        "nonreply_only": nonreply_only,
-        "mod_action": mod_action,
-        "regex_pattern": regex_pattern_str,  # None for similarity mode, pattern string for regex mode
-    }
+    previous_rule = guild_rules.get(name_key)
+    guild_rules[name_key] = _compile_spam_rule(
+        label=label,
+        min_length=min_length,
+        similarity_threshold=similarity_threshold,
+        time_window=time_window,
+        message_count=message_count,
+        dm_message=dm_message,
+        notify_channel_id=notify_channel.id,
+        channels=monitored_channels,
+        excluded_channels=excluded_channels,
+        targeted_roles=targeted_roles,
+        exempted_roles=exempted_roles,
+        nonreply_only=nonreply_only,
+        mod_action=mod_action,
+        regex_pattern=regex_pattern_str,  # None for similarity mode, pattern string for regex mode
+        compiled_regex=_acquire_compiled_pattern(regex_pattern_str, "i", "re", fallback=False) if regex_pattern_str else None,
+        input_mode=previous_rule.input if previous_rule else "raw",  # kept across redefinitions, see !ruleinput
+        cross_user=cross_user,
+    )
+    if previous_rule:
+        _release_compiled_pattern(previous_rule.compiled_regex)
+    _refresh_spam_rule_caches(guild_id)
 
     save_security_settings()
 
     details = [f"Spam rule `{label}` saved."]
-    if regex_pattern_str:
+    if cross_user:
+        details.append(f"- Mode: Cross-user (same content from > {message_count} users)")
+        details.append(f"- Min characters: {min_length}")
+    elif regex_pattern_str:
         details.append(f"- Mode: Regex")
         details.append(f"- Pattern: `{regex_pattern_str}`")
     else:
@@ -2843,7 +5941,7 @@ async def spamrule(ctx, rulename: str, *, rule_spec: str = ""):
         details.append(f"- Similarity: {similarity_threshold * 100:.0f}%")
     details.extend([
         f"- Window: {duration_display}",
-        f"- Message count: {message_count}",
+        f"- {'User' if cross_user else 'Message'} count: {message_count}",
         f"- Notify: {notify_channel.mention}",
     ])
     if mod_action:
@@ -2901,16 +5999,20 @@ async def removespamrule(ctx, rulename: str):
         return
 
     removed_rule = guild_rules.pop(name_key, None)
+    if removed_rule:
+        _release_compiled_pattern(removed_rule.compiled_regex)
     if not guild_rules:
         try:
             del spam_rules_by_guild[guild_id]
         except KeyError:
             pass
+    _refresh_spam_rule_caches(guild_id)
 
     # Clean trigger log entries for this rule in this guild
     keys_to_delete = [key for key in spam_rule_trigger_log if key[0] == guild_id and key[2] == name_key]
     for key in keys_to_delete:
         del spam_rule_trigger_log[key]
+    _forget_rule_runtime(guild_id, "spam", name_key)
 
     # Save settings after removal
     save_security_settings()
@@ -3019,7 +6121,10 @@ async def spamrules(ctx):
         )
 
         lines.append(f"\n**{label}** (`{name_key}`)")
-        if regex_pattern:
+        if rule.get("cross_user"):
+            lines.append(f"• Mode: Cross-user")
+            lines.append(f"• Min characters: {min_length}")
+        elif regex_pattern:
             lines.append(f"• Mode: Regex")
             lines.append(f"• Pattern: `{regex_pattern}`")
         else:
@@ -3027,7 +6132,7 @@ async def spamrules(ctx):
             lines.append(f"• Min characters: {min_length}")
             lines.append(f"• Similarity: {similarity:.0f}%")
         lines.extend([
-            f"• Threshold: {message_count} messages in {window}",
+            f"• Threshold: {message_count} {'users' if rule.get('cross_user') else 'messages'} in {window}",
             f"• Mod-log channel: {notify_text}",
             f"• Scope: {channels_text}",
             f"• Roles: {roles_text}",
@@ -3068,6 +6173,35 @@ async def spamrules(ctx):
     for chunk in messages:
         await ctx.send(chunk)
 
+# Show spam history memory usage
+@bot.command(name="spamhistory")
+async def spamhistory(ctx, action: str = None):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    store = spam_message_history
+    if action and action.lower() == "sweep":
+        dropped = store.sweep(time.time())
+        await ctx.send(f"✅ Spam history swept: {dropped} idle users dropped.")
+        return
+
+    guild_users = sum(1 for history_key in store if history_key[0] == ctx.guild.id)
+    idle_limit = store.idle_limit(ctx.guild.id)
+    lines = [
+        "**Spam History**",
+        f"Users: {len(store)} (this server: {guild_users}) | Entries: {store.entry_count}/{store.max_entries}",
+        f"Idle limit for this server: {idle_limit:g}s" + ("" if store.idle_ttl_seconds > 0 else " (longest rule window)"),
+        f"Expired entries: {store.expired_entries} | Idle users dropped: {store.idle_evictions} | "
+        f"Users evicted by the cap: {store.lru_evictions} | Entries trimmed by the cap: {store.trimmed_entries}",
+        f"Sweeps: {store.sweeps} every {SPAM_HISTORY_SWEEP_SECONDS:g}s | last took {store.last_sweep_seconds * 1000:.1f} ms",
+        f"Cross-user indexes (this server): "
+        + (", ".join(
+            f"`{key[1]}` {len(index)} messages / {len(index.buckets)} fingerprints"
+            for key, index in spam_crossuser_indexes.items() if key[0] == ctx.guild.id
+        ) or "none"),
+    ]
+    await ctx.send("\n".join(lines))
+
 # ---------------- Play Event Section ----------------
 def normalize_autosend_name(schedule_name: str) -> str:
     return (schedule_name or "").strip().lower()
@@ -4734,18 +7868,33 @@ async def define_regex(ctx, regexsettingsname: str, *, regexcommand: str = ""):
 
     # Accept extended syntaxes: /pattern/flags or plain pattern with optional --flags i m s x ...
     pattern_text, flags_letters = _parse_pattern_and_flags(regexcommand)
+    guild_id = ctx.guild.id
+    # Redefining a rule keeps its engine choice (see !regexengine)
+    engine_choice = regex_settings_by_guild.get(guild_id, {}).get(name_key, {}).get("engine", "default")
     try:
-        compiled = _compile_with_flags(pattern_text, flags_letters)
-    except re.error as e:
+        compiled = _acquire_compiled_pattern(pattern_text, flags_letters, engine_choice)
+    except (re.error, _REGEX_ENGINE.error) as e:
         await ctx.send(f"Invalid regex: {e}")
         return
-    guild_id = ctx.guild.id
+    profile_report = await _profile_regex_rule_for_commit(ctx, guild_id, compiled)
+    if profile_report is None:
+        _release_compiled_pattern(compiled)
+        return
     if guild_id not in regex_settings_by_guild:
         regex_settings_by_guild[guild_id] = {}
     settings = regex_settings_by_guild[guild_id].get(name_key, {"channels": set(), "exempt_users": set(), "exempt_roles": set()})
-    settings["pattern"] = regexcommand
+    for stale_key in ("kind", "domain_mode", "domains", "quarantined", "pattern", "pattern_ref", "pattern_length"):
+        settings.pop(stale_key, None)
+    settings.update(_regex_pattern_fields(regexcommand))
+    _release_compiled_pattern(settings.get("compiled"))
     settings["compiled"] = compiled
+    settings["engine"] = engine_choice
+    settings["literals"] = _interned_required_literals(compiled)
+    settings["profile"] = profile_report
     regex_settings_by_guild[guild_id][name_key] = settings
+    _invalidate_regex_rule_set(guild_id)
+    _forget_rule_runtime(guild_id, "regex", name_key)
+    _forget_regex_rule_counters(guild_id, name_key)
     save_settings()
 
     source_info = f"\nKaynak: {pattern_source}" if pattern_source else ""
@@ -4753,6 +7902,14 @@ async def define_regex(ctx, regexsettingsname: str, *, regexcommand: str = ""):
     # Pattern parcalama (4000 karakterden uzunsa)
     async def send_pattern_chunks(pattern: str, chunk_size: int = 4000):
         """Pattern'i parcalar halinde gonder"""
+        if settings.get("pattern_ref"):
+            # Large patterns live in the pattern store; echo a reference instead of dozens of chunks
+            preview = pattern[:300].replace("`", "'")
+            await ctx.send(
+                f"Pattern stored as `{settings['pattern_ref'][:19]}…` ({len(pattern)} chars)\n"
+                f"Preview: `{preview}…`"
+            )
+            return
         if len(pattern) <= chunk_size:
             await ctx.send(f"Pattern: `{pattern}`")
         else:
@@ -4766,17 +7923,75 @@ async def define_regex(ctx, regexsettingsname: str, *, regexcommand: str = ""):
         ch_mentions = ", ".join(f"<#{cid}>" for cid in settings["channels"])
         await ctx.send(
             f"Regex setting updated: `{regexsettingsname}`\n"
-            f"Engine: `{_REGEX_ENGINE_NAME}`  Flags: `{flags_letters or '-'}`{source_info}\n"
+            f"Engine: `{_describe_regex_rule_engine(settings)}`  Flags: `{flags_letters or '-'}`{source_info}\n"
             f"Applied channels: {ch_mentions}"
         )
         await send_pattern_chunks(regexcommand)
+        await ctx.send(_format_regex_profile_report(profile_report))
     else:
         await ctx.send(
             f"Regex setting saved: `{regexsettingsname}`\n"
-            f"Engine: `{_REGEX_ENGINE_NAME}`  Flags: `{flags_letters or '-'}`{source_info}\n"
+            f"Engine: `{_describe_regex_rule_engine(settings)}`  Flags: `{flags_letters or '-'}`{source_info}\n"
             f"No channels assigned yet. Use `!setregexsettings {regexsettingsname} <channels>` to assign."
         )
         await send_pattern_chunks(regexcommand)
+        await ctx.send(_format_regex_profile_report(profile_report))
+
+# Define a domain allow-list or block-list rule (same channels/exemptions as regex rules)
+@bot.command(name="domainlist")
+async def define_domain_list(ctx, regexsettingsname: str, mode: str, *, domains: str = ""):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+
+    mode = mode.strip().lower()
+    if mode not in DOMAIN_LIST_MODES:
+        await ctx.send("Mode must be `block` or `allow`. Usage: `!domainlist <name> block|allow <domains...>` (or attach a TXT file)")
+        return
+
+    name_key = regexsettingsname.strip().lower()
+    # Inline list may be wrapped in a code block; TXT attachments hold one domain per line
+    raw_domains = _extract_regex_from_codeblock(domains) or domains
+    for attachment in ctx.message.attachments:
+        if attachment.filename.lower().endswith('.txt'):
+            try:
+                content_bytes = await attachment.read()
+                raw_domains += "\n" + content_bytes.decode('utf-8')
+            except Exception as e:
+                await ctx.send(f"TXT dosyasi okunamadi: {e}")
+                return
+
+    parsed_domains, invalid = _parse_domain_list(raw_domains)
+    if not parsed_domains:
+        await ctx.send("No valid domains given. Example: `!domainlist scamlinks block steamcommunnity.com discord-nitro.gift`")
+        return
+
+    guild_id = ctx.guild.id
+    guild_rules = regex_settings_by_guild.setdefault(guild_id, {})
+    settings = guild_rules.get(name_key, {"channels": set(), "exempt_users": set(), "exempt_roles": set()})
+    _release_compiled_pattern(settings.get("compiled"))
+    for regex_key in ("compiled", "engine", "literals", "profile", "quarantined", "pattern_ref", "pattern_length"):
+        settings.pop(regex_key, None)
+    settings["kind"] = "domains"
+    settings["domain_mode"] = mode
+    settings["domains"] = frozenset(parsed_domains)
+    settings["pattern"] = ""
+    guild_rules[name_key] = settings
+    _invalidate_regex_rule_set(guild_id)
+    _forget_rule_runtime(guild_id, "regex", name_key)
+    _forget_regex_rule_counters(guild_id, name_key)
+    save_settings()
+
+    msg = f"Domain {mode}-list saved: `{regexsettingsname}` ({len(parsed_domains)} domains)"
+    if invalid:
+        shown = " ".join(invalid[:20])
+        more = f" (+{len(invalid) - 20} more)" if len(invalid) > 20 else ""
+        msg += f"\nIgnored/Invalid: {shown}{more}"
+    if settings["channels"]:
+        msg += f"\nApplied channels: {', '.join(f'<#{cid}>' for cid in settings['channels'])}"
+    else:
+        msg += f"\nNo channels assigned yet. Use `!setregexsettings {regexsettingsname} <channels>` to assign."
+    await _send_long_message(ctx.send, msg)
 
 # Assign channels to a regex rule
 @bot.command(name="setregexsettings")
@@ -4844,12 +8059,25 @@ async def set_regex_settings(ctx, regexsettingsname: str, *, channels: str):
         await ctx.send("Please specify valid channels. Examples: `!setregexsettings spamRule #general #chat` or `!setregexsettings spamRule allchannel notchannel #log #mod`")
         return
 
+    # Rules loaded from disk have not been profiled yet; do it before they go live
+    profile_report = guild_rules[name_key].get("profile")
+    if profile_report is None and guild_rules[name_key].get("compiled") is not None:
+        profile_report = await _profile_regex_rule_for_commit(ctx, guild_id, guild_rules[name_key]["compiled"])
+        if profile_report is None:
+            return
+        guild_rules[name_key]["profile"] = profile_report
+
+    previous_channels = guild_rules[name_key].get("channels", set())
     guild_rules[name_key]["channels"] = selected
+    _update_regex_channel_index(guild_id, name_key, previous_channels, selected)
+    _invalidate_regex_rule_set(guild_id)
     save_settings()
     ch_mentions = ", ".join(f"<#{cid}>" for cid in selected)
     msg = f"Applied channels updated for `{regexsettingsname}`: {ch_mentions}"
     if invalid:
         msg += f"\nIgnored/Invalid: {' '.join(invalid)}"
+    if profile_report is not None and profile_report.verdict not in {"ok", "disabled"}:
+        msg += f"\n{_format_regex_profile_report(profile_report)}"
     await ctx.send(msg)
 
 # Set exemptions (users or roles) for a regex rule
@@ -4903,6 +8131,7 @@ async def set_regex_exempt(ctx, regexsettingsname: str, kind: str, *, targets: s
         return
     if kind_l == "roles":
         guild_rules[name_key]["exempt_roles"] = selected
+        _invalidate_regex_rule_set(guild_id)
         save_settings()
         names = []
         for rid in selected:
@@ -4915,6 +8144,7 @@ async def set_regex_exempt(ctx, regexsettingsname: str, kind: str, *, targets: s
         msg = f"Exempt roles updated for `{regexsettingsname}`: {names_str}"
     else:
         guild_rules[name_key]["exempt_users"] = selected
+        _invalidate_regex_rule_set(guild_id)
         save_settings()
         names = []
         for uid in selected:
@@ -4974,16 +8204,21 @@ async def regexsettings(ctx, regexsettingsname: str = None):
         if not rule:
             await ctx.send("No regex setting found with the specified name.")
             return
-        pattern_text = rule.get("pattern", "-")
+        pattern_text = _describe_regex_rule_pattern(rule)
         
         channels = rule.get("channels", set())
         exempt_users = rule.get("exempt_users", set())
         exempt_roles = rule.get("exempt_roles", set())
-        status = "Active" if channels else "Inactive"
+        status = "Quarantined" if rule.get("quarantined") else ("Active" if channels else "Inactive")
 
         settings_text = f"**Regex Settings - {regexsettingsname}**\n\n"
         settings_text += f"**Status:** {status}\n"
         settings_text += f"**Pattern:** `{pattern_text}`\n"
+        settings_text += f"**Input:** {rule.get('input', 'raw')}\n"
+        if rule.get("kind") != "domains":
+            settings_text += f"**Engine:** {_describe_regex_rule_engine(rule)} (choice: {rule.get('engine', 'default')})\n"
+        if rule.get("quarantined"):
+            settings_text += f"**Quarantined:** {rule['quarantined'].get('reason', 'yes')} (re-enable with `!regexenable {name_key}`)\n"
         settings_text += f"**Applied Channels:** {_mentions_list(channels, 'channel')}\n"
         settings_text += f"**Exempt Users:** {_mentions_list(exempt_users, 'user')}\n"
         settings_text += f"**Exempt Roles:** {_mentions_list(exempt_roles, 'role')}\n"
@@ -5003,12 +8238,12 @@ async def regexsettings(ctx, regexsettingsname: str = None):
     # Build and send each rule separately if needed
     header_sent = False
     for name_key, rule in rules_list:
-        pattern_text = rule.get("pattern", "-")
+        pattern_text = _describe_regex_rule_pattern(rule)
 
         channels = rule.get("channels", set())
         exempt_users = rule.get("exempt_users", set())
         exempt_roles = rule.get("exempt_roles", set())
-        status = "Active" if channels else "Inactive"
+        status = "Quarantined" if rule.get("quarantined") else ("Active" if channels else "Inactive")
 
         channels_text = _mentions_list(channels, "channel")
         users_text = _mentions_list(exempt_users, "user")
@@ -5034,6 +8269,393 @@ async def regexsettings(ctx, regexsettingsname: str = None):
         for chunk in chunks:
             await ctx.send(chunk)
 
+# Show literal prefilter coverage and skip ratio
+@bot.command(name="regexprefilter")
+async def regexprefilter(ctx):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    guild_id = ctx.guild.id
+    guild_rules = regex_settings_by_guild.get(guild_id)
+    if not guild_rules:
+        await ctx.send("There are no regex settings defined in this server.")
+        return
+
+    stats = regex_prefilter_stats[guild_id]
+    messages = stats["messages"]
+    considered = stats["rules_considered"]
+    message_ratio = (stats["messages_skipped"] / messages * 100) if messages else 0.0
+    rule_ratio = (stats["rules_skipped"] / considered * 100) if considered else 0.0
+    engine_name = "pyahocorasick" if _ahocorasick_module is not None else "built-in"
+
+    lines = [
+        "**Regex Literal Prefilter**",
+        f"Automaton: {engine_name}",
+        f"Messages checked: {messages} | fully skipped: {stats['messages_skipped']} ({message_ratio:.1f}%)",
+        f"Rule evaluations skipped: {stats['rules_skipped']}/{considered} ({rule_ratio:.1f}%)",
+        "",
+    ]
+    for name_key, rule in guild_rules.items():
+        literals = rule.get("literals")
+        if rule.get("kind") == "domains":
+            lines.append(f"**{name_key}**: domain {_describe_regex_rule_pattern(rule)}, checked by host lookup")
+        elif literals:
+            sample = ", ".join(f"`{literal}`" for literal in sorted(literals)[:5])
+            more = f" (+{len(literals) - 5} more)" if len(literals) > 5 else ""
+            lines.append(f"**{name_key}**: {len(literals)} literal(s) - {sample}{more}")
+        else:
+            lines.append(f"**{name_key}**: no required literal, always evaluated")
+
+    await _send_long_message(ctx.send, "\n".join(lines))
+
+# Show regex verdict cache usage
+@bot.command(name="regexcache")
+async def regexcache(ctx, action: str = None):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    cache = _get_regex_verdict_cache(ctx.guild.id)
+    if action and action.lower() == "clear":
+        cache.clear()
+        await ctx.send("✅ Regex verdict cache cleared for this server.")
+        return
+
+    lookups = cache.lookups
+    hit_ratio = (cache.hits / lookups * 100) if lookups else 0.0
+    partial_ratio = (cache.partial_hits / lookups * 100) if lookups else 0.0
+    lines = [
+        "**Regex Verdict Cache**",
+        f"Entries: {len(cache)}/{cache.max_entries} | TTL: {cache.ttl_seconds:g}s | Rule set version: {regex_rule_set_versions[ctx.guild.id]}",
+        f"Lookups: {lookups}",
+        f"Full hits: {cache.hits} ({hit_ratio:.1f}%) | Partial hits: {cache.partial_hits} ({partial_ratio:.1f}%) | Misses: {cache.misses}",
+        f"Evictions: {cache.evictions}",
+        f"Edits checked: {regex_edit_scan_stats['edits']} | skipped as unchanged: {regex_edit_scan_stats['edits_skipped']}",
+        f"Shared compiled patterns (all servers): {len(regex_pattern_intern)} unique, "
+        f"{sum(entry[1] for entry in regex_pattern_intern.values())} references | "
+        f"compiled {regex_pattern_intern_stats['compiles']}, reused {regex_pattern_intern_stats['hits']}",
+    ]
+    await ctx.send("\n".join(lines))
+
+# Show the current rule evaluation plan
+@bot.command(name="ruleplan")
+async def ruleplan(ctx, channel_input: str = None):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    guild_id = ctx.guild.id
+    channel = None
+    if channel_input:
+        channel = resolve_text_channel(ctx.guild, channel_input)
+        if channel is None:
+            await ctx.send("Channel not found.")
+            return
+
+    lines = [f"**Rule Evaluation Plan**{f' for {channel.mention}' if channel else ''}"]
+
+    guild_rules = regex_settings_by_guild.get(guild_id, {})
+    if channel is not None:
+        routed_keys = regex_channel_index.get(guild_id, {}).get(channel.id, ())
+    else:
+        routed_keys = tuple(guild_rules)
+    regex_rules = [
+        (name_key, guild_rules[name_key]["compiled"])
+        for name_key in routed_keys
+        if guild_rules.get(name_key, {}).get("compiled")
+    ]
+    lines.append("__Regex__ (routing and exemptions → literal prefilter → units below, stop at first hit)")
+    if regex_rules:
+        matcher = _get_combined_regex_matcher(guild_id, regex_rules)
+        for position, unit in enumerate(_plan_regex_units(guild_id, matcher), start=1):
+            lines.append(f"{position}. {_describe_planned_unit(guild_id, 'regex', unit.key)}")
+    else:
+        lines.append("(no regex rules)")
+
+    spam_rules = spam_rules_by_guild.get(guild_id, {})
+    spam_keys = [
+        name_key for name_key, rule in spam_rules.items()
+        if channel is None
+        or (
+            channel.id not in rule.excluded_channels
+            and (not rule.channels or channel.id in rule.channels)
+        )
+    ]
+    lines.append("")
+    lines.append("__Spam__ (channel, role, reply and length checks → matchers below, all evaluated in rule order)")
+    if spam_keys:
+        for position, name_key in enumerate(spam_keys, start=1):
+            lines.append(f"{position}. {_describe_planned_unit(guild_id, 'spam', name_key)}")
+    else:
+        lines.append("(no spam rules)")
+
+    await _send_long_message(ctx.send, "\n".join(lines))
+
+# Choose whether a regex/domain or spam rule reads raw or normalized (folded) text
+@bot.command(name="ruleinput")
+async def ruleinput(ctx, rule_type: str, rulename: str, input_mode: str):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    rule_type = rule_type.strip().lower()
+    input_mode = input_mode.strip().lower()
+    if rule_type not in {"regex", "spam"} or input_mode not in RULE_INPUT_MODES:
+        await ctx.send(
+            "Usage: `!ruleinput regex|spam <rulename> raw|folded`\n"
+            "`folded` removes zero-width characters and combining marks, applies NFKC and maps look-alike letters (Cyrillic, Greek, small caps) to Latin before matching."
+        )
+        return
+
+    guild_id = ctx.guild.id
+    name_key = rulename.strip().lower()
+    rules = (regex_settings_by_guild if rule_type == "regex" else spam_rules_by_guild).get(guild_id, {})
+    rule = rules.get(name_key)
+    if rule is None:
+        await ctx.send(f"No {rule_type} rule found with that name.")
+        return
+
+    if rule_type == "regex":
+        rule["input"] = input_mode
+        _invalidate_regex_rule_set(guild_id)
+        save_settings()
+    else:
+        rules[name_key] = rule._replace(input=input_mode)
+        _refresh_spam_rule_caches(guild_id)
+        save_security_settings()
+    await ctx.send(f"✅ {rule_type.capitalize()} rule `{rulename}` now matches against **{input_mode}** text.")
+
+# Per-rule regex hit/latency report
+@bot.command(name="regexstats")
+async def regexstats(ctx, sort_by: str = "time"):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    guild_id = ctx.guild.id
+    guild_rules = regex_settings_by_guild.get(guild_id)
+    if not guild_rules:
+        await ctx.send("There are no regex settings defined in this server.")
+        return
+
+    sort_keys = {
+        "time": lambda counters: counters.total_time,
+        "max": lambda counters: counters.max_time,
+        "evals": lambda counters: counters.evaluations,
+        "matches": lambda counters: counters.matches,
+        "deletions": lambda counters: counters.deletions,
+        "timeouts": lambda counters: counters.timeouts,
+    }
+    sort_by = sort_by.strip().lower()
+    if sort_by not in sort_keys:
+        await ctx.send(f"Unknown sort key. Use one of: {', '.join(sort_keys)}")
+        return
+
+    guild_counters = regex_rule_counters.get(guild_id, {})
+    rows = [(name_key, guild_counters.get(name_key) or RegexRuleCounters()) for name_key in guild_rules]
+    rows.sort(key=lambda row: sort_keys[sort_by](row[1]), reverse=True)
+
+    lines = [
+        f"**Regex Rule Stats** (sorted by {sort_by}, since last restart or rule change)",
+        f"Evals, matches and times are from standalone runs; combined rules are sampled every "
+        f"{REGEX_STATS_SAMPLE_EVERY} scans of their shared alternation.",
+    ]
+    for name_key, counters in rows:
+        average_ms = (counters.total_time / counters.evaluations * 1000) if counters.evaluations else 0.0
+        notes = []
+        if guild_rules[name_key].get("quarantined"):
+            notes.append("⛔ quarantined")
+        elif not guild_rules[name_key].get("channels"):
+            notes.append("inactive")
+        elif (counters.evaluations or counters.combined_scans) and not (counters.matches or counters.combined_fires):
+            notes.append("no matches yet")
+        if counters.timeouts:
+            notes.append(f"⚠️ {counters.timeouts} timeouts")
+        note_text = f" - {', '.join(notes)}" if notes else ""
+        combined_text = ""
+        if counters.combined_scans:
+            combined_text = f" | combined: {counters.combined_scans} scans, fired {counters.combined_fires}"
+        lines.append(
+            f"**{name_key}**: {counters.evaluations} evals, {counters.matches} matches, {counters.deletions} deletions{combined_text} | "
+            f"total {counters.total_time * 1000:.1f} ms, avg {average_ms:.3f} ms, max {counters.max_time * 1000:.2f} ms | "
+            f"cache hits {counters.cache_hits}, prefilter skips {counters.prefilter_skips}{note_text}"
+        )
+
+    await _send_long_message(ctx.send, "\n".join(lines))
+
+# Set the channel that receives regex notices (quarantines)
+@bot.command(name="regexmodlog")
+async def regexmodlog(ctx, channel_input: str):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    if channel_input.strip().lower() == "off":
+        regex_modlog_channels.pop(ctx.guild.id, None)
+        save_settings()
+        await ctx.send("Regex mod-log channel cleared.")
+        return
+    channel = resolve_text_channel(ctx.guild, channel_input)
+    if channel is None:
+        await ctx.send("Channel not found. Usage: `!regexmodlog #channel` or `!regexmodlog off`")
+        return
+    regex_modlog_channels[ctx.guild.id] = channel.id
+    save_settings()
+    await ctx.send(f"Regex notices will be posted to {channel.mention}.")
+
+# Re-enable a quarantined regex rule
+@bot.command(name="regexenable")
+async def regexenable(ctx, regexsettingsname: str):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    guild_id = ctx.guild.id
+    name_key = regexsettingsname.strip().lower()
+    rule = regex_settings_by_guild.get(guild_id, {}).get(name_key)
+    if rule is None:
+        await ctx.send("No regex setting found with the specified name.")
+        return
+    if not rule.get("quarantined"):
+        await ctx.send(f"`{regexsettingsname}` is not quarantined.")
+        return
+    rule.pop("quarantined", None)
+    regex_rule_budgets.pop((guild_id, name_key), None)
+    _invalidate_regex_rule_set(guild_id)
+    save_settings()
+    await ctx.send(f"✅ Regex rule `{regexsettingsname}` re-enabled. It will be quarantined again if it exceeds its CPU budget.")
+
+# Show or change the engine a regex rule runs on
+@bot.command(name="regexengine")
+async def regexengine(ctx, regexsettingsname: str, engine: str = ""):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    guild_id = ctx.guild.id
+    name_key = regexsettingsname.strip().lower()
+    rule = regex_settings_by_guild.get(guild_id, {}).get(name_key)
+    if rule is None or rule.get("kind") == "domains":
+        await ctx.send("No regex setting found with the specified name.")
+        return
+    available = ", ".join(f"`{name}`" for name in REGEX_AVAILABLE_ENGINES)
+    engine = engine.strip().lower()
+    if not engine:
+        await ctx.send(
+            f"`{regexsettingsname}` runs on `{_describe_regex_rule_engine(rule)}` "
+            f"(choice: `{rule.get('engine', 'default')}`, server default: `{REGEX_DEFAULT_ENGINE}`).\n"
+            f"Available engines: {available}"
+        )
+        return
+    if engine not in REGEX_ENGINE_CHOICES:
+        await ctx.send(f"Engine must be one of: {', '.join(f'`{name}`' for name in REGEX_ENGINE_CHOICES)}")
+        return
+
+    try:
+        pattern_text, flags_letters = _parse_pattern_and_flags(_regex_rule_pattern_text(rule))
+        compiled = _acquire_compiled_pattern(pattern_text, flags_letters, engine)
+    except Exception as e:
+        await ctx.send(f"Could not compile `{regexsettingsname}` for `{engine}`: {e}")
+        return
+    # A backtracking fallback can behave very differently from the engine it replaces
+    profile_report = await _profile_regex_rule_for_commit(ctx, guild_id, compiled)
+    if profile_report is None:
+        _release_compiled_pattern(compiled)
+        return
+    _release_compiled_pattern(rule.get("compiled"))
+    rule["compiled"] = compiled
+    rule["engine"] = engine
+    rule["literals"] = _interned_required_literals(compiled)
+    rule["profile"] = profile_report
+    _invalidate_regex_rule_set(guild_id)
+    _forget_rule_runtime(guild_id, "regex", name_key)
+    _forget_regex_rule_counters(guild_id, name_key)
+    save_settings()
+
+    actual = _pattern_engine_name(compiled)
+    preferred = _regex_engine_fallbacks(engine)[0]
+    if actual != preferred:
+        await ctx.send(
+            f"⚠️ `{preferred}` cannot run `{regexsettingsname}` (unsupported syntax, flags or engine not installed); "
+            f"it falls back to `{actual}`."
+        )
+    else:
+        await ctx.send(f"✅ Regex rule `{regexsettingsname}` now runs on `{actual}`.")
+
+# Retroactively scan a channel's history with one regex rule and bulk-delete matches
+@bot.command(name="regexscan")
+async def regexscan(ctx, regexsettingsname: str, channel_input: str, limit: int = 1000):
+    if not is_security_authorized(ctx):
+        await ctx.message.delete()
+        return
+    guild_id = ctx.guild.id
+    name_key = regexsettingsname.strip().lower()
+    rule = regex_settings_by_guild.get(guild_id, {}).get(name_key)
+    if rule is None or (rule.get("kind") != "domains" and not rule.get("compiled")):
+        await ctx.send("No regex setting found with the specified name.")
+        return
+    if rule.get("quarantined"):
+        await ctx.send(f"`{regexsettingsname}` is quarantined. Fix it or use `!regexenable {name_key}` first.")
+        return
+    channel = resolve_text_channel(ctx.guild, channel_input)
+    if channel is None:
+        await ctx.send("Channel not found.")
+        return
+    if limit < 1:
+        await ctx.send("Limit must be a positive number of messages.")
+        return
+    limit = min(limit, REGEX_HISTORY_SCAN_MAX_MESSAGES)
+    if guild_id in regex_history_scans:
+        await ctx.send("A history scan is already running in this server. Wait for it to finish.")
+        return
+
+    regex_history_scans.add(guild_id)
+    status_message = await ctx.send(f"🔎 Scanning up to {limit} messages in {channel.mention} with `{regexsettingsname}`...")
+    skip_ids = {ctx.message.id, status_message.id}
+    scanned = matched = deleted = 0
+    pending = []
+    stop_reason = None
+    last_progress = time.monotonic()
+
+    def _progress_text(prefix: str) -> str:
+        return f"{prefix} `{regexsettingsname}` in {channel.mention}: scanned {scanned}, matched {matched}, deleted {deleted}"
+
+    try:
+        # history() pages through the channel 100 messages per API call, newest first
+        async for message in channel.history(limit=limit):
+            if regex_settings_by_guild.get(guild_id, {}).get(name_key) is not rule:
+                stop_reason = "the rule was changed or deleted during the scan"
+                break
+            if rule.get("quarantined"):
+                stop_reason = "the rule was quarantined for exceeding its CPU budget"
+                break
+            scanned += 1
+            if message.id in skip_ids or message.pinned:
+                continue
+            if bot.user and message.author.id == bot.user.id:
+                continue
+            if await _regex_rule_matches_message(guild_id, name_key, rule, message):
+                matched += 1
+                pending.append(message)
+            if len(pending) >= BULK_DELETE_BATCH:
+                deleted += await _bulk_delete_channel_messages(channel, pending)
+                pending = []
+            if time.monotonic() - last_progress >= REGEX_HISTORY_SCAN_PROGRESS_SECONDS:
+                last_progress = time.monotonic()
+                try:
+                    await status_message.edit(content=_progress_text("🔎 Scanning with"))
+                except discord.HTTPException:
+                    pass
+        if pending:
+            deleted += await _bulk_delete_channel_messages(channel, pending)
+    except discord.Forbidden:
+        stop_reason = "missing Read Message History or Manage Messages permission"
+    finally:
+        regex_history_scans.discard(guild_id)
+
+    if deleted:
+        _regex_rule_counters(guild_id, name_key).deletions += deleted
+    summary = _progress_text("⚠️ Scan stopped early for" if stop_reason else "✅ Scan finished for")
+    if stop_reason:
+        summary += f"\nReason: {stop_reason}"
+    try:
+        await status_message.edit(content=summary)
+    except discord.HTTPException:
+        await ctx.send(summary)
+
 # Delete a regex setting by name
 @bot.command(name="delregexsettings")
 async def delregexsettings(ctx, regexsettingsname: str):
@@ -5049,12 +8671,17 @@ async def delregexsettings(ctx, regexsettingsname: str):
     if name_key not in guild_rules:
         await ctx.send("No regex setting found with the specified name.")
         return
-    del guild_rules[name_key]
+    removed_rule = guild_rules.pop(name_key)
+    _release_compiled_pattern(removed_rule.get("compiled"))
     if not guild_rules:
         try:
             del regex_settings_by_guild[guild_id]
         except KeyError:
             pass
+    _update_regex_channel_index(guild_id, name_key, removed_rule.get("channels", set()), ())
+    _invalidate_regex_rule_set(guild_id)
+    _forget_rule_runtime(guild_id, "regex", name_key)
+    _forget_regex_rule_counters(guild_id, name_key)
     save_settings()
     await ctx.send(f"Regex setting deleted: `{regexsettingsname}`")
 
@@ -5073,6 +8700,7 @@ async def on_ready():
     except Exception:
         pass
     start_all_scheduled_message_tasks()
+    start_spam_history_sweeper()
     print(f"Logged in as {bot.user} (ID: {getattr(bot.user, 'id', '-')})")
     print("[SETTINGS] Bot ready with loaded settings")
 
@@ -5339,4 +8967,6 @@ bot_token = os.getenv("PLAYBOT")
 if not bot_token:
     bot_token = "BOTTOKENHERE"  # Fallback to hardcoded token if env var not set
 
-bot.run(bot_token)
+if __name__ == "__main__":
+    # Guarded so regex sandbox processes started with "spawn" do not launch a second bot
+    bot.run(bot_token)
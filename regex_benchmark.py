@@ -0,0 +1,158 @@
+"""Benchmark the bot's regex rules on every available regex engine.
+
+Loads the regex rules from the settings file, compiles each one on every engine
+(re2 when its bindings are installed, regex, re) without fallback, runs them
+against a message corpus and reports throughput, timeouts, rules the engine
+cannot run and verdicts that differ from the default engine.
+
+The stdlib re engine has no native timeout, so its jobs run in the bot's
+killable process sandbox to enforce --timeout. Throughput is based on the
+matching time each job reports, so the sandbox round trips are not counted.
+
+Usage:
+    python regex_benchmark.py [corpus] [--settings bot_settings.json] [--repeat 3] [--timeout 1.0]
+
+The corpus is a text file with one message per line, or a .jsonl file whose
+lines hold a "content" field. Without a corpus the profiler's sample messages
+are used.
+"""
+import argparse
+import asyncio
+import json
+from collections import defaultdict
+
+import bot as bot_module
+
+
+def load_corpus(path):
+    if not path:
+        return list(bot_module._REGEX_PROFILE_SAMPLE_MESSAGES)
+    messages = []
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                try:
+                    line = json.loads(line).get("content", "")
+                except (ValueError, AttributeError):
+                    continue
+            if line:
+                messages.append(line)
+    return messages
+
+
+def load_rules(settings_path):
+    """[(label, pattern text, flags letters, input mode)] for every regex rule in the settings file."""
+    bot_module.SETTINGS_FILE = settings_path
+    bot_module.load_settings()
+    rules = []
+    for guild_id, guild_rules in bot_module.regex_settings_by_guild.items():
+        for name_key, rule in guild_rules.items():
+            if rule.get("kind") == "domains":
+                continue
+            try:
+                source = bot_module._regex_rule_pattern_text(rule)
+            except Exception as exc:
+                print(f"Skipping {guild_id}/{name_key}: {exc}")
+                continue
+            pattern_text, flags_letters = bot_module._parse_pattern_and_flags(source)
+            rules.append((f"{guild_id}/{name_key}", pattern_text, flags_letters, rule.get("input", "raw")))
+    return rules
+
+
+async def run_engine(engine_name, rules, corpus_views, repeat, timeout):
+    """Time every rule this engine can compile over the corpus. Returns a result dict."""
+    compiled_rules = []
+    unsupported = []
+    for label, pattern_text, flags_letters, input_mode in rules:
+        try:
+            compiled = bot_module._compile_on_engine(
+                engine_name, pattern_text, bot_module._regex_flags_value(flags_letters)
+            )
+        except Exception as exc:
+            unsupported.append((label, str(exc)))
+            continue
+        compiled_rules.append((label, compiled, input_mode))
+
+    # Without a native timeout a runaway re match could only be stopped by killing its process
+    sandbox = bot_module.RegexProcessSandbox(1) if engine_name == "re" else None
+    rule_time = defaultdict(float)
+    verdicts = {}
+    timeouts = 0
+    try:
+        for _ in range(repeat):
+            for label, compiled, input_mode in compiled_rules:
+                for index, text in enumerate(corpus_views[input_mode]):
+                    texts = [text[:bot_module.REGEX_MAX_TEXT_LENGTH]]
+                    if sandbox is not None:
+                        result = await sandbox.run(compiled, texts, "any", timeout)
+                    else:
+                        result = bot_module._run_regex_job(compiled, texts, "any", timeout)
+                    timeouts += result.timed_out
+                    verdicts[(label, index)] = result.matched
+                    rule_time[label] += result.elapsed
+    finally:
+        if sandbox is not None:
+            sandbox.close()
+    elapsed = sum(rule_time.values())
+    return {
+        "rules": len(compiled_rules),
+        "unsupported": unsupported,
+        "elapsed": elapsed,
+        "timeouts": timeouts,
+        "matches": sum(verdicts.values()),
+        "verdicts": verdicts,
+        "rule_time": rule_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", nargs="?", help="messages, one per line (.txt) or {\"content\": ...} per line (.jsonl)")
+    parser.add_argument("--settings", default=bot_module.SETTINGS_FILE, help="settings file holding the regex rules")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus per engine")
+    parser.add_argument("--timeout", type=float, default=bot_module.REGEX_EVAL_TIMEOUT_SECONDS, help="per-match budget in seconds")
+    parser.add_argument("--top", type=int, default=5, help="slowest rules to list per engine")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    rules = load_rules(args.settings)
+    if not corpus or not rules:
+        print("Nothing to benchmark: need at least one message and one regex rule.")
+        return
+    corpus_views = {"raw": corpus, "folded": [bot_module._fold_message_text(text) for text in corpus]}
+    corpus_bytes = sum(len(text.encode("utf-8")) for text in corpus)
+    print(f"{len(rules)} rules, {len(corpus)} messages ({corpus_bytes / 1024:.1f} KiB), {args.repeat} passes")
+    print(f"Engines: {', '.join(bot_module.REGEX_AVAILABLE_ENGINES)} (default: {bot_module.REGEX_DEFAULT_ENGINE})\n")
+
+    results = {}
+    for engine_name in bot_module.REGEX_AVAILABLE_ENGINES:
+        results[engine_name] = asyncio.run(run_engine(engine_name, rules, corpus_views, args.repeat, args.timeout))
+
+    baseline = results[bot_module.REGEX_DEFAULT_ENGINE]["verdicts"]
+    print(f"{'engine':<8}{'rules':>7}{'msgs/s':>12}{'MiB/s':>9}{'matches':>9}{'timeouts':>10}{'differs':>9}")
+    for engine_name, result in results.items():
+        scanned = len(corpus) * args.repeat
+        elapsed = max(result["elapsed"], 1e-9)
+        differs = sum(
+            1 for key, matched in result["verdicts"].items() if key in baseline and baseline[key] != matched
+        )
+        print(
+            f"{engine_name:<8}{result['rules']:>7}{scanned / elapsed:>12.0f}"
+            f"{corpus_bytes * args.repeat / elapsed / 1048576:>9.2f}{result['matches']:>9}"
+            f"{result['timeouts']:>10}{differs:>9}"
+        )
+
+    for engine_name, result in results.items():
+        print(f"\n[{engine_name}] slowest rules:")
+        slowest = sorted(result["rule_time"].items(), key=lambda item: item[1], reverse=True)[:args.top]
+        for label, seconds in slowest:
+            print(f"  {label}: {seconds * 1000 / args.repeat:.2f} ms per pass")
+        for label, reason in result["unsupported"]:
+            print(f"  unsupported {label}: {reason}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Similarity-mode spam rules must trigger exactly like max(SequenceMatcher ratio, token Jaccard)."""
+import asyncio
+import random
+import sys
+import types
+from collections import Counter
+from difflib import SequenceMatcher
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import bot  # noqa: E402
+
+VOCAB = "gift gg click now your free nitro steam claim here link win prize join server hey hi lol ok".split()
+GUILD_ID = 1
+CHANNEL_ID = 10
+
+
+def reference_similarity(left: str, right: str) -> float:
+    """The rule's metric as originally defined: full SequenceMatcher ratio or multiset token Jaccard."""
+    char_ratio = SequenceMatcher(None, left, right).ratio() if right else 0.0
+    left_tokens, right_tokens = Counter(bot._extract_word_tokens(left)), Counter(bot._extract_word_tokens(right))
+    if not left_tokens or not right_tokens:
+        return char_ratio
+    intersection = sum((left_tokens & right_tokens).values())
+    union = sum((left_tokens | right_tokens).values())
+    return max(char_ratio, intersection / union)
+
+
+def near_duplicate_stream(rng: random.Random, length: int) -> list:
+    """Messages that keep mutating one template a word at a time, with an occasional fresh one."""
+    words = [rng.choice(VOCAB) for _ in range(rng.randint(1, 6))]
+    stream = []
+    for _ in range(length):
+        if rng.random() < 0.15:
+            words = [rng.choice(VOCAB) for _ in range(rng.randint(1, 6))]
+        variant = list(words)
+        for _ in range(rng.randint(0, 2)):
+            operation = rng.random()
+            if operation < 0.4:
+                variant.insert(rng.randint(0, len(variant)), rng.choice(VOCAB))
+            elif operation < 0.7 and len(variant) > 1:
+                variant.pop(rng.randrange(len(variant)))
+            else:
+                rng.shuffle(variant)
+        stream.append(" ".join(variant))
+    return stream
+
+
+def replay(stream: list, rule, user_id: int) -> list:
+    """Feed stream through the bot's similarity matcher; returns one trigger verdict per message."""
+    message = types.SimpleNamespace(
+        guild=types.SimpleNamespace(id=GUILD_ID),
+        author=types.SimpleNamespace(id=user_id),
+        channel=types.SimpleNamespace(id=CHANNEL_ID),
+    )
+    history_key = (GUILD_ID, user_id)
+    verdicts = []
+
+    async def run():
+        for position, content in enumerate(stream):
+            now = 1000.0 + position
+            entry = bot.SpamHistoryEntry(now, content, False, CHANNEL_ID)
+            history = bot.spam_message_history.record(history_key, entry, rule.time_window)
+            verdicts.append(await bot._evaluate_spam_rule_matcher(message, "similar", rule, None, history, entry, now))
+
+    asyncio.run(run())
+    return verdicts
+
+
+def reference_replay(stream: list, rule) -> list:
+    verdicts = []
+    for position, content in enumerate(stream):
+        window = [
+            earlier for offset, earlier in enumerate(stream[:position + 1])
+            if position - offset <= rule.time_window
+        ]
+        similar = sum(1 for earlier in window if reference_similarity(content, earlier) >= rule.similarity_threshold)
+        verdicts.append(similar > rule.message_count)
+    return verdicts
+
+
+def make_rule(threshold: float, message_count: int = 3, time_window: int = 30):
+    return bot._compile_spam_rule(
+        label="similar",
+        min_length=0,
+        similarity_threshold=threshold,
+        time_window=time_window,
+        message_count=message_count,
+        dm_message="",
+        notify_channel_id=None,
+    )
+
+
+@pytest.mark.parametrize("left, right", [("gift", "gift gg"), ("click now your", "click now gift your")])
+def test_entries_similar_matches_reference_on_near_duplicates(left, right):
+    exact = reference_similarity(left, right)
+    counts = bot.SpamHistoryEntry(0.0, left, False, None).view("raw")[1]
+    other_counts = bot.SpamHistoryEntry(0.0, right, False, None).view("raw")[1]
+    for threshold in (0.3, 0.5, 0.7, 0.8, exact, exact + 0.01):
+        assert bot._spam_entries_similar(left, counts, right, other_counts, threshold) == (exact >= threshold)
+
+
+@pytest.mark.parametrize("threshold", [0.3, 0.5, 0.7, 0.8])
+@pytest.mark.parametrize("seed", range(3))
+def test_similarity_triggers_match_reference(threshold, seed):
+    rule = make_rule(threshold)
+    stream = near_duplicate_stream(random.Random(seed), 300)
+    user_id = 1000 + seed * 10 + int(threshold * 10)
+    assert replay(stream, rule, user_id) == reference_replay(stream, rule)